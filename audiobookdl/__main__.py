@@ -4,11 +4,14 @@ from .utils.audiobook import Audiobook, Series
 from .output.download import download
 from .sources import find_compatible_source
 from .config import load_config, Config, SourceConfig
+from .utils import retry, ratelimit
+from .utils.quality import Quality, parse_quality
 
 import os
 import sys
+import copy
 from rich.prompt import Prompt
-from typing import List, Optional, Union
+from typing import List, Optional, Type, Union
 
 
 def main() -> None:
@@ -35,6 +38,8 @@ def main() -> None:
             e.print()
             if logging.debug_mode:
                 logging.print_traceback()
+    if retry.stats.total > 0:
+        logging.debug(f"Retried {retry.stats.total} requests: {retry.stats.summary()}")
 
 
 def process_url(url: str, options, config: Config):
@@ -50,6 +55,7 @@ def process_url(url: str, options, config: Config):
         url = f"https://{url}"
     logging.log("Finding compatible source")
     source_class = find_compatible_source(url)
+    options = get_source_options(options, source_class, config)
     source = source_class(options)
     if source.requires_authentication and not source.authenticated:
         authenticate(url, source, options, config)
@@ -73,6 +79,39 @@ def process_url(url: str, options, config: Config):
                 continue
 
 
+def get_source_options(options, source_class: Type[Source], config: Config):
+    """
+    Create a copy of the cli options with source specific settings applied.
+    Cli options take priority over the config file, which takes priority over
+    the defaults of the source.
+
+    :param options: Cli options
+    :param source_class: Source the options are used for
+    :param config: Configuration file options
+    :returns: Cli options for source
+    """
+    source_options = copy.copy(options)
+    source_config = config.sources.get(source_class.names[0].lower())
+    source_options.split = options.split \
+        or getattr(source_config, "split", None) \
+        or source_class.split
+    source_options.connections = options.connections \
+        or getattr(source_config, "connections", None) \
+        or source_class.connections
+    source_options.http2 = next(
+        value for value in [options.http2, getattr(source_config, "http2", None), source_class.http2]
+        if value is not None
+    )
+    for key in ["limit_rate", "limit_burst"]:
+        value = getattr(options, key) or getattr(source_config, key, None)
+        setattr(source_options, key, ratelimit.parse_size(value) if value else None)
+    config_quality = getattr(source_config, "quality", None)
+    source_options.quality = options.quality \
+        or (parse_quality(config_quality) if config_quality else None) \
+        or Quality()
+    return source_options
+
+
 def get_cookie_path(options, config: Optional[SourceConfig]) -> Optional[str]:
     """
     Find path to cookie file. The cookie files a looked for in cli arguments
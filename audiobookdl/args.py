@@ -2,6 +2,9 @@ import argparse
 import os
 import appdirs
 from audiobookdl import __version__
+from audiobookdl.utils.ratelimit import parse_size
+from audiobookdl.utils.quality import parse_quality
+from audiobookdl.output.chapters import parse_chapter_selection
 from typing import Any, List
 
 
@@ -60,6 +63,12 @@ def parse_arguments() -> Any:
         help="Quiet mode",
         action="store_true",
     )
+    parser.add_argument(
+        '--progress-json',
+        dest="progress_json",
+        help="Print download progress as json lines",
+        action="store_true",
+    )
     parser.add_argument(
         '--print-output',
         dest="print_output",
@@ -138,6 +147,102 @@ def parse_arguments() -> Any:
         dest = "ebook",
         help = "Download ebook instead of audiobook (only for storytel)"
     )
+    parser.add_argument(
+        '--split',
+        dest = "split",
+        help = "Download single files in this many parts at the same time (if supported by the server)",
+        type = int,
+    )
+    parser.add_argument(
+        '--connections',
+        dest = "connections",
+        help = "Max number of connections to each host",
+        type = int,
+    )
+    parser.add_argument(
+        '--retries',
+        dest = "retries",
+        help = "Number of times failed requests are retried (default: %(default)s)",
+        type = int,
+        default = 3,
+    )
+    parser.add_argument(
+        '--timeout',
+        dest = "timeout",
+        help = "Seconds to wait for data from the server before a download is retried (default: %(default)s)",
+        type = float,
+        default = 30,
+    )
+    parser.add_argument(
+        '--hedge-percentile',
+        dest = "hedge_percentile",
+        help = "Start a duplicate download of files slower than this percentile of the other files. 0 disables hedging (default: %(default)s)",
+        type = float,
+        default = 95,
+    )
+    parser.add_argument(
+        '--limit-rate',
+        dest = "limit_rate",
+        help = "Max download speed in bytes per second shared by all downloads. Accepts suffixes K, M and G (example: 20M)",
+        type = parse_size,
+    )
+    parser.add_argument(
+        '--limit-burst',
+        dest = "limit_burst",
+        help = "Max bytes downloaded at full speed before the rate limit applies (default: one second of traffic)",
+        type = parse_size,
+    )
+    parser.add_argument(
+        '--coalesce-size',
+        dest = "coalesce_size",
+        help = "Max size of a request when adjacent byte ranges of a stream are downloaded together (default: 4M)",
+        type = parse_size,
+        default = 4 * 1024 * 1024,
+    )
+    parser.add_argument(
+        '--http2',
+        dest = "http2",
+        help = "Multiplex requests over HTTP/2 connections when the server supports it. Requires httpx[http2] (default: depends on source)",
+        action = argparse.BooleanOptionalAction,
+        default = None,
+    )
+    parser.add_argument(
+        '--quality',
+        dest = "quality",
+        help = "Bitrate of streams with multiple variants: best, worst or a max bitrate like <=128k (default: best)",
+        type = parse_quality,
+    )
+    parser.add_argument(
+        '--chapters',
+        dest = "chapters",
+        help = "Only download these chapters. Accepts chapter numbers and ranges (example: 1-3,10)",
+        type = parse_chapter_selection,
+    )
+    parser.add_argument(
+        '--plan-only',
+        dest = "plan_only",
+        help = "Print the files that would be downloaded with their sizes as json without downloading them",
+        action = "store_true",
+    )
+    parser.add_argument(
+        '--stream-convert',
+        dest = "stream_convert",
+        help = "Convert to the output format while downloading by piping the downloaded audio into ffmpeg. Only used for streams and files that ffmpeg can read from a pipe (mp3, aac and ts)",
+        action = "store_true",
+    )
+    parser.add_argument(
+        '--engine',
+        dest = "engine",
+        help = "Download files with threads or with asyncio. The async engine requires aiohttp and is faster for books with many small files (default: %(default)s)",
+        choices = ["thread", "async"],
+        default = "thread",
+    )
+    parser.add_argument(
+        '--resume',
+        dest = "resume",
+        help = "Keep partially downloaded files and continue downloading them on the next run",
+        action = "store_true",
+    )
     parser.add_argument(
         '--generate_cue',
         '-gc',
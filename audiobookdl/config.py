@@ -1,7 +1,7 @@
 from audiobookdl.exceptions import ConfigNotFound
 from attrs import define, Factory
 
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 import tomli
 import appdirs
@@ -15,6 +15,12 @@ class SourceConfig:
     password: Optional[str]
     library: Optional[str]
     cookie_file: Optional[str]
+    split: Optional[int]
+    connections: Optional[int]
+    limit_rate: Optional[Union[str, int]]
+    limit_burst: Optional[Union[str, int]]
+    http2: Optional[bool]
+    quality: Optional[str]
 
 
 @define
@@ -96,7 +102,13 @@ def structure_config(config_location: str, config_dict: dict) -> Config:
                 username = values.get("username"),
                 password = values.get("password"),
                 library = values.get("library"),
-                cookie_file = cookie_file
+                cookie_file = cookie_file,
+                split = values.get("split"),
+                connections = values.get("connections"),
+                limit_rate = values.get("limit_rate"),
+                limit_burst = values.get("limit_burst"),
+                http2 = values.get("http2"),
+                quality = values.get("quality"),
             )
     # Create config object
     return Config(
@@ -19,6 +19,9 @@ class DataNotPresent(AudiobookDLException):
 class FailedCombining(AudiobookDLException):
     error_description = "failed_combining"
 
+class FailedConversion(AudiobookDLException):
+    error_description = "failed_conversion"
+
 class MissingDependency(AudiobookDLException):
     error_description = "missing_dependency"
 
@@ -63,4 +66,13 @@ class GenericAudiobookDLException(AudiobookDLException):
         self.data = {'heading': heading, 'body': body if body else ""}
 
 class DownloadError(AudiobookDLException):
-    error_description: str = "download_error"
\ No newline at end of file
+    error_description: str = "download_error"
+
+class DownloadStalled(AudiobookDLException):
+    error_description: str = "download_stalled"
+
+class ChapterNotFound(AudiobookDLException):
+    error_description: str = "chapter_not_found"
+
+class NotEnoughSpace(AudiobookDLException):
+    error_description: str = "not_enough_space"
@@ -0,0 +1,67 @@
+import threading
+from typing import BinaryIO, Dict, Optional
+
+
+class AssemblyAborted(Exception):
+    """Raised in download threads when another segment has failed"""
+
+
+class SegmentAssembler:
+    """
+    Writes segments of a stream that are downloaded out of order to a single
+    output in order.
+
+    Segments are kept in memory until all earlier segments have been
+    written. Downloads more than `window` segments ahead of the next
+    unwritten segment have to wait, which bounds the memory used.
+    """
+
+    def __init__(self, output: BinaryIO, window: int):
+        self.output = output
+        self.window = window
+        # Index of the next segment to write
+        self.next_index = 0
+        self.pending: Dict[int, bytes] = {}
+        self.error: Optional[Exception] = None
+        self._condition = threading.Condition()
+
+
+    def wait_for_turn(self, index: int) -> None:
+        """
+        Wait until segment `index` is allowed to be downloaded
+
+        :param index: Index of segment
+        :raises AssemblyAborted: If another segment has failed
+        """
+        with self._condition:
+            while index >= self.next_index + self.window and self.error is None:
+                self._condition.wait()
+            if self.error is not None:
+                raise AssemblyAborted
+
+
+    def put(self, index: int, data: bytes) -> None:
+        """
+        Add downloaded segment and write all segments that are now in order
+
+        :param index: Index of segment
+        :param data: Content of segment
+        :raises AssemblyAborted: If another segment has failed
+        """
+        with self._condition:
+            if self.error is not None:
+                raise AssemblyAborted
+            self.pending[index] = data
+            while self.next_index in self.pending:
+                self.output.write(self.pending.pop(self.next_index))
+                self.next_index += 1
+            self._condition.notify_all()
+
+
+    def abort(self, error: Exception) -> None:
+        """Stop assembly after segment failed with `error`"""
+        with self._condition:
+            if self.error is None:
+                self.error = error
+            self.pending.clear()
+            self._condition.notify_all()
@@ -0,0 +1,300 @@
+from audiobookdl import Audiobook, AudiobookFile, Chapter, logging
+from audiobookdl.exceptions import ChapterNotFound
+from audiobookdl.utils import mp3, retry
+
+import re
+from attrs import define
+from typing import List, Optional, Sequence, Set, Tuple
+
+# Number of bytes downloaded from the start of mp3 files to find the first
+# audio frame
+MP3_PROBE_SIZE = 64 * 1024
+# Number of bytes downloaded at a cut to find the next frame
+MP3_RESYNC_SIZE = 8 * 1024
+# Seconds to wait for the probe request
+PROBE_TIMEOUT = 30
+
+# Start and end of part of a book in milliseconds
+Interval = Tuple[float, float]
+
+
+def parse_chapter_selection(value: str) -> List[int]:
+    """
+    Parse chapter selection
+
+    :param value: Comma separated chapter numbers and ranges (example: `1-3,10`)
+    :returns: Sorted chapter numbers starting from 1
+    :raises ValueError: If the value is not a valid selection
+    """
+    numbers: Set[int] = set()
+    for part in value.split(","):
+        match = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", part)
+        if match is None:
+            raise ValueError(f"Invalid chapter selection: {value}")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid chapter range: {part.strip()}")
+        numbers.update(range(first, last + 1))
+    return sorted(numbers)
+
+
+@define
+class Mp3Layout:
+    """Position of audio data in an mp3 file used to map time to bytes"""
+    # First byte of audio frames
+    audio_start: int
+    # Start of the frame byte positions in `toc` are relative to
+    toc_start: int
+    # Number of bytes `toc` covers
+    toc_size: int
+    # Total size of file
+    total_size: int
+    # Duration of file in milliseconds
+    duration: float
+    # Seek table of Xing header
+    toc: Optional[List[int]] = None
+    # Average size of frames in CBR files
+    frame_size: Optional[float] = None
+
+    def position(self, time: float) -> int:
+        """
+        Estimate byte position of `time`. The position is close to a frame
+        boundary, but has to be moved to the next frame header to cut there.
+
+        :param time: Time in milliseconds
+        :returns: Position in file
+        """
+        if time >= self.duration:
+            return self.total_size
+        percent = max(0.0, time / self.duration * 100)
+        if self.toc:
+            index = min(int(percent), mp3.XING_TOC_SIZE - 1)
+            lower = self.toc[index]
+            upper = self.toc[index + 1] if index + 1 < mp3.XING_TOC_SIZE else 256
+            fraction = (lower + (upper - lower) * (percent - index)) / 256
+        else:
+            fraction = percent / 100
+        position = max(self.audio_start, self.toc_start + int(fraction * self.toc_size))
+        if self.frame_size:
+            # Padded frames are a byte larger, so frames don't have a fixed size
+            index = int((position - self.audio_start) / self.frame_size)
+            position = self.audio_start + int(index * self.frame_size)
+        return position
+
+
+def select_chapters(audiobook: Audiobook, selection: Sequence[int], options) -> None:
+    """
+    Remove the files of `audiobook` that are not needed for the selected
+    chapters and move the chapters to their place in the trimmed book.
+    Files are selected by their duration, by matching them with chapters or,
+    for a single mp3 file, replaced with byte ranges of the selected chapters.
+
+    :param audiobook: Audiobook to trim
+    :param selection: Chapter numbers starting from 1
+    :param options: Cli options
+    """
+    chapters = audiobook.chapters
+    missing = [number for number in selection if number > len(chapters)]
+    if missing:
+        raise ChapterNotFound(chapter=missing[0], chapters=len(chapters))
+    files = audiobook.files
+    if all(file.duration for file in files):
+        durations: List[float] = [file.duration for file in files] # type: ignore[misc]
+    elif len(files) == len(chapters) and len(files) > 1:
+        logging.debug("Matching each file with a chapter")
+        ends = [chapter.start for chapter in chapters[1:]]
+        durations = [end - chapter.start for chapter, end in zip(chapters, ends)]
+        # The duration of the last file is not needed to select it
+        durations.append(float("inf"))
+    elif len(files) == 1 and files[0].ext == "mp3" and not files[0].encryption_method and not files[0].byte_range:
+        select_mp3_chapters(audiobook, selection, options)
+        return
+    else:
+        logging.log("Could not map chapters to the files of the book, downloading all chapters")
+        return
+    intervals = chapter_intervals(chapters, selection, sum(durations))
+    kept_files: List[AudiobookFile] = []
+    kept_intervals: List[Interval] = []
+    start = 0.0
+    for file, duration in zip(files, durations):
+        end = start + duration
+        if any(first < end and last > start for first, last in intervals):
+            kept_files.append(file)
+            kept_intervals.append((start, end))
+        start = end
+    logging.debug(f"Downloading {len(kept_files)} of {len(files)} files")
+    audiobook.files = kept_files
+    audiobook.chapters = remap_chapters(chapters, selection, kept_intervals)
+
+
+def select_mp3_chapters(audiobook: Audiobook, selection: Sequence[int], options) -> None:
+    """Replace single mp3 file of `audiobook` with byte ranges of the selected chapters"""
+    file = audiobook.files[0]
+    layout = probe_mp3(audiobook, file, options)
+    if layout is None:
+        logging.log("Could not find the bitrate of the book, downloading all chapters")
+        return
+    intervals = merge_intervals(chapter_intervals(audiobook.chapters, selection, layout.duration))
+    files = []
+    for start, end in intervals:
+        files.append(AudiobookFile(
+            url = file.url,
+            ext = file.ext,
+            headers = file.headers,
+            segment = True,
+            byte_range = (
+                frame_position(audiobook, file, layout, start, options),
+                frame_position(audiobook, file, layout, end, options) - 1,
+            ),
+            duration = end - start,
+        ))
+    logging.debug(f"Downloading byte ranges {[file.byte_range for file in files]} of {layout.total_size} bytes")
+    audiobook.chapters = remap_chapters(audiobook.chapters, selection, intervals)
+    audiobook.files = files
+
+
+def probe_mp3(audiobook: Audiobook, file: AudiobookFile, options) -> Optional[Mp3Layout]:
+    """
+    Find the position of the audio frames and the duration of an mp3 file
+    by downloading the start of the file
+
+    :returns: Layout of the file or `None` if it could not be found
+    """
+    data, total_size = fetch_range(audiobook, file, 0, MP3_PROBE_SIZE, options)
+    if data is None or total_size is None:
+        return None
+    tag_size = mp3.id3v2_size(data)
+    if tag_size + 4 > len(data):
+        # Covers can make the tag larger than the probe
+        data, _ = fetch_range(audiobook, file, tag_size, MP3_PROBE_SIZE, options)
+        if data is None:
+            return None
+        data_offset, search_offset = tag_size, 0
+    else:
+        data_offset, search_offset = 0, tag_size
+    frame_position = mp3.find_first_frame(data, search_offset)
+    if frame_position is None:
+        return None
+    header = mp3.parse_frame_header(data, frame_position)
+    if header is None:
+        return None
+    frame_start = data_offset + frame_position
+    xing = mp3.parse_xing_header(data, frame_position, header)
+    if xing is None:
+        # Without a Xing header the bitrate of the first frame is used
+        audio_size = total_size - frame_start
+        return Mp3Layout(
+            audio_start = frame_start,
+            toc_start = frame_start,
+            toc_size = audio_size,
+            total_size = total_size,
+            duration = audio_size * 8 / header.bitrate * 1000,
+            frame_size = header.average_size,
+        )
+    audio_start = frame_start + header.size
+    toc_size = xing.size or total_size - frame_start
+    if xing.frames:
+        duration = xing.frames * header.duration
+    else:
+        duration = (total_size - audio_start) * 8 / header.bitrate * 1000
+    return Mp3Layout(
+        audio_start = audio_start,
+        toc_start = frame_start,
+        toc_size = toc_size,
+        total_size = total_size,
+        duration = duration,
+        toc = xing.toc,
+        frame_size = None if xing.vbr else header.average_size,
+    )
+
+
+def frame_position(audiobook: Audiobook, file: AudiobookFile, layout: Mp3Layout, time: float, options) -> int:
+    """
+    Find the first frame at or after the estimated position of `time`, so
+    selected chapters are cut at frame boundaries
+
+    :returns: Position of frame, or the estimate if no frame was found
+    """
+    position = layout.position(time)
+    if position <= layout.audio_start or position >= layout.total_size:
+        return position
+    data, _ = fetch_range(audiobook, file, position, MP3_RESYNC_SIZE, options)
+    if data is None:
+        return position
+    offset = mp3.find_first_frame(data)
+    return position if offset is None else position + offset
+
+
+def fetch_range(audiobook: Audiobook, file: AudiobookFile, start: int, size: int, options) -> Tuple[Optional[bytes], Optional[int]]:
+    """
+    Download part of a file. The body is only read if the server answers
+    with the requested range, so servers without byte range support don't
+    send the whole file.
+
+    :returns: Content and total size of file, or `None` if the server does
+    not support byte ranges
+    """
+    retry_policy = retry.RetryPolicy(retries=options.retries)
+    response = retry_policy.call(lambda: audiobook.session.get(
+        file.url,
+        headers = {**file.headers, "Range": f"bytes={start}-{start + size - 1}"},
+        stream = True,
+        timeout = PROBE_TIMEOUT,
+    ))
+    with response:
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        if response.status_code != 206 or not total.isdigit():
+            return None, None
+        response.raw.decode_content = True
+        return response.raw.read(size), int(total)
+
+
+def chapter_intervals(chapters: Sequence[Chapter], selection: Sequence[int], duration: float) -> List[Interval]:
+    """
+    Find start and end of selected chapters
+
+    :param chapters: All chapters of book
+    :param selection: Chapter numbers starting from 1
+    :param duration: Duration of book in milliseconds
+    :returns: Start and end of each selected chapter in milliseconds
+    """
+    intervals: List[Interval] = []
+    for number in selection:
+        start = chapters[number-1].start
+        end = chapters[number].start if number < len(chapters) else duration
+        intervals.append((start, end))
+    return intervals
+
+
+def merge_intervals(intervals: Sequence[Interval]) -> List[Interval]:
+    """Merge sorted intervals that follow each other"""
+    merged: List[Interval] = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def remap_chapters(chapters: Sequence[Chapter], selection: Sequence[int], kept: Sequence[Interval]) -> List[Chapter]:
+    """
+    Move selected chapters to their place in a trimmed book
+
+    :param chapters: All chapters of book
+    :param selection: Chapter numbers starting from 1
+    :param kept: Parts of the book that are kept, in order
+    :returns: Chapters of trimmed book
+    """
+    result = []
+    for number in selection:
+        chapter = chapters[number-1]
+        offset = 0.0
+        for start, end in kept:
+            if start <= chapter.start < end:
+                result.append(Chapter(start = round(offset + chapter.start - start), title = chapter.title))
+                break
+            offset += end - start
+    return result
@@ -0,0 +1,173 @@
+from audiobookdl import logging
+from attrs import define
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# Concurrency used for hosts without learned settings
+INITIAL_CONCURRENCY = 8
+# Added to the concurrency when throughput improves
+CONCURRENCY_INCREASE = 1
+# Multiplied with the concurrency on errors
+ERROR_DECREASE = 0.5
+# Multiplied with the concurrency when throughput drops
+SLOWDOWN_DECREASE = 0.75
+# Relative change in throughput that counts as an improvement or slowdown
+THROUGHPUT_THRESHOLD = 0.1
+# Name of file in database directory where learned settings are stored
+CONCURRENCY_FILENAME = "concurrency.json"
+
+
+@define
+class HostState:
+    # Current number of allowed concurrent downloads
+    limit: float
+    # Number of running downloads
+    active: int = 0
+    # Measurements since the last adjustment
+    window_start: float = 0
+    window_bytes: int = 0
+    window_downloads: int = 0
+    window_latency: float = 0
+    # Throughput in the previous window in bytes per second
+    throughput: Optional[float] = None
+
+
+class ConcurrencyController:
+    """
+    Limits the number of concurrent downloads from each host and adjusts the
+    limit with additive increase/multiplicative decrease.
+
+    The throughput of each host is measured in windows of downloads. The
+    limit is raised by one while the throughput improves, and cut on errors
+    or when the throughput drops.
+    """
+
+    def __init__(self, max_limit: int, learned: Dict[str, float] = {}, path: Optional[str] = None):
+        self.max_limit = max_limit
+        self.learned = dict(learned)
+        self.path = path
+        self.hosts: Dict[str, HostState] = {}
+        self._condition = threading.Condition()
+
+
+    @classmethod
+    def load(cls, max_limit: int, database_directory: Optional[str]) -> "ConcurrencyController":
+        """
+        Create controller with settings learned in earlier runs
+
+        :param max_limit: Max number of concurrent downloads from each host
+        :param database_directory: Directory where learned settings are stored
+        :returns: Controller
+        """
+        if database_directory is None:
+            return cls(max_limit)
+        path = os.path.join(database_directory, CONCURRENCY_FILENAME)
+        learned: Dict[str, float] = {}
+        try:
+            with open(path, "r") as f:
+                learned = json.load(f)
+        except (OSError, ValueError):
+            pass
+        return cls(max_limit, learned, path)
+
+
+    def save(self) -> None:
+        """Store learned settings in database directory"""
+        if self.path is None:
+            return
+        with self._condition:
+            for host, state in self.hosts.items():
+                self.learned[host] = state.limit
+            data = json.dumps(self.learned)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            f.write(data)
+
+
+    def _host_state(self, host: str) -> HostState:
+        if host not in self.hosts:
+            limit = self.learned.get(host, INITIAL_CONCURRENCY)
+            self.hosts[host] = HostState(
+                limit = max(1, min(limit, self.max_limit)),
+                window_start = time.monotonic()
+            )
+        return self.hosts[host]
+
+
+    @contextmanager
+    def slot(self, host: str) -> Iterator["DownloadSlot"]:
+        """
+        Wait until a download from `host` is allowed and measure it
+
+        :param host: Host of the download
+        :returns: Slot where the number of downloaded bytes is recorded
+        """
+        with self._condition:
+            state = self._host_state(host)
+            while state.active >= int(state.limit):
+                self._condition.wait()
+            state.active += 1
+        slot = DownloadSlot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except Exception:
+            self._finish(host, slot, time.monotonic() - start, error = True)
+            raise
+        self._finish(host, slot, time.monotonic() - start, error = False)
+
+
+    def _finish(self, host: str, slot: "DownloadSlot", duration: float, error: bool) -> None:
+        with self._condition:
+            state = self.hosts[host]
+            state.active -= 1
+            if error:
+                self._adjust(host, state, max(1, state.limit * ERROR_DECREASE))
+                state.throughput = None
+            else:
+                state.window_bytes += slot.bytes
+                state.window_downloads += 1
+                state.window_latency += duration
+                if state.window_downloads >= int(state.limit):
+                    self._end_window(host, state)
+            self._condition.notify_all()
+
+
+    def _end_window(self, host: str, state: HostState) -> None:
+        elapsed = time.monotonic() - state.window_start
+        if elapsed <= 0:
+            return
+        throughput = state.window_bytes / elapsed
+        latency = state.window_latency / state.window_downloads
+        logging.debug(f"{host}: {int(state.limit)} connections, {int(throughput)} B/s, {latency:.2f} s per file")
+        previous = state.throughput
+        if previous is None or throughput > previous * (1 + THROUGHPUT_THRESHOLD):
+            limit = min(state.limit + CONCURRENCY_INCREASE, self.max_limit)
+        elif throughput < previous * (1 - THROUGHPUT_THRESHOLD):
+            limit = max(1, state.limit * SLOWDOWN_DECREASE)
+        else:
+            limit = state.limit
+        self._adjust(host, state, limit)
+        state.throughput = throughput
+
+
+    def _adjust(self, host: str, state: HostState, limit: float) -> None:
+        """Set new limit for host and start a new measurement window"""
+        if int(limit) != int(state.limit):
+            logging.debug(f"Changing concurrency for {host} from {int(state.limit)} to {int(limit)}")
+        state.limit = limit
+        state.window_start = time.monotonic()
+        state.window_bytes = 0
+        state.window_downloads = 0
+        state.window_latency = 0
+
+
+@define
+class DownloadSlot:
+    # Number of downloaded bytes
+    bytes: int = 0
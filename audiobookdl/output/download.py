@@ -1,26 +1,60 @@
-from audiobookdl import AudiobookFile, Source, logging, Audiobook
-from audiobookdl.exceptions import UserNotAuthorized, NoFilesFound, DownloadError
-from . import metadata, output, encryption
+from audiobookdl import AudiobookFile, Source, logging, Audiobook, utils
+from audiobookdl.utils import retry, ratelimit
+from audiobookdl.exceptions import UserNotAuthorized, NoFilesFound, DownloadError, NotEnoughSpace
+from . import metadata, output, encryption, journal, manifest, progress, concurrency, watchdog, assembler, chapters, planner, postprocess
 
 import os
+import errno
 import shutil
 from functools import partial
-from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
-from rich.progress import Progress, BarColumn, ProgressColumn, SpinnerColumn
+from attrs import evolve
+from contextlib import ExitStack
+from datetime import timedelta
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from rich import filesize
+from rich.progress import Progress, BarColumn, ProgressColumn, SpinnerColumn, TaskID
 from rich.prompt import Confirm
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from math import log10
 import sys
 from sanitize_filename import sanitize
+from requests import Response
+from urllib.parse import urlparse
 
 DOWNLOAD_PROGRESS: List[Union[str, ProgressColumn]] = [
     SpinnerColumn(),
     "{task.description}",
     BarColumn(),
-    "[progress.percentage]{task.percentage:>3.0f}%"
+    "[progress.percentage]{task.percentage:>3.0f}%",
+    "[progress.download]{task.fields[size]}",
+    "[progress.data.speed]{task.fields[speed]}",
+    "[progress.remaining]{task.fields[eta]}",
 ]
 
+CONVERSION_PROGRESS: List[Union[str, ProgressColumn]] = [
+    SpinnerColumn(),
+    "{task.description}",
+    BarColumn(),
+    "{task.completed}/{task.total} files",
+    "[blue]{task.fields[file]}",
+]
+
+# Smallest byte range a file is split into when downloading in parts
+MIN_SPLIT_SIZE = 1024 * 1024 * 4
+# Size of buffer responses are read into
+DOWNLOAD_BUFFER_SIZE = 1024 * 256
+# Number of downloaded bytes between each update of a download journal
+JOURNAL_SAVE_INTERVAL = 1024 * 1024
+# Seconds to wait for a connection to the server
+CONNECT_TIMEOUT = 10
+# Number of stream segments per connection that can be downloaded ahead of
+# the next segment written to the output file
+REORDER_WINDOW_PER_CONNECTION = 2
+# Number of copies of the downloaded files that exist at the same time
+# while combining, in addition to the downloaded files
+COMBINE_SCRATCH_COPIES = 1
+
 
 def download(audiobook: Audiobook, options):
     """
@@ -38,14 +72,35 @@ def download(audiobook: Audiobook, options):
         download_audiobook(audiobook, output_dir, options)
     except KeyboardInterrupt:
         logging.book_update("Stopped download")
+        if options.resume:
+            logging.book_update("Keeping partial files for resuming")
+            return
         logging.book_update("Cleaning up files")
-        if len(audiobook.files) == 1:
+        if can_assemble_stream(audiobook, options):
+            filepath, filepath_tmp = create_stream_filepath(audiobook, output_dir)
+            if os.path.exists(filepath_tmp):
+                os.remove(filepath_tmp)
+        elif len(audiobook.files) == 1:
             filepath, filepath_tmp = create_filepath(audiobook, output_dir, 0)
-            os.remove(filepath_tmp)
-        else:
+            for path in [filepath_tmp, journal.journal_path(filepath_tmp)]:
+                if os.path.exists(path):
+                    os.remove(path)
+        elif manifest.has_manifest(output_dir):
+            # Files recorded in the manifest are reused by the next run
+            remove_unfinished_files(output_dir)
+        elif os.path.isdir(output_dir):
+            # Books converted while downloading are never written to the
+            # directory, and ffmpeg's partial output is removed when it is stopped
             shutil.rmtree(output_dir)
 
 
+def remove_unfinished_files(output_dir: str) -> None:
+    """Remove tmp files and journals of unfinished downloads in `output_dir`"""
+    for entry in os.scandir(output_dir):
+        if entry.name.endswith((".tmp", f".tmp.{journal.JOURNAL_EXTENSION}")):
+            os.remove(entry.path)
+
+
 def download_audiobook(audiobook: Audiobook, output_dir: str, options):
     """Download, convert, combine, and add metadata to files from `Audiobook` object"""
     # Check if file/dir exists and should be skipped
@@ -59,26 +114,59 @@ def download_audiobook(audiobook: Audiobook, output_dir: str, options):
                 if os.path.exists(output_path):
                     logging.log(f"Skipping [blue]{audiobook.title}[/], file already exists.")
                     return
-        elif os.path.isdir(output_dir):  # multiple files, check for directory
+        elif os.path.isdir(output_dir) and not manifest.has_manifest(output_dir):  # multiple files, check for directory
             logging.log(f"Skipping [blue]{audiobook.title}[/], directory already exists.")
             return
 
-    # Downloading files
-    filepaths = download_files_with_cli_output(audiobook, output_dir)
-    # Converting files
-    current_format, output_format = get_output_audio_format(options.output_format, filepaths)
-    # Combine files
-    if options.combine and len(filepaths) > 1:
-        logging.book_update("Combining files")
-        output_path = f"{output_dir}.{current_format}"
-        output.combine_audiofiles(filepaths, output_dir, output_path)
-        filepaths = [output_path]
-    if current_format != output_format:
-        logging.book_update("Converting files")
-        filepaths = output.convert_output(filepaths, output_format)
+    set_bitrate_metadata(audiobook)
+    # Remove files of chapters that are not downloaded
+    if options.chapters:
+        chapters.select_chapters(audiobook, options.chapters, options)
+    # Find size of files before downloading
+    download_plan = planner.create_plan(audiobook, output_dir, options)
+    if options.plan_only:
+        print(download_plan.as_json())
+        return
+    planner.check_free_space(download_plan, required_space(audiobook, download_plan, output_dir, options))
+    # Convert files while downloading them
+    plan: Optional[postprocess.PostProcessPlan] = None
+    stream_audiobook: Optional[Audiobook] = None
+    if options.stream_convert:
+        plan = postprocess.plan_stream_processing(audiobook, output_dir, options)
+    # Splitting a single file sends a request, so it is only done if the book can be streamed
+    if plan:
+        stream_audiobook = stream_segments(audiobook, options)
+    if plan and stream_audiobook:
+        filepaths = download_files_with_cli_output(stream_audiobook, output_dir, options, stream_plan=plan)
+    else:
+        # Downloading files
+        filepaths = download_files_with_cli_output(audiobook, output_dir, options, download_plan)
+        # Combine, convert and embed chapters and cover in one ffmpeg run
+        # when the audio has to be rewritten anyway
+        current_format, output_format = get_output_audio_format(options.output_format, filepaths)
+        plan = postprocess.plan_post_processing(audiobook, filepaths, output_dir, current_format, output_format, options)
+    if plan and not plan.input_format:
+        logging.book_update("Processing files")
+        filepaths = [postprocess.run_post_processing(plan)]
+    elif plan is None:
+        # Combine files
+        if options.combine and len(filepaths) > 1:
+            logging.book_update("Combining files")
+            output_path = f"{output_dir}.{current_format}"
+            output.combine_audiofiles(filepaths, output_dir, output_path)
+            filepaths = [output_path]
+        if current_format != output_format:
+            logging.book_update("Converting files")
+            filepaths = convert_files_with_cli_output(filepaths, output_format)
     # Add metadata
     if len(filepaths) == 1:
-        add_metadata_to_file(audiobook, filepaths[0], options)
+        add_metadata_to_file(
+            audiobook,
+            filepaths[0],
+            options,
+            add_chapters = not (plan and plan.chapters),
+            add_cover = not (plan and plan.cover),
+        )
         if options.generate_cue:
             if len(audiobook.chapters) > 1:
                 performer = audiobook.metadata.narrators[0]
@@ -88,13 +176,64 @@ def download_audiobook(audiobook: Audiobook, output_dir: str, options):
         add_metadata_to_dir(audiobook, filepaths, output_dir, options)
 
 
-def add_metadata_to_file(audiobook: Audiobook, filepath: str, options):
+def set_bitrate_metadata(audiobook: Audiobook) -> None:
+    """Store the bitrate of the selected stream variant in the metadata of `audiobook`"""
+    if audiobook.metadata.bitrate is None:
+        audiobook.metadata.bitrate = next((file.bitrate for file in audiobook.files if file.bitrate), None)
+
+
+def required_space(audiobook: Audiobook, download_plan: planner.DownloadPlan, output_dir: str, options) -> Optional[int]:
+    """
+    Estimate the disk space needed to download and post-process audiobook.
+    Combining, converting and adding chapters with ffmpeg write a new copy
+    of the audio before the old one is removed, so the largest of these
+    steps is added to the size of the download.
+
+    :param audiobook: Audiobook to download
+    :param download_plan: Planned files with their sizes
+    :param output_dir: Output location of audiobook
+    :param options: Cli options
+    :returns: Required space in bytes or `None` if the size of the files is unknown
+    """
+    total = download_plan.total_size
+    if total is None:
+        return None
+    combined = len(audiobook.files) == 1 or options.combine or can_assemble_stream(audiobook, options)
+    largest_output = total if combined else max(file.size or 0 for file in download_plan.files)
+    current_format = audiobook.files[0].ext
+    output_format = options.output_format or current_format
+    scratch = 0
+    if options.combine and len(audiobook.files) > 1 and not can_assemble_stream(audiobook, options):
+        scratch = max(scratch, COMBINE_SCRATCH_COPIES * total)
+    if output_format != current_format:
+        scratch = max(scratch, largest_output)
+    if combined and audiobook.chapters and not options.no_chapters and output_format != "mp3":
+        scratch = max(scratch, total)
+    return max(total - size_on_disk(audiobook, output_dir, options), 0) + scratch
+
+
+def size_on_disk(audiobook: Audiobook, output_dir: str, options) -> int:
+    """Bytes of audiobook already written in an earlier run"""
+    if can_assemble_stream(audiobook, options):
+        paths = [create_stream_filepath(audiobook, output_dir)[1]]
+    elif len(audiobook.files) == 1:
+        paths = [create_filepath(audiobook, output_dir, 0)[1]]
+    elif os.path.isdir(output_dir):
+        paths = [entry.path for entry in os.scandir(output_dir) if entry.is_file()]
+    else:
+        paths = []
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def add_metadata_to_file(audiobook: Audiobook, filepath: str, options, add_chapters: bool = True, add_cover: bool = True):
     """
     Embed metadata into a single file
 
     :param audiobook: Audiobook object. Stores metadata
     :param filepath: Filepath of output file
     :options: Cli options
+    :param add_chapters: Add chapters. Disabled if they were added while post-processing
+    :param add_cover: Embed cover. Disabled if it was embedded while post-processing
     """
     # General metadata
     logging.book_update("Adding metadata")
@@ -103,11 +242,11 @@ def add_metadata_to_file(audiobook: Audiobook, filepath: str, options):
         with open(f"{filepath}.json", "w") as f:
             f.write(audiobook.metadata.as_json())
     # Chapters
-    if audiobook.chapters and not options.no_chapters:
+    if add_chapters and audiobook.chapters and not options.no_chapters:
         logging.book_update("Adding chapters")
         metadata.add_chapters(filepath, audiobook.chapters)
     # Cover
-    if audiobook.cover:
+    if add_cover and audiobook.cover:
         logging.book_update("Embedding cover")
         metadata.embed_cover(filepath, audiobook.cover)
 
@@ -167,34 +306,96 @@ def add_metadata_to_dir(audiobook: Audiobook, filepaths: Iterable[str], output_d
             f.write(audiobook.cover.image)
 
 
-def download_files_with_cli_output(audiobook: Audiobook, output_dir: str) -> List[str]:
+def download_files_with_cli_output(audiobook: Audiobook, output_dir: str, options, download_plan: Optional[planner.DownloadPlan] = None, stream_plan: Optional[postprocess.PostProcessPlan] = None) -> List[str]:
     """
     Download `audiobook` with cli progress bar
 
     :param audiobook: Audiobook to download
     :param output_dir: Output directory where files are downloaded to
+    :param options: Cli options
+    :param download_plan: Planned files with their sizes
+    :param stream_plan: Convert the segments of `audiobook` with ffmpeg while downloading
     :returns: A list of paths of the downloaded files
     """
-    if len(audiobook.files) > 1:
-        setup_download_dir(output_dir)
+    stream = stream_plan is not None or can_assemble_stream(audiobook, options)
+    if stream and options.resume:
+        logging.log("Downloads written directly into one file can't be resumed, downloading from the start")
+    if stream and options.engine == "async":
+        logging.log("Downloads written directly into one file don't use the async engine, downloading with threads")
+    if len(audiobook.files) > 1 and not stream:
+        setup_download_dir(output_dir, options.resume)
     else:
         parent = Path(output_dir).parent
         if not parent.exists():
             os.makedirs(parent)
-    with logging.progress(DOWNLOAD_PROGRESS) as progress:
-        task = progress.add_task(
-            f"Downloading [blue]{audiobook.title}",
-            total = len(audiobook.files)
-        )
-        update_progress = partial(progress.advance, task)
-        filepaths = download_files(audiobook, output_dir, update_progress)
-        # Make sure progress bar is at 100%
-        remaining_progress: float = progress.tasks[0].remaining or 0
-        update_progress(remaining_progress)
+    tracker = progress.ProgressTracker(len(audiobook.files))
+    reporters: List[progress.ProgressReporter] = []
+    if options.progress_json:
+        reporters.append(progress.json_reporter)
+    with ExitStack() as stack:
+        if not logging.quiet_mode:
+            progress_bar = stack.enter_context(logging.progress(DOWNLOAD_PROGRESS))
+            task = progress_bar.add_task(
+                f"Downloading [blue]{audiobook.title}",
+                total = None,
+                size = "",
+                speed = "",
+                eta = "",
+            )
+            reporters.append(partial(report_progress_bar, progress_bar, task))
+        with progress.ProgressRenderer(tracker, reporters):
+            if stream:
+                filepaths = [download_stream(audiobook, output_dir, tracker, options, download_plan, stream_plan)]
+            else:
+                filepaths = download_files(audiobook, output_dir, tracker, options, download_plan)
+        for host, (requests_count, connections_count) in utils.connection_stats(audiobook.session).items():
+            logging.debug(f"{requests_count} requests to {host} over {connections_count} connections")
         # Return filenames of downloaded files
         return filepaths
 
 
+def convert_files_with_cli_output(filepaths: Sequence[str], output_format: str) -> List[str]:
+    """
+    Convert files with cli progress bar
+
+    :param filepaths: Paths of files to convert
+    :param output_format: Format to convert to
+    :returns: Paths of converted files
+    """
+    if logging.quiet_mode or len(filepaths) == 1:
+        return output.convert_output(filepaths, output_format)
+    with logging.progress(CONVERSION_PROGRESS) as progress_bar:
+        task = progress_bar.add_task("Converting", total = len(filepaths), file = "")
+        on_converted = lambda path: progress_bar.update(task, advance = 1, file = os.path.basename(path))
+        return output.convert_output(filepaths, output_format, on_converted)
+
+
+def report_progress_bar(progress_bar: Progress, task: TaskID, snapshot: progress.ProgressSnapshot) -> None:
+    """
+    Show progress snapshot in cli progress bar
+
+    :param progress_bar: Cli progress bar
+    :param task: Task in progress bar
+    :param snapshot: Current download progress
+    """
+    size = filesize.decimal(snapshot.completed)
+    if snapshot.total:
+        size = f"{size}/{filesize.decimal(snapshot.total)}"
+    if len(snapshot.files) > 1:
+        size = f"{size} ({snapshot.finished_files}/{len(snapshot.files)} files)"
+    eta = ""
+    if snapshot.eta is not None:
+        eta = str(timedelta(seconds=int(snapshot.eta)))
+    progress_bar.update(
+        task,
+        completed = snapshot.completed,
+        total = snapshot.total,
+        size = size,
+        speed = f"{filesize.decimal(int(snapshot.speed))}/s",
+        eta = eta,
+    )
+
+
 def create_filepath(audiobook: Audiobook, output_dir: str, index: int) -> Tuple[str, str]:
     """
     Create output file path for file number `index` in `audibook`
@@ -216,53 +417,658 @@ def create_filepath(audiobook: Audiobook, output_dir: str, index: int) -> Tuple[
     return path, path_tmp
 
 
-def download_file(args: Tuple[Audiobook, str, int, Any]) -> str:
+def create_stream_filepath(audiobook: Audiobook, output_dir: str) -> Tuple[str, str]:
+    """
+    Create path of the file all segments of a stream are written to
+
+    :param audiobook: Currently downloading audiobook
+    :param output_dir: Output location of audiobook
+    :returns: Filepath, Filepath_tmp
+    """
+    path = f"{output_dir}.{audiobook.files[0].ext}"
+    return path, f"{path}.tmp"
+
+
+def can_assemble_stream(audiobook: Audiobook, options) -> bool:
+    """
+    Checks whether the files of `audiobook` are segments of a stream that
+    should be written directly into one combined file
+
+    :param audiobook: Audiobook to download
+    :param options: Cli options
+    :returns: True if the segments should be assembled while downloading
+    """
+    # Byte ranges of a single resource, like the selected chapters of an mp3
+    # file, are always written to one file
+    single_resource = all(file.byte_range for file in audiobook.files) \
+        and len({file.url for file in audiobook.files}) == 1
+    # Assembled streams can't be resumed and are only downloaded with threads,
+    # so other segments are downloaded to separate files recorded in the
+    # manifest and combined afterwards
+    if (options.resume or options.engine == "async") and not single_resource:
+        return False
+    return (bool(options.combine) or single_resource) \
+        and len(audiobook.files) > 1 \
+        and all(file.segment for file in audiobook.files) \
+        and len({file.ext for file in audiobook.files}) == 1
+
+
+def stream_segments(audiobook: Audiobook, options) -> Optional[Audiobook]:
+    """
+    Split audiobook into segments that can be downloaded at the same time
+    and written in order. Single files are split into byte ranges if the
+    server supports them.
+
+    :param audiobook: Audiobook to download
+    :param options: Cli options
+    :returns: Audiobook where all files are segments of one stream, or
+        `None` if the files can't be downloaded as a stream
+    """
+    if len(audiobook.files) > 1:
+        stream = all(file.segment for file in audiobook.files) \
+            and len({file.ext for file in audiobook.files}) == 1
+        return audiobook if stream else None
+    file = audiobook.files[0]
+    if file.encryption_method or file.byte_range:
+        return None
+    # A request for the first byte shows if byte ranges are supported
+    data, total_size = chapters.fetch_range(audiobook, file, 0, 1, options)
+    if data is None or not total_size:
+        logging.debug("Server does not support byte ranges, converting after download")
+        return None
+    files = []
+    for start in range(0, total_size, options.coalesce_size):
+        files.append(evolve(
+            file,
+            segment = True,
+            byte_range = (start, min(start + options.coalesce_size, total_size) - 1),
+            expected_status_code = 206,
+        ))
+    return evolve(audiobook, files = files)
+
+
+def download_file(args: Tuple[Audiobook, str, int, Any, Any], attempt: Optional[watchdog.DownloadAttempt] = None) -> str:
     # Prepare download
-    audiobook, output_dir, index, update_progress = args
-    file = audiobook.files[index]
+    audiobook, output_dir, index, tracker, options = args
+    if attempt is None:
+        attempt = watchdog.DownloadAttempt(hedge = False)
     filepath, filepath_tmp = create_filepath(audiobook, output_dir, index)
+    if attempt.hedge:
+        # Hedged attempts run next to the original attempt and can't share its files
+        filepath_tmp = f"{filepath}.hedge.tmp"
+    try:
+        return download_file_attempt(audiobook, index, tracker, options, attempt, filepath, filepath_tmp)
+    except watchdog.DownloadCancelled:
+        tracker.remove_bytes(index, attempt.bytes)
+        if os.path.exists(filepath_tmp):
+            os.remove(filepath_tmp)
+        raise
+    except Exception:
+        # Failed attempts are retried from the bytes on disk
+        tracker.remove_bytes(index, attempt.bytes)
+        raise
+
+
+def download_file_attempt(audiobook: Audiobook, index: int, tracker: progress.ProgressTracker, options, attempt: watchdog.DownloadAttempt, filepath: str, filepath_tmp: str) -> str:
+    file = audiobook.files[index]
+    # Journals store ranges relative to the whole resource
+    resumable = options.resume and not attempt.hedge and file.byte_range is None
+    download_journal = journal.load_journal(filepath_tmp) if resumable else None
+    headers = request_headers(file)
+    if download_journal:
+        logging.debug(f"Resuming download of file: {file.url}")
+        headers = {**headers, **download_journal.resume_headers()}
     logging.debug(f"Starting downloading file: {file.url}")
-    request = audiobook.session.get(file.url, headers=file.headers, stream=True)
+    request = audiobook.session.get(
+        file.url,
+        headers = headers,
+        stream = True,
+        timeout = (CONNECT_TIMEOUT, options.timeout),
+    )
+    # The response is closed on errors, so its connection is returned to the pool
+    with request:
+        attempt.add_response(request)
+        if download_journal and download_journal.matches(request):
+            # Signed urls might have been renewed by the source
+            download_journal.url = file.url
+        elif download_journal:
+            logging.debug("File has changed since last download, starting over")
+            download_journal.remove()
+            if request.status_code == 206:
+                # Only part of the changed file was sent, so the whole file
+                # is requested again
+                request.close()
+                return download_file_attempt(audiobook, index, tracker, options, attempt, filepath, filepath_tmp)
+            download_journal = None
+        check_response(file, request, resumed = download_journal is not None)
+        if download_journal:
+            total_filesize: Optional[int] = download_journal.total_filesize
+        else:
+            total_filesize = int(request.headers.get("Content-Length", 0)) if "Content-Length" in request.headers else int(request.headers["content-range"].split("/")[1]) if "content-range" in request.headers else None
+        # Plan which byte ranges should be downloaded
+        if download_journal is None and total_filesize is not None and request.status_code == 200:
+            # Files in multi-file audiobooks are not split, since each download
+            # thread could otherwise wait for connections held by the others
+            split = options.split if len(audiobook.files) == 1 else 1
+            if not supports_split_download(request, total_filesize, split):
+                split = 1
+            resumable = resumable and journal.can_resume(request)
+            if split > 1 or resumable:
+                download_journal = journal.DownloadJournal.create(
+                    url = file.url,
+                    response = request,
+                    total_filesize = total_filesize,
+                    ranges = split_byte_ranges(total_filesize, split),
+                    path = journal.journal_path(filepath_tmp) if resumable else None,
+                )
+                with open(filepath_tmp, "wb") as f:
+                    preallocate(f, total_filesize)
+        # Download file to tmp file
+        tracker.start_file(index, total_filesize, download_journal.committed if download_journal else 0)
+        if download_journal:
+            download_file_ranges(audiobook, index, request, filepath_tmp, download_journal, tracker, options, attempt)
+            # Decrypt file if necessary
+            if file.encryption_method:
+                encryption.decrypt_file(filepath_tmp, file.encryption_method)
+        else:
+            # Files downloaded in a single stream are decrypted while downloading
+            decryptor = encryption.create_decryptor(file.encryption_method)
+            with open(filepath_tmp, "wb") as f:
+                if total_filesize:
+                    preallocate(f, total_filesize)
+                for chunk in read_response(request, attempt):
+                    f.write(decryptor.update(chunk) if decryptor else chunk)
+                    tracker.add_bytes(index, len(chunk))
+                if decryptor:
+                    f.write(decryptor.finalize())
+                # Content-Length might not match the decoded and decrypted size
+                f.truncate()
+    # rename file after download is complete
+    os.rename(filepath_tmp, filepath)
+    if download_journal:
+        download_journal.remove()
+    tracker.finish_file(index)
+    # Return filepath
+    return filepath
+
+
+def request_headers(file: AudiobookFile) -> dict:
+    """
+    Headers of the request for `file`
+
+    :param file: File to download
+    :returns: Headers including the byte range of the file
+    """
+    headers = dict(file.headers)
+    if file.byte_range:
+        headers["Range"] = f"bytes={file.byte_range[0]}-{file.byte_range[1]}"
+    return headers
+
+
+def expected_status_code(file: AudiobookFile) -> Optional[int]:
+    """Status code the download request for `file` should return"""
+    if file.expected_status_code:
+        return file.expected_status_code
+    return 206 if file.byte_range else None
+
+
+def check_response(file: AudiobookFile, request: Response, resumed: bool = False) -> None:
+    """
+    Check that the response to a download request contains the expected file
+
+    :param file: File being downloaded
+    :param request: Response of the download request
+    :param resumed: Whether the download request continues an earlier download
+    :raises DownloadError: If the response has an unexpected status or content type
+    """
     content_type: Optional[str] =  request.headers.get("Content-type", None)
+    expected_status = expected_status_code(file)
     if ((file.expected_content_type and file.expected_content_type != content_type) 
-        or (file.expected_status_code and file.expected_status_code != request.status_code)):
+        or (expected_status and expected_status != request.status_code and not resumed)
+        or request.status_code in retry.RETRY_STATUS_CODES):
         raise DownloadError(status_code=request.status_code,
                             content_type=content_type,
-                            expected_status_code=file.expected_status_code,
+                            expected_status_code=expected_status or 200,
                             expected_content_type=file.expected_content_type,
+                            retry_after=request.headers.get("Retry-After"),
                             )
-    total_filesize = int(request.headers.get("Content-Length", 0)) if "Content-Length" in request.headers else int(request.headers["content-range"].split("/")[1]) if "content-range" in request.headers else None
     if not file.expected_status_code:
         logging.debug(f"expected_status_code not set by source, status-code is {request.status_code}, please update the source implementation")
     if not file.expected_content_type:
         logging.debug(f"expected_content_type not set by source, content-type is {content_type}, please update the source implementation")
-    # Download file to tmp file
-    with open(filepath_tmp, "wb") as f:
-        for chunk in request.iter_content(chunk_size=1024):
-            f.write(chunk)
-            download_progress = len(chunk)/total_filesize
-            update_progress(download_progress)
-    # Decrypt file if necessary
-    if file.encryption_method:
-        encryption.decrypt_file(filepath_tmp, file.encryption_method)
-    # rename file after download is complete
-    os.rename(filepath_tmp, filepath)
-    # Return filepath
-    return filepath
 
 
-def download_files(audiobook: Audiobook, output_dir: str, update_progress) -> List[str]:
-    """Download files from audiobook and return paths of the downloaded files"""
-    filepaths = []
-    with ThreadPool(processes=20) as pool:
-        arguments = []
-        for index in range(len(audiobook.files)):
-            arguments.append((audiobook, output_dir, index, update_progress))
-        for filepath in pool.imap(download_file, arguments):
-            filepaths.append(filepath)
+def read_response(response: Response, attempt: Optional[watchdog.DownloadAttempt] = None) -> Iterator[memoryview]:
+    """
+    Read body of streamed response in large chunks.
+    All chunks are views into the same reused buffer, so each chunk has to be
+    used before the next one is read.
+
+    :param response: Streamed response
+    :param attempt: Download attempt monitored by the watchdog
+    :returns: Iterator over chunks of the body
+    """
+    buffer = bytearray(DOWNLOAD_BUFFER_SIZE)
+    view = memoryview(buffer)
+    response.raw.decode_content = True
+    while True:
+        try:
+            size = response.raw.readinto(buffer)
+        except Exception:
+            # Reads fail when the watchdog shuts down the connection
+            if attempt:
+                attempt.check()
+            raise
+        if attempt:
+            attempt.check()
+        if not size:
+            break
+        if attempt:
+            attempt.bytes += size
+        if attempt:
+            delay = ratelimit.limiter.reserve(size)
+            if delay > 0:
+                attempt.throttle(delay)
+        else:
+            ratelimit.limiter.consume(size)
+        yield view[:size]
+
+
+def preallocate(f: BinaryIO, size: int) -> None:
+    """
+    Reserve disk space for file, so it is written in one piece and fails
+    before downloading if the disk is full. Falls back to creating a sparse
+    file on systems without `posix_fallocate`.
+
+    :param f: File opened for writing
+    :param size: Size of file in bytes
+    :raises NotEnoughSpace: If there is not enough space for the file
+    """
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise NotEnoughSpace(
+                path = f.name,
+                required = filesize.decimal(size),
+                free = filesize.decimal(planner.free_space(f.name) or 0),
+            )
+        f.truncate(size)
+    except AttributeError:
+        f.truncate(size)
+
+
+def supports_split_download(request: Response, total_filesize: Optional[int], split: int) -> bool:
+    """
+    Checks whether the response to a download request can be downloaded in
+    multiple byte ranges at the same time
+
+    :param request: Response of the initial download request
+    :param total_filesize: Size of file if known
+    :param split: Number of parts the file should be split into
+    :returns: True if the file should be downloaded in parts
+    """
+    return split > 1 \
+        and request.status_code == 200 \
+        and total_filesize is not None \
+        and total_filesize >= 2 * MIN_SPLIT_SIZE \
+        and request.headers.get("Accept-Ranges", "").lower() == "bytes" \
+        and request.headers.get("Content-Encoding", "identity").lower() == "identity"
+
+
+def split_byte_ranges(total_filesize: int, split: int) -> List[journal.ByteRange]:
+    """
+    Split file into byte ranges of roughly equal size
+
+    :param total_filesize: Size of file in bytes
+    :param split: Max number of byte ranges
+    :returns: List of byte ranges
+    """
+    split = max(1, min(split, total_filesize // MIN_SPLIT_SIZE))
+    part_size = max(1, -(-total_filesize // split))
+    return [
+        journal.ByteRange(start, min(start + part_size, total_filesize) - 1)
+        for start in range(0, total_filesize, part_size)
+    ]
+
+
+def download_file_ranges(audiobook: Audiobook, index: int, request: Response, filepath_tmp: str, download_journal: journal.DownloadJournal, tracker: progress.ProgressTracker, options, attempt: watchdog.DownloadAttempt):
+    """
+    Download the pending byte ranges of a file at the same time. Each range is
+    written directly to its place in the preallocated tmp file, and progress is
+    recorded in `download_journal`.
+    The already open `request` is used for the first pending byte range.
+
+    :param audiobook: Audiobook the file belongs to
+    :param index: Index of file in `audiobook.files`
+    :param request: Response of the initial download request
+    :param filepath_tmp: Path of tmp file
+    :param download_journal: Journal with the byte ranges of the file
+    :param tracker: Download progress of audiobook
+    :param options: Cli options
+    :param attempt: Download attempt monitored by the watchdog
+    """
+    file = audiobook.files[index]
+    pending_ranges = download_journal.pending_ranges
+    logging.debug(f"Downloading {len(pending_ranges)} byte ranges of file: {file.url}")
+    download_journal.save()
+
+    def download_range(range_index: int):
+        byte_range = pending_ranges[range_index]
+        start = byte_range.start + byte_range.committed
+        if range_index == 0:
+            response = request
+        else:
+            headers = {**file.headers, "Range": f"bytes={start}-{byte_range.end}"}
+            response = audiobook.session.get(
+                file.url,
+                headers = headers,
+                stream = True,
+                timeout = (CONNECT_TIMEOUT, options.timeout),
+            )
+            attempt.add_response(response)
+            if response.status_code != 206:
+                response.close()
+                raise DownloadError(
+                    status_code=response.status_code,
+                    content_type=response.headers.get("Content-type", None),
+                    expected_status_code=206,
+                    expected_content_type=request.headers.get("Content-type", None),
+                )
+        unsaved = 0
+        with response, open(filepath_tmp, "r+b") as f:
+            f.seek(start)
+            for chunk in read_response(response, attempt):
+                chunk = chunk[:byte_range.size - byte_range.committed]
+                f.write(chunk)
+                byte_range.committed += len(chunk)
+                tracker.add_bytes(index, len(chunk))
+                unsaved += len(chunk)
+                if unsaved >= JOURNAL_SAVE_INTERVAL:
+                    f.flush()
+                    download_journal.save()
+                    unsaved = 0
+                if byte_range.complete:
+                    break
+        download_journal.save()
+
+    with ThreadPool(processes=len(pending_ranges)) as pool:
+        pool.map(download_range, range(len(pending_ranges)))
+
+
+def find_missing_files(audiobook: Audiobook, output_dir: str, tracker: progress.ProgressTracker) -> Tuple[List[str], List[int], Optional[manifest.DownloadManifest]]:
+    """
+    Find files that have to be downloaded. Files from multi-file audiobooks
+    that were completed in an earlier run are reused if they are still intact.
+
+    :param audiobook: Audiobook to download
+    :param output_dir: Output directory where files are downloaded to
+    :param tracker: Download progress of audiobook
+    :returns: Paths of all files, indices of missing files and manifest of completed files
+    """
+    filepaths = [create_filepath(audiobook, output_dir, index)[0] for index in range(len(audiobook.files))]
+    download_manifest: Optional[manifest.DownloadManifest] = None
+    completed: Set[int] = set()
+    if len(audiobook.files) > 1:
+        download_manifest = manifest.load_manifest(output_dir)
+        completed = download_manifest.verified_indices(filepaths)
+        if completed:
+            logging.debug(f"Reusing {len(completed)} previously downloaded files")
+        for index in completed:
+            tracker.reuse_file(index, os.path.getsize(filepaths[index]))
+    missing = [index for index in range(len(audiobook.files)) if index not in completed]
+    return filepaths, missing, download_manifest
+
+
+def plan_downloads(audiobook: Audiobook, output_dir: str, missing: List[int], tracker: progress.ProgressTracker, options, download_plan: Optional[planner.DownloadPlan] = None) -> List[int]:
+    """
+    Find the size of missing files, so the total size is known before
+    downloading, and order them largest first
+
+    :param audiobook: Audiobook to download
+    :param output_dir: Output directory where files are downloaded to
+    :param missing: Indices of files that have to be downloaded
+    :param tracker: Download progress of audiobook
+    :param options: Cli options
+    :param download_plan: Planned files with their sizes. The files are probed if not given
+    :returns: Indices of missing files in the order they should be downloaded
+    """
+    if len(missing) <= 1:
+        return missing
+    if download_plan is None:
+        download_plan = planner.create_plan(audiobook, output_dir, options, missing)
+    missing_files = set(missing)
+    download_plan = planner.DownloadPlan(
+        output = download_plan.output,
+        files = [file for file in download_plan.files if file.index in missing_files],
+        free_space = download_plan.free_space,
+    )
+    for file in download_plan.files:
+        tracker.plan_file(file.index, file.size)
+    return download_plan.order
+
+
+def download_files(audiobook: Audiobook, output_dir: str, tracker: progress.ProgressTracker, options, download_plan: Optional[planner.DownloadPlan] = None) -> List[str]:
+    """
+    Download files from audiobook and return paths of the downloaded files.
+    Files from multi-file audiobooks that were completed in an earlier run are
+    reused if they are still intact.
+    """
+    if options.engine == "async" and len(audiobook.files) > 1:
+        # Imported here so aiohttp is only needed when the engine is used
+        from . import download_async
+        return download_async.download_files(audiobook, output_dir, tracker, options, download_plan)
+    filepaths, missing, download_manifest = find_missing_files(audiobook, output_dir, tracker)
+    missing = plan_downloads(audiobook, output_dir, missing, tracker, options, download_plan)
+
+    # Sources can have different limits, so the shared limit is changed for each audiobook
+    ratelimit.limiter.set_rate(options.limit_rate, options.limit_burst)
+    controller = concurrency.ConcurrencyController.load(options.connections, options.database_directory)
+    retry_policy = retry.RetryPolicy(retries=options.retries)
+
+    def download_attempt(arguments: Tuple[Audiobook, str, int, Any, Any]) -> str:
+        host = urlparse(audiobook.files[arguments[2]].url).netloc
+        with controller.slot(host) as slot:
+            # Bytes of a hedged attempt that finished second are counted twice
+            discarded = lambda attempt: tracker.remove_bytes(arguments[2], attempt.bytes)
+            filepath = dog.download(partial(download_file, arguments), discarded)
+            slot.bytes = os.path.getsize(filepath)
+        return filepath
+
+    def download_and_record(arguments: Tuple[Audiobook, str, int, Any, Any]) -> Optional[Exception]:
+        # Errors are returned instead of raised, so the remaining files are
+        # still downloaded and recorded in the manifest
+        try:
+            filepath = retry_policy.call(partial(download_attempt, arguments))
+        except Exception as e:
+            return e
+        if download_manifest:
+            download_manifest.add(arguments[2], filepath)
+        return None
+
+    errors = []
+    # Only downloads with several files have peers to compare against when hedging
+    hedge_percentile = options.hedge_percentile if len(missing) > 1 else None
+    try:
+        with watchdog.DownloadWatchdog(hedge_percentile) as dog, ThreadPool(processes=options.connections) as pool:
+            arguments = []
+            for index in missing:
+                arguments.append((audiobook, output_dir, index, tracker, options))
+            for error in pool.imap_unordered(download_and_record, arguments):
+                if error:
+                    errors.append(error)
+        summary = dog.summary()
+        if summary:
+            logging.debug(summary)
+    finally:
+        if len(missing) > 1:
+            controller.save()
+    if errors:
+        raise errors[0]
+    if download_manifest:
+        download_manifest.remove()
     return filepaths
 
 
+def plan_segment_requests(files: Sequence[AudiobookFile], max_size: int) -> List[List[int]]:
+    """
+    Group stream segments into requests. Adjacent byte ranges of the same
+    resource are merged into a single request of at most `max_size` bytes.
+
+    :param files: Segments of stream
+    :param max_size: Max number of bytes in a merged request
+    :returns: Indices of the segments in each request
+    """
+    groups: List[List[int]] = []
+    for index, file in enumerate(files):
+        if groups and file.byte_range:
+            first = files[groups[-1][0]]
+            last = files[groups[-1][-1]]
+            if first.byte_range and last.byte_range \
+                    and file.url == last.url \
+                    and file.headers == last.headers \
+                    and file.byte_range[0] == last.byte_range[1] + 1 \
+                    and file.byte_range[1] - first.byte_range[0] + 1 <= max_size:
+                groups[-1].append(index)
+                continue
+        groups.append([index])
+    return groups
+
+
+def download_segments(audiobook: Audiobook, indices: List[int], tracker: progress.ProgressTracker, options, attempt: watchdog.DownloadAttempt) -> bytes:
+    """
+    Download stream segments into memory with a single request and decrypt
+    each segment on its own
+
+    :param audiobook: Audiobook the segments belong to
+    :param indices: Indices of segments in `audiobook.files`. Multiple
+        segments have to be adjacent byte ranges of the same resource.
+    :param tracker: Download progress of audiobook
+    :param options: Cli options
+    :param attempt: Download attempt monitored by the watchdog
+    :returns: Content of segments
+    """
+    files = [audiobook.files[index] for index in indices]
+    headers = request_headers(files[0])
+    if len(files) > 1:
+        headers["Range"] = f"bytes={files[0].byte_range[0]}-{files[-1].byte_range[1]}" # type: ignore[index]
+    request = audiobook.session.get(
+        files[0].url,
+        headers = headers,
+        stream = True,
+        timeout = (CONNECT_TIMEOUT, options.timeout),
+    )
+    attempt.add_response(request)
+    data = bytearray()
+    # The response is closed on errors, so its connection is returned to the pool
+    with request:
+        check_response(files[0], request)
+        if len(files) > 1:
+            sizes: List[Optional[int]] = [file.byte_range[1] - file.byte_range[0] + 1 for file in files] # type: ignore[index]
+        else:
+            sizes = [int(request.headers["Content-Length"]) if "Content-Length" in request.headers else None]
+        for index, size in zip(indices, sizes):
+            tracker.start_file(index, size)
+        try:
+            for chunk in read_response(request, attempt):
+                data += chunk
+                tracker.add_bytes(indices[0], len(chunk))
+        except BaseException:
+            # The segments are downloaded again by another attempt
+            tracker.remove_bytes(indices[0], attempt.bytes)
+            raise
+    # Each segment is encrypted on its own
+    result = bytearray()
+    position = 0
+    for file, size in zip(files, sizes):
+        part = data[position:position+size] if size is not None and len(files) > 1 else data
+        position += len(part)
+        decryptor = encryption.create_decryptor(file.encryption_method)
+        if decryptor:
+            result += decryptor.update(part)
+            result += decryptor.finalize()
+        else:
+            result += part
+    for index in indices:
+        tracker.finish_file(index)
+    return bytes(result)
+
+
+def download_stream(audiobook: Audiobook, output_dir: str, tracker: progress.ProgressTracker, options, download_plan: Optional[planner.DownloadPlan] = None, stream_plan: Optional[postprocess.PostProcessPlan] = None) -> str:
+    """
+    Download all segments of a stream at the same time and write them in
+    order into a single file, so they don't have to be combined afterwards
+
+    :param audiobook: Audiobook where all files are segments of a stream
+    :param output_dir: Output location of audiobook
+    :param tracker: Download progress of audiobook
+    :param options: Cli options
+    :param download_plan: Planned segments with their sizes
+    :param stream_plan: Pipe segments into ffmpeg instead of writing them to a file
+    :returns: Path of the combined file
+    """
+    filepath, filepath_tmp = create_stream_filepath(audiobook, output_dir)
+    logging.debug(f"Assembling {len(audiobook.files)} segments into {filepath}")
+    controller = concurrency.ConcurrencyController.load(options.connections, options.database_directory)
+    retry_policy = retry.RetryPolicy(retries=options.retries)
+    ratelimit.limiter.set_rate(options.limit_rate, options.limit_burst)
+
+    # Adjacent byte ranges are downloaded together and written as one part
+    groups = plan_segment_requests(audiobook.files, options.coalesce_size)
+    if len(groups) < len(audiobook.files):
+        logging.debug(f"Merged {len(audiobook.files)} segments into {len(groups)} requests")
+
+    def download_attempt(group: List[int]) -> bytes:
+        host = urlparse(audiobook.files[group[0]].url).netloc
+        with controller.slot(host) as slot:
+            discarded = lambda attempt: tracker.remove_bytes(group[0], attempt.bytes)
+            data = dog.download(partial(download_segments, audiobook, group, tracker, options), discarded)
+            slot.bytes = len(data)
+        return data
+
+    def download_and_write(group_index: int) -> None:
+        try:
+            segments.wait_for_turn(group_index)
+            segments.put(group_index, retry_policy.call(partial(download_attempt, groups[group_index])))
+        except assembler.AssemblyAborted:
+            pass
+        except Exception as e:
+            segments.abort(e)
+
+    try:
+        with ExitStack() as stack:
+            if stream_plan:
+                f: Any = stack.enter_context(postprocess.StreamProcessor(stream_plan))
+            else:
+                f = stack.enter_context(open(filepath_tmp, "wb"))
+                if download_plan and not any(file.size is None for file in download_plan.files):
+                    preallocate(f, download_plan.total_size or 0)
+            segments = assembler.SegmentAssembler(f, REORDER_WINDOW_PER_CONNECTION * options.connections)
+            with watchdog.DownloadWatchdog(options.hedge_percentile) as dog, ThreadPool(processes=options.connections) as pool:
+                # Segments are started in order, so the next segment to write
+                # is always downloading and the window can't deadlock
+                for _ in pool.imap_unordered(download_and_write, range(len(groups))):
+                    pass
+            summary = dog.summary()
+            if summary:
+                logging.debug(summary)
+            if segments.error:
+                raise segments.error
+            if stream_plan:
+                logging.book_update("Converting files")
+                return f.finish()
+            # Decrypted segments can be smaller than planned
+            f.truncate()
+    except Exception:
+        if os.path.exists(filepath_tmp):
+            os.remove(filepath_tmp)
+        raise
+    finally:
+        controller.save()
+    os.rename(filepath_tmp, filepath)
+    return filepath
+
+
 def get_output_audio_format(option: Optional[str], files: Sequence[str]) -> Tuple[str, str]:
     """
     Get output format for files
@@ -280,15 +1086,19 @@ def get_output_audio_format(option: Optional[str], files: Sequence[str]) -> Tupl
     return current_format, output_format
 
 
-def setup_download_dir(path: str) -> None:
+def setup_download_dir(path: str, resume: bool = False) -> None:
     """
     Creates output folder for the audiobook.
-    Will give a prompt if the folder already exists.
+    Will give a prompt if the folder already exists, unless downloads should
+    be resumed or the folder contains an unfinished download.
 
     :param path: Path of output folder
+    :param resume: Keep existing folder to resume downloads
     :returns: Nothing
     """
     logging.book_update("Creating output dir")
+    if os.path.isdir(path) and (resume or manifest.has_manifest(path)):
+        return
     if os.path.isdir(path):
         answer = Confirm.ask(
             f"The folder '[blue]{path}[/blue]' already exists. Do you want to override it?"
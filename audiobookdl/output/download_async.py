@@ -0,0 +1,142 @@
+from audiobookdl import Audiobook, logging
+from audiobookdl.exceptions import DownloadError, MissingDependency
+from audiobookdl.utils import retry, ratelimit
+from . import encryption, manifest, planner, progress
+from .download import CONNECT_TIMEOUT, DOWNLOAD_BUFFER_SIZE, create_filepath, expected_status_code, find_missing_files, plan_downloads, preallocate, request_headers
+
+import os
+import asyncio
+import ssl
+import requests
+from typing import List, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:
+    raise MissingDependency(dependency="aiohttp")
+
+
+def download_files(audiobook: Audiobook, output_dir: str, tracker: progress.ProgressTracker, options, download_plan: Optional[planner.DownloadPlan] = None) -> List[str]:
+    """
+    Download files from audiobook on a single event loop and return paths of
+    the downloaded files. Works like `download.download_files`, but handles
+    many small files with far less overhead per file.
+    """
+    filepaths, missing, download_manifest = find_missing_files(audiobook, output_dir, tracker)
+    missing = plan_downloads(audiobook, output_dir, missing, tracker, options, download_plan)
+    ratelimit.limiter.set_rate(options.limit_rate, options.limit_burst)
+    errors = asyncio.run(download_missing_files(audiobook, output_dir, missing, download_manifest, tracker, options))
+    if errors:
+        raise errors[0]
+    if download_manifest:
+        download_manifest.remove()
+    return filepaths
+
+
+async def download_missing_files(audiobook: Audiobook, output_dir: str, missing: List[int], download_manifest: Optional[manifest.DownloadManifest], tracker: progress.ProgressTracker, options) -> List[Exception]:
+    """
+    Download files concurrently with at most `options.connections` requests
+    in flight
+
+    :returns: Errors of files that could not be downloaded
+    """
+    retry_policy = retry.RetryPolicy(retries=options.retries)
+    in_flight = asyncio.Semaphore(options.connections)
+    loop = asyncio.get_running_loop()
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=options.connections)
+    timeout = aiohttp.ClientTimeout(connect=CONNECT_TIMEOUT, sock_read=options.timeout)
+    # Cookies are handled by the requests session of the source
+    cookie_jar = aiohttp.DummyCookieJar()
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, cookie_jar=cookie_jar) as client:
+        async def download_and_record(index: int) -> Optional[Exception]:
+            # Errors are returned instead of raised, so the remaining files are
+            # still downloaded and recorded in the manifest
+            async with in_flight:
+                try:
+                    filepath = await retry_policy.call_async(
+                        lambda: download_file(client, audiobook, output_dir, index, tracker),
+                        classify = classify_exception,
+                    )
+                except Exception as e:
+                    return e
+            if download_manifest:
+                # Hashing the file would block the event loop
+                await loop.run_in_executor(None, download_manifest.add, index, filepath)
+            return None
+
+        results = await asyncio.gather(*[download_and_record(index) for index in missing])
+    return [error for error in results if error]
+
+
+async def download_file(client: "aiohttp.ClientSession", audiobook: Audiobook, output_dir: str, index: int, tracker: progress.ProgressTracker) -> str:
+    file = audiobook.files[index]
+    filepath, filepath_tmp = create_filepath(audiobook, output_dir, index)
+    url, headers, ssl_context = prepare_request(audiobook.session, file.url, request_headers(file))
+    logging.debug(f"Starting downloading file: {file.url}")
+    async with client.get(url, headers=headers, ssl=ssl_context or True) as response:
+        content_type: Optional[str] = response.headers.get("Content-Type")
+        expected_status = expected_status_code(file)
+        if ((file.expected_content_type and file.expected_content_type != content_type)
+            or (expected_status and expected_status != response.status)
+            or response.status in retry.RETRY_STATUS_CODES):
+            raise DownloadError(status_code=response.status,
+                                content_type=content_type,
+                                expected_status_code=expected_status or 200,
+                                expected_content_type=file.expected_content_type,
+                                retry_after=response.headers.get("Retry-After"),
+                                )
+        tracker.start_file(index, response.content_length)
+        decryptor = encryption.create_decryptor(file.encryption_method)
+        downloaded = 0
+        try:
+            with open(filepath_tmp, "wb") as f:
+                if response.content_length:
+                    preallocate(f, response.content_length)
+                async for chunk in response.content.iter_chunked(DOWNLOAD_BUFFER_SIZE):
+                    f.write(decryptor.update(chunk) if decryptor else chunk)
+                    tracker.add_bytes(index, len(chunk))
+                    downloaded += len(chunk)
+                    delay = ratelimit.limiter.reserve(len(chunk))
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if decryptor:
+                    f.write(decryptor.finalize())
+                f.truncate()
+        except BaseException:
+            # Failed downloads are retried from the start
+            tracker.remove_bytes(index, downloaded)
+            raise
+    os.rename(filepath_tmp, filepath)
+    tracker.finish_file(index)
+    return filepath
+
+
+def prepare_request(session: requests.Session, url: str, headers: dict) -> Tuple[str, dict, Optional[ssl.SSLContext]]:
+    """
+    Apply headers, cookies and authentication of a requests session to a
+    request, so it can be sent with aiohttp
+
+    :param session: Session of source
+    :param url: Url of request
+    :param headers: Extra headers of request
+    :returns: Url, headers and custom ssl context of the session
+    """
+    prepared = session.prepare_request(requests.Request("GET", url, headers=headers))
+    prepared_url = prepared.url or url
+    ssl_context = getattr(session.get_adapter(prepared_url), "ssl_context", None)
+    if not isinstance(ssl_context, ssl.SSLContext):
+        ssl_context = None
+    return prepared_url, dict(prepared.headers), ssl_context
+
+
+def classify_exception(error: Exception, idempotent: bool) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    Decide if a request that raised `error` should be retried.
+    Adds aiohttp errors to `retry.classify_exception`.
+    """
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return "connection failure", None
+    if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)):
+        return ("connection error", None) if idempotent else None
+    return retry.classify_exception(error, idempotent)
@@ -1,15 +1,104 @@
 from Crypto.Cipher import AES
 from audiobookdl.utils.audiobook import AudiobookFileEncryption, AESEncryption
 
+import os
+from typing import Optional, Union
+
+# Size of blocks read from disk when decrypting files
+DECRYPTION_BUFFER_SIZE = 1024 * 1024
+
+
+class AESStreamDecryptor:
+    """
+    Decrypts AES-CBC encrypted data in chunks of any size.
+    Data that does not fill a full block is kept until the next chunk
+    arrives, and padding is only removed from the final block.
+    """
+
+    def __init__(self, key: bytes, iv: bytes, unpad: bool = False):
+        self.cipher = AES.new(key, AES.MODE_CBC, iv)
+        self.unpad = unpad
+        self.buffer = b""
+
+    def update(self, data: Union[bytes, bytearray, memoryview]) -> bytes:
+        """
+        Decrypt next chunk of data
+
+        :param data: Encrypted data
+        :returns: Decrypted data that is ready to be written
+        """
+        if self.buffer:
+            data = self.buffer + bytes(data)
+        remaining = len(data) % AES.block_size
+        # The last full block might contain padding
+        if self.unpad and remaining == 0:
+            remaining = min(AES.block_size, len(data))
+        ready = len(data) - remaining
+        # `data` might be a view into a buffer that is reused
+        self.buffer = bytes(data[ready:])
+        if ready == 0:
+            return b""
+        return self.cipher.decrypt(data[:ready])
+
+    def finalize(self) -> bytes:
+        """
+        Decrypt the remaining data
+
+        :returns: Last decrypted data without padding
+        :raises ValueError: If the data did not end on a block boundary
+        """
+        if not self.buffer:
+            return b""
+        result = self.cipher.decrypt(self.buffer)
+        self.buffer = b""
+        if self.unpad:
+            result = strip_padding(result)
+        return result
+
+
+def strip_padding(data: bytes) -> bytes:
+    """Remove PKCS#7 padding from `data` if it is valid"""
+    if not data:
+        return data
+    length = data[-1]
+    if 0 < length <= AES.block_size and data[-length:] == bytes([length]) * length:
+        return data[:-length]
+    return data
+
+
+def create_decryptor(encryption_method: Optional[AudiobookFileEncryption]) -> Optional[AESStreamDecryptor]:
+    """Create streaming decryptor for encryption method"""
+    if isinstance(encryption_method, AESEncryption):
+        return AESStreamDecryptor(encryption_method.key, encryption_method.iv, encryption_method.unpad)
+    return None
+
+
 def decrypt_file(path: str, encryption_method: AudiobookFileEncryption):
     """Decrypt encrypted file in place"""
     if isinstance(encryption_method, AESEncryption):
-        decrypt_file_aes(path, encryption_method.key, encryption_method.iv)
-
-def decrypt_file_aes(path: str, key: bytes, iv: bytes):
-    """Decrypt AES encrypted file in place"""
-    with open(path, "rb") as f:
-        cipher = AES.new(key, AES.MODE_CBC, iv)
-        decrypted = cipher.decrypt(f.read())
-    with open(path, "wb") as f:
-        f.write(decrypted)
+        decrypt_file_aes(path, encryption_method.key, encryption_method.iv, encryption_method.unpad)
+
+def decrypt_file_aes(path: str, key: bytes, iv: bytes, unpad: bool = False):
+    """
+    Decrypt AES encrypted file in place.
+    The file is decrypted in blocks, so the whole file is never loaded into
+    memory.
+    """
+    decryptor = AESStreamDecryptor(key, iv, unpad)
+    read_position = 0
+    write_position = 0
+    with open(path, "r+b") as f:
+        while True:
+            f.seek(read_position)
+            data = f.read(DECRYPTION_BUFFER_SIZE)
+            if not data:
+                break
+            read_position += len(data)
+            decrypted = decryptor.update(data)
+            # Decrypted data is never longer than the data read
+            f.seek(write_position)
+            f.write(decrypted)
+            write_position += len(decrypted)
+        f.seek(write_position)
+        f.write(decryptor.finalize())
+        f.truncate()
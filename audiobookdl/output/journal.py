@@ -0,0 +1,183 @@
+from attrs import define, field
+from requests import Response
+
+import os
+import json
+import threading
+from typing import List, Optional
+
+JOURNAL_EXTENSION = "journal"
+
+
+@define
+class ByteRange:
+    # First byte of range
+    start: int
+    # Last byte of range (inclusive)
+    end: int
+    # Number of bytes from `start` written to disk
+    committed: int = 0
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def complete(self) -> bool:
+        return self.committed >= self.size
+
+
+@define
+class DownloadJournal:
+    """
+    Keeps track of which parts of a file have been written to its tmp file,
+    so an interrupted download can be continued later
+    """
+    # Url the file was downloaded from
+    url: str
+    # Size of the complete file
+    total_filesize: int
+    # Byte ranges of the file
+    ranges: List[ByteRange]
+    # Validators from the server
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Location of journal on disk. The journal is only kept in memory if `None`
+    path: Optional[str] = None
+    _lock: threading.Lock = field(factory=threading.Lock, eq=False, repr=False)
+
+    @classmethod
+    def create(cls, url: str, response: Response, total_filesize: int, ranges: List[ByteRange], path: Optional[str]) -> "DownloadJournal":
+        """Create new journal from the response of the first download request"""
+        return cls(
+            url = url,
+            total_filesize = total_filesize,
+            ranges = ranges,
+            etag = response.headers.get("ETag"),
+            last_modified = response.headers.get("Last-Modified"),
+            path = path,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["DownloadJournal"]:
+        """
+        Load journal from disk
+
+        :param path: Location of journal
+        :returns: Journal if it exists and can be read
+        """
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            return cls(
+                url = data["url"],
+                total_filesize = data["total_filesize"],
+                ranges = [ByteRange(*r) for r in data["ranges"]],
+                etag = data.get("etag"),
+                last_modified = data.get("last_modified"),
+                path = path,
+            )
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self) -> None:
+        """Write journal to disk if it has a location"""
+        if self.path is None:
+            return
+        with self._lock:
+            data = {
+                "url": self.url,
+                "total_filesize": self.total_filesize,
+                "etag": self.etag,
+                "last_modified": self.last_modified,
+                "ranges": [[r.start, r.end, r.committed] for r in self.ranges],
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        """Remove journal from disk"""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    @property
+    def committed(self) -> int:
+        """Number of bytes written to disk"""
+        return sum(r.committed for r in self.ranges)
+
+    @property
+    def pending_ranges(self) -> List[ByteRange]:
+        """Byte ranges that are not completely downloaded"""
+        return [r for r in self.ranges if not r.complete]
+
+    def resume_headers(self) -> dict:
+        """
+        Headers for continuing the download of the first pending byte range.
+        The server will send the full file if the validators no longer match.
+        """
+        byte_range = self.pending_ranges[0]
+        headers = { "Range": f"bytes={byte_range.start + byte_range.committed}-{byte_range.end}" }
+        # Weak validators can't be used with If-Range
+        if self.etag and not self.etag.startswith("W/"):
+            headers["If-Range"] = self.etag
+        elif self.last_modified:
+            headers["If-Range"] = self.last_modified
+        return headers
+
+    def matches(self, response: Response) -> bool:
+        """
+        Checks whether `response` continues the same file as the journal
+
+        :param response: Response of request made with `resume_headers`
+        :returns: True if the download can be continued
+        """
+        if response.status_code != 206:
+            return False
+        content_range = response.headers.get("Content-Range", "")
+        if content_range.split("/")[-1] != str(self.total_filesize):
+            return False
+        etag = response.headers.get("ETag")
+        if self.etag and etag and etag != self.etag:
+            return False
+        last_modified = response.headers.get("Last-Modified")
+        if self.last_modified and last_modified and last_modified != self.last_modified:
+            return False
+        return True
+
+
+def can_resume(response: Response) -> bool:
+    """
+    Checks whether the download of `response` can be continued in a later
+    run. Byte ranges count bytes of the encoded body, while downloads write
+    decoded bytes, so only identity encoded responses are used. A strong
+    validator is needed to make sure the server continues the same file.
+
+    :param response: Response of the first download request
+    :returns: True if a journal should be kept for the download
+    """
+    if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+        return False
+    etag = response.headers.get("ETag")
+    return bool(etag and not etag.startswith("W/")) or "Last-Modified" in response.headers
+
+
+def journal_path(filepath_tmp: str) -> str:
+    """Location of journal for tmp file"""
+    return f"{filepath_tmp}.{JOURNAL_EXTENSION}"
+
+
+def load_journal(filepath_tmp: str) -> Optional[DownloadJournal]:
+    """
+    Load journal for tmp file if both exist and the download is unfinished
+
+    :param filepath_tmp: Path of tmp file
+    :returns: Journal for tmp file
+    """
+    journal = DownloadJournal.load(journal_path(filepath_tmp))
+    if journal is None or not journal.pending_ranges:
+        return None
+    if not os.path.exists(filepath_tmp) or os.path.getsize(filepath_tmp) != journal.total_filesize:
+        return None
+    return journal
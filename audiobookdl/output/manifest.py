@@ -0,0 +1,130 @@
+from attrs import define, field
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Optional, Sequence, Set
+
+MANIFEST_FILENAME = ".audiobook-dl-manifest"
+
+
+@define
+class ManifestEntry:
+    # Index of file in audiobook
+    index: int
+    # Name of file in output directory
+    filename: str
+    # Size of file in bytes
+    size: int
+    # Sha256 hash of file
+    sha256: str
+
+
+@define
+class DownloadManifest:
+    """
+    Records which files of a multi-file audiobook have been downloaded
+    completely, so they don't have to be downloaded again if the download
+    fails or is stopped.
+    The manifest is stored as one json object per line, which makes adding
+    an entry a single append to the file.
+    """
+    # Location of manifest on disk
+    path: str
+    # Completed files by index
+    entries: Dict[int, ManifestEntry] = field(factory=dict)
+    _lock: threading.Lock = field(factory=threading.Lock, eq=False, repr=False)
+
+    @classmethod
+    def load(cls, path: str) -> "DownloadManifest":
+        """
+        Load manifest from disk. Lines that can't be read are ignored.
+
+        :param path: Location of manifest
+        :returns: Manifest with all readable entries
+        """
+        result = cls(path)
+        if not os.path.exists(path):
+            return result
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    entry = ManifestEntry(**json.loads(line))
+                    result.entries[entry.index] = entry
+                except (ValueError, TypeError):
+                    continue
+        return result
+
+    def add(self, index: int, filepath: str) -> None:
+        """
+        Record file as completely downloaded
+
+        :param index: Index of file in audiobook
+        :param filepath: Location of downloaded file
+        """
+        entry = ManifestEntry(
+            index = index,
+            filename = os.path.basename(filepath),
+            size = os.path.getsize(filepath),
+            sha256 = hash_file(filepath),
+        )
+        line = json.dumps({
+            "index": entry.index,
+            "filename": entry.filename,
+            "size": entry.size,
+            "sha256": entry.sha256,
+        })
+        with self._lock:
+            self.entries[index] = entry
+            with open(self.path, "a") as f:
+                f.write(f"{line}\n")
+
+    def verified_indices(self, filepaths: Sequence[str]) -> Set[int]:
+        """
+        Find files recorded in the manifest that are still intact on disk
+
+        :param filepaths: Expected locations of all files in audiobook
+        :returns: Indices of files that don't have to be downloaded again
+        """
+        result = set()
+        for index, entry in self.entries.items():
+            if index >= len(filepaths):
+                continue
+            filepath = filepaths[index]
+            if os.path.basename(filepath) != entry.filename \
+                    or not os.path.exists(filepath) \
+                    or os.path.getsize(filepath) != entry.size:
+                continue
+            if hash_file(filepath) == entry.sha256:
+                result.add(index)
+        return result
+
+    def remove(self) -> None:
+        """Remove manifest from disk"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def manifest_path(output_dir: str) -> str:
+    """Location of manifest in output directory"""
+    return os.path.join(output_dir, MANIFEST_FILENAME)
+
+
+def has_manifest(output_dir: str) -> bool:
+    """Returns `True` if `output_dir` contains an unfinished download"""
+    return os.path.exists(manifest_path(output_dir))
+
+
+def load_manifest(output_dir: str) -> DownloadManifest:
+    """Load manifest from output directory"""
+    return DownloadManifest.load(manifest_path(output_dir))
+
+
+def hash_file(filepath: str) -> str:
+    """Calculate sha256 hash of file"""
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
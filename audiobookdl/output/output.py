@@ -1,18 +1,32 @@
 from audiobookdl import logging, AudiobookMetadata
-from audiobookdl.exceptions import FailedCombining
+from audiobookdl.exceptions import FailedCombining, FailedConversion
+from audiobookdl.utils import mp3
 
 import os
 import shutil
 import platform
 import subprocess
-from typing import Sequence, Mapping
+from multiprocessing.pool import ThreadPool
+from typing import BinaryIO, Callable, List, Optional, Sequence, Mapping, Tuple
 
 LOCATION_DEFAULTS = {
     'album': 'NA',
     'artist': 'NA',
 }
 
-COMBINE_CHUNK_SIZE = 500
+# Name of the file listing the inputs of the ffmpeg concat demuxer
+CONCAT_LIST_FILENAME = "concat.txt"
+# Empty space in the ID3 tag of combined mp3 files, so tags and covers can
+# be added later without rewriting the file
+MP3_TAG_PADDING = 512 * 1024
+# Max number of bytes copied by each system call
+COPY_CHUNK_SIZE = 1024 * 1024 * 64
+# Extensions of files in the mp4 container. Audio can be moved between
+# them without encoding
+MP4_FORMATS = ["mp4", "m4a", "m4b"]
+# Memory reserved for each ffmpeg process when converting files at the same
+# time
+CONVERSION_MEMORY = 256 * 1024 * 1024
 
 def gen_output_filename(booktitle: str, file: Mapping[str, str], template: str) -> str:
     """Generates an output filename based on different attributes of the
@@ -24,36 +38,166 @@ def gen_output_filename(booktitle: str, file: Mapping[str, str], template: str)
 
 def combine_audiofiles(filepaths: Sequence[str], tmp_dir: str, output_path: str):
     """
-    Combines the given audiofiles in `path` into a new file
+    Combines the given audiofiles in `path` into a new file.
+    Mp3 files are combined without ffmpeg. Other files are listed in a file
+    for the ffmpeg concat demuxer, so every file is read once and the output
+    is written in a single pass no matter how many files there are.
 
     :param filepaths: Paths to audio files
     :param tmp_dir: Temporary directory with audio files
     :param output_path: Path of combined audio files
     """
     output_extension = get_extension(output_path)
-    tmp_input = os.path.join(tmp_dir, f"input_file.{output_extension}")
     tmp_output = os.path.join(tmp_dir, f"output_file.{output_extension}")
-    shutil.move(filepaths[0], tmp_input)
-    for i in range(1, len(filepaths), COMBINE_CHUNK_SIZE):
-        inputs = "|".join(filepaths[i:i+COMBINE_CHUNK_SIZE])
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-i", f"concat:{tmp_input}|{inputs}",
-                "-safe", "0",
-                "-codec", "copy",
-                tmp_output
-            ],
-            capture_output=not logging.ffmpeg_output,
-        )
-        os.remove(tmp_input)
-        shutil.move(tmp_output, tmp_input)
-    shutil.move(tmp_input, output_path)
-    if not os.path.exists(output_path):
-        raise FailedCombining
+    if output_extension == "mp3" and all(get_extension(path) == "mp3" for path in filepaths):
+        try:
+            combine_mp3_files(filepaths, tmp_output)
+            shutil.move(tmp_output, output_path)
+            shutil.rmtree(tmp_dir)
+            return
+        except ValueError as e:
+            logging.debug(f"Combining mp3 files with ffmpeg: {e}")
+    combine_with_ffmpeg(filepaths, tmp_dir, tmp_output)
+    shutil.move(tmp_output, output_path)
     shutil.rmtree(tmp_dir)
 
 
+def combine_with_ffmpeg(filepaths: Sequence[str], tmp_dir: str, output_path: str):
+    """
+    Combine audio files with the ffmpeg concat demuxer
+
+    :param filepaths: Paths to audio files
+    :param tmp_dir: Directory the list of files is written to
+    :param output_path: Path of combined audio files
+    """
+    concat_list = os.path.join(tmp_dir, CONCAT_LIST_FILENAME)
+    with open(concat_list, "w", encoding="utf-8") as f:
+        for filepath in filepaths:
+            f.write(f"file {quote_concat_path(os.path.abspath(filepath))}\n")
+    result = subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", concat_list,
+            "-codec", "copy",
+            output_path
+        ],
+        capture_output=not logging.ffmpeg_output,
+    )
+    if result.returncode != 0 or not os.path.exists(output_path):
+        raise FailedCombining
+
+
+def combine_mp3_files(filepaths: Sequence[str], output_path: str):
+    """
+    Combine mp3 files by copying their audio frames into a single file.
+    Tags and Xing headers of each file are left out, and a new Xing header
+    and an ID3 tag with the length of the audio are written for the result.
+
+    :param filepaths: Paths to mp3 files
+    :param output_path: Path of combined file
+    :raises ValueError: If the files can't be combined without re-encoding
+    """
+    audio = [mp3.read_audio(path) for path in filepaths]
+    first = audio[0].header
+    for current in audio:
+        if (current.header.version, current.header.sample_rate, current.header.mono) != (first.version, first.sample_rate, first.mono):
+            raise ValueError(f"{current.path} has a different format than {audio[0].path}")
+    frames = sum(current.frames for current in audio)
+    duration = sum(current.duration for current in audio)
+    vbr = any(current.vbr for current in audio) or len({current.header.bitrate for current in audio}) > 1
+    # The size of the Xing frame doesn't depend on its content
+    xing_size = len(mp3.create_xing_frame(first, 0, 0, [0] * mp3.XING_TOC_SIZE, vbr))
+    size = xing_size + sum(current.size for current in audio)
+    toc = combined_toc(audio, xing_size, size, duration)
+    with open(output_path, "wb") as output:
+        output.write(mp3.create_id3v2_tag(round(duration), MP3_TAG_PADDING))
+        output.write(mp3.create_xing_frame(first, frames, size, toc, vbr))
+        for current in audio:
+            with open(current.path, "rb") as f:
+                copy_range(f, output, current.start, current.size)
+
+
+def combined_toc(audio: Sequence[mp3.Mp3Audio], xing_size: int, size: int, duration: float) -> List[int]:
+    """
+    Create Xing seek table for mp3 files combined after a Xing frame
+
+    :param audio: Audio of combined files
+    :param xing_size: Size of Xing frame
+    :param size: Size of all frames
+    :param duration: Duration of all files in milliseconds
+    :returns: Seek table
+    """
+    toc = []
+    index = 0
+    # Start time and position of the current file in the combined file
+    file_start = 0.0
+    file_position = xing_size
+    for percent in range(mp3.XING_TOC_SIZE):
+        time = duration * percent / 100
+        while index < len(audio) - 1 and time >= file_start + audio[index].duration:
+            file_start += audio[index].duration
+            file_position += audio[index].size
+            index += 1
+        position = file_position + audio[index].position(time - file_start)
+        toc.append(min(255, position * 256 // size))
+    return toc
+
+
+def copy_range(source: BinaryIO, destination: BinaryIO, offset: int, size: int):
+    """
+    Copy part of a file to the end of another file. The data is copied in
+    the kernel with `copy_file_range` or `sendfile` when they are available.
+
+    :param source: File opened for reading
+    :param destination: File opened for writing
+    :param offset: Position of data in `source`
+    :param size: Number of bytes to copy
+    """
+    destination.flush()
+    source_fd, destination_fd = source.fileno(), destination.fileno()
+    end = offset + size
+    for copy in (os_copy_file_range, os_sendfile):
+        try:
+            while offset < end:
+                copied = copy(source_fd, destination_fd, offset, min(end - offset, COPY_CHUNK_SIZE))
+                if copied == 0:
+                    break
+                offset += copied
+            if offset >= end:
+                return
+        except (AttributeError, OSError):
+            # Not supported by the system or between these file systems
+            continue
+    source.seek(offset)
+    while offset < end:
+        chunk = source.read(min(end - offset, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise ValueError(f"{source.name} ended before the audio frames")
+        destination.write(chunk)
+        offset += len(chunk)
+
+
+def os_copy_file_range(source_fd: int, destination_fd: int, offset: int, size: int) -> int:
+    return os.copy_file_range(source_fd, destination_fd, size, offset)
+
+
+def os_sendfile(source_fd: int, destination_fd: int, offset: int, size: int) -> int:
+    return os.sendfile(destination_fd, source_fd, offset, size)
+
+
+def quote_concat_path(path: str) -> str:
+    """
+    Quote path for a concat demuxer list file
+
+    :param path: Path of file
+    :returns: Path in single quotes with quotes in the path escaped
+    """
+    return "'" + path.replace("'", "'\\''") + "'"
+
+
 def get_extension(path: str) -> str:
     """
     Get extension from path
@@ -75,30 +219,109 @@ def can_copy_codec(input_format: str, output_format: str) -> bool:
     # TODO Add better verification
     return output_format == "mkv" \
         or output_format == "mka" \
-        or (input_format == "ts" and output_format == "mp3")
-
-
-def convert_output(filenames: Sequence[str], output_format: str):
-    """Converts a list of audio files into another format and return new
-    files"""
-    new_paths = []
-    for old_path in filenames:
-        path_without_ext, old_ext = os.path.splitext(old_path)
-        new_path = f"{path_without_ext}.{output_format}"
-        if not output_format == old_ext:
-            if can_copy_codec(old_ext, output_format):
-                subprocess.run(
-                    ["ffmpeg", "-i", old_path, "-codec", "copy", new_path],
-                    capture_output=not logging.ffmpeg_output
-                )
-            else:
-                subprocess.run(
-                    ["ffmpeg", "-i", old_path, new_path],
-                    capture_output=not logging.ffmpeg_output
-                )
-            os.remove(old_path)
-        new_paths.append(new_path)
-    return new_paths
+        or (input_format == "ts" and output_format == "mp3") \
+        or (input_format in MP4_FORMATS and output_format in MP4_FORMATS)
+
+
+def convert_output(filenames: Sequence[str], output_format: str, on_converted: Optional[Callable[[str], None]] = None) -> List[str]:
+    """
+    Converts a list of audio files into another format and return new
+    files. Files are converted at the same time by a number of ffmpeg
+    processes that fits the cpu and memory of the machine. A file that fails
+    to convert doesn't stop the others.
+
+    :param filenames: Paths of audio files
+    :param output_format: Format to convert to
+    :param on_converted: Called with the path of each file when it is done
+    :returns: Paths of converted files in the order of `filenames`
+    :raises FailedConversion: If any file could not be converted
+    """
+    workers = conversion_workers(len(filenames))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logging.debug(f"Converting {len(filenames)} files with {workers} ffmpeg processes using {threads} threads each")
+
+    def convert(old_path: str) -> Tuple[str, Optional[Exception]]:
+        try:
+            new_path = convert_file(old_path, output_format, threads)
+        except Exception as e:
+            return old_path, e
+        if on_converted:
+            on_converted(new_path)
+        return new_path, None
+
+    with ThreadPool(processes=workers) as pool:
+        results = pool.map(convert, filenames)
+    failed = [path for path, error in results if error]
+    if failed:
+        raise FailedConversion(files="\n".join(f" • {path}" for path in failed))
+    return [path for path, _ in results]
+
+
+def convert_file(old_path: str, output_format: str, threads: int) -> str:
+    """
+    Convert audio file to `output_format`. The original file is only removed
+    after the conversion has succeeded.
+
+    :param old_path: Path of audio file
+    :param output_format: Format to convert to
+    :param threads: Number of threads used by ffmpeg
+    :returns: Path of converted file
+    :raises FailedConversion: If ffmpeg failed
+    """
+    path_without_ext = os.path.splitext(old_path)[0]
+    old_ext = get_extension(old_path)
+    new_path = f"{path_without_ext}.{output_format}"
+    if old_ext == output_format:
+        return old_path
+    tmp_path = f"{path_without_ext}.tmp.{output_format}"
+    command = ["ffmpeg", "-y", "-i", old_path]
+    if can_copy_codec(old_ext, output_format):
+        command += ["-codec", "copy"]
+    command += ["-threads", str(threads), tmp_path]
+    result = subprocess.run(command, capture_output=not logging.ffmpeg_output)
+    if result.returncode != 0 or not os.path.exists(tmp_path):
+        logging.debug(f"Failed to convert {old_path}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise FailedConversion(files=f" • {old_path}")
+    os.remove(old_path)
+    os.rename(tmp_path, new_path)
+    return new_path
+
+
+def conversion_workers(files: int) -> int:
+    """
+    Find number of files that should be converted at the same time. Limited
+    by the number of cpus and the memory available to ffmpeg processes.
+
+    :param files: Number of files to convert
+    :returns: Number of ffmpeg processes
+    """
+    workers = min(files, os.cpu_count() or 1)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, memory // CONVERSION_MEMORY)
+    return max(1, workers)
+
+
+def available_memory() -> Optional[int]:
+    """
+    Find memory available to new processes
+
+    :returns: Available memory in bytes or `None` if it is unknown
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
 
 def get_max_name_length() -> int:
     """
@@ -0,0 +1,198 @@
+from audiobookdl import Audiobook, AudiobookFile, logging
+from audiobookdl.utils import retry
+from audiobookdl.exceptions import NotEnoughSpace
+
+from attrs import define, Factory
+
+import os
+import json
+import shutil
+import requests
+from multiprocessing.pool import ThreadPool
+from rich import filesize
+from typing import List, Optional, Sequence
+
+# Max number of files probed at the same time
+PROBE_CONNECTIONS = 16
+# Seconds to wait for the response of a probe request
+PROBE_TIMEOUT = 10
+# Max number of stream segments probed. The size of the other segments is
+# estimated from them
+MAX_PROBED_SEGMENTS = 16
+
+
+@define
+class PlannedFile:
+    # Index of file in audiobook
+    index: int
+    url: str
+    ext: str
+    # Size of file in bytes if known
+    size: Optional[int] = None
+
+
+@define
+class DownloadPlan:
+    """Files that will be downloaded with their sizes"""
+    # Directory or file path the audiobook is downloaded to
+    output: str
+    files: List[PlannedFile] = Factory(list)
+    # Free space on the volume of `output` in bytes
+    free_space: Optional[int] = None
+
+    @property
+    def total_size(self) -> Optional[int]:
+        """
+        Estimated size of all files. Files with unknown size are assumed to
+        have the average size of the known files.
+        """
+        known = [file.size for file in self.files if file.size is not None]
+        if not known:
+            return None
+        return sum(known) + (len(self.files) - len(known)) * sum(known) // len(known)
+
+    @property
+    def order(self) -> List[int]:
+        """
+        Indices of files in the order they should be downloaded. The largest
+        files are started first, so a large file at the end of the book
+        doesn't leave a long tail of a single download.
+        """
+        known = [file.size for file in self.files if file.size is not None]
+        average = sum(known) // len(known) if known else 0
+        files = sorted(
+            self.files,
+            key = lambda file: file.size if file.size is not None else average,
+            reverse = True,
+        )
+        return [file.index for file in files]
+
+    def as_json(self) -> str:
+        return json.dumps({
+            "output": self.output,
+            "total_size": self.total_size,
+            "unknown_sizes": len([file for file in self.files if file.size is None]),
+            "free_space": self.free_space,
+            "order": self.order,
+            "files": [
+                {
+                    "index": file.index,
+                    "url": file.url,
+                    "ext": file.ext,
+                    "size": file.size,
+                }
+                for file in self.files
+            ],
+        }, indent=2)
+
+
+def create_plan(audiobook: Audiobook, output: str, options, indices: Optional[Sequence[int]] = None) -> DownloadPlan:
+    """
+    Find the size of files in audiobook by probing them concurrently.
+    Streams with many segments of similar size are only sampled.
+
+    :param audiobook: Audiobook to download
+    :param output: Directory or file path the audiobook is downloaded to
+    :param options: Cli options
+    :param indices: Indices of files to plan. All files are planned if not given
+    :returns: Download plan
+    """
+    if indices is None:
+        indices = range(len(audiobook.files))
+    retry_policy = retry.RetryPolicy(retries=options.retries)
+    probed = set(indices)
+    unprobed_segments = [index for index in indices if audiobook.files[index].segment and not audiobook.files[index].byte_range]
+    if len(unprobed_segments) > MAX_PROBED_SEGMENTS:
+        step = len(unprobed_segments) / MAX_PROBED_SEGMENTS
+        sample = {unprobed_segments[int(i * step)] for i in range(MAX_PROBED_SEGMENTS)}
+        probed -= set(unprobed_segments) - sample
+
+    def plan_file(index: int) -> PlannedFile:
+        file = audiobook.files[index]
+        if index not in probed:
+            return PlannedFile(index, file.url, file.ext)
+        try:
+            size = probe_size(audiobook.session, file, retry_policy)
+        except Exception as e:
+            # The size is found when the file is downloaded instead
+            logging.debug(f"Could not find size of {file.url}: {e}")
+            size = None
+        return PlannedFile(index, file.url, file.ext, size)
+
+    connections = max(1, min(len(probed), options.connections, PROBE_CONNECTIONS))
+    with ThreadPool(processes=connections) as pool:
+        files = pool.map(plan_file, indices)
+    plan = DownloadPlan(output, files, free_space(output))
+    logging.debug(
+        f"Planned {len(files)} files with a total size of {plan.total_size} bytes "
+        f"({plan.free_space} bytes free)"
+    )
+    return plan
+
+
+def check_free_space(plan: DownloadPlan, required: Optional[int]) -> None:
+    """
+    Check that there is enough free space on the output volume
+
+    :param plan: Download plan
+    :param required: Bytes that will be written, or `None` if unknown
+    :raises NotEnoughSpace: If `required` is larger than the free space
+    """
+    if required is None or plan.free_space is None:
+        logging.debug("Could not check free space")
+        return
+    if required > plan.free_space:
+        raise NotEnoughSpace(
+            path = plan.output,
+            required = filesize.decimal(required),
+            free = filesize.decimal(plan.free_space),
+        )
+
+
+def probe_size(session: requests.Session, file: AudiobookFile, retry_policy: retry.RetryPolicy) -> Optional[int]:
+    """
+    Find size of file without downloading it. A HEAD request is tried first,
+    and a request for the first byte is used for servers that don't support
+    HEAD requests, like presigned urls only valid for GET.
+
+    :param session: Session used for requests
+    :param file: File to probe
+    :param retry_policy: Policy used to retry failed requests
+    :returns: Size of file in bytes or `None` if it is unknown
+    """
+    if file.byte_range:
+        return file.byte_range[1] - file.byte_range[0] + 1
+    head = lambda: session.head(file.url, headers=file.headers, allow_redirects=True, timeout=PROBE_TIMEOUT)
+    with retry_policy.call(head) as response:
+        content_length = response.headers.get("Content-Length")
+        if response.status_code == 200 and content_length and content_length.isdigit() and int(content_length) > 0:
+            return int(content_length)
+    headers = {**file.headers, "Range": "bytes=0-0"}
+    get = lambda: session.get(file.url, headers=headers, stream=True, timeout=PROBE_TIMEOUT)
+    with retry_policy.call(get) as response:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        if response.status_code == 206 and total.isdigit():
+            return int(total)
+        content_length = response.headers.get("Content-Length")
+        if response.status_code == 200 and content_length and content_length.isdigit():
+            return int(content_length)
+    return None
+
+
+def free_space(path: str) -> Optional[int]:
+    """
+    Find free space on the volume `path` will be written to
+
+    :param path: Path of file or directory that might not exist yet
+    :returns: Free space in bytes or `None` if it could not be found
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
@@ -0,0 +1,336 @@
+from audiobookdl import Audiobook, Chapter, Cover, logging
+from audiobookdl.exceptions import FailedCombining, FailedConversion
+from audiobookdl.utils import program_in_path
+from . import output
+from .metadata import id3
+from .metadata.ffmpeg import create_chapter_text
+
+from attrs import define, Factory
+
+import os
+import shutil
+import subprocess
+from mutagen import File as MutagenFile
+from typing import List, Optional, Sequence, Tuple
+
+# Formats ffmpeg can embed a cover in as an attached picture
+COVER_FORMATS = ["mp3", "mp4", "m4a", "m4b"]
+# Cover image formats supported by all cover formats
+COVER_IMAGE_EXTENSIONS = ["jpg", "jpeg", "png"]
+# ffmpeg demuxers of formats that can be read from a pipe while downloading.
+# Mp4 files are not included, since they are only readable when seekable
+STREAM_INPUT_FORMATS = {"mp3": "mp3", "aac": "aac", "ts": "mpegts"}
+
+
+@define
+class PostProcessPlan:
+    """
+    Steps done to downloaded files in a single ffmpeg run. The files are
+    combined, converted, and chapters and cover are embedded while the
+    output is written once.
+    """
+    # Downloaded files in order
+    inputs: List[str]
+    output_path: str
+    # Copy audio stream instead of encoding it
+    copy_codec: bool
+    # Directory with downloaded files removed after processing
+    tmp_dir: Optional[str] = None
+    chapters: List[Chapter] = Factory(list)
+    # Duration of audio in milliseconds used as end of the last chapter
+    duration: Optional[float] = None
+    cover: Optional[Cover] = None
+    # Demuxer of input read from stdin
+    input_format: Optional[str] = None
+
+
+    def command(self, concat_list: Optional[str], metadata_path: Optional[str], cover_path: Optional[str], tmp_output: str) -> List[str]:
+        """
+        Create ffmpeg command for plan
+
+        :param concat_list: List of inputs for the concat demuxer if there are several inputs
+        :param metadata_path: FFMETADATA file with chapters
+        :param cover_path: Path of cover image
+        :param tmp_output: Path the output is written to
+        :returns: ffmpeg arguments
+        """
+        command = ["ffmpeg", "-y"]
+        if concat_list:
+            command += ["-f", "concat", "-safe", "0", "-i", concat_list]
+        elif self.input_format:
+            command += ["-f", self.input_format, "-i", "pipe:0"]
+        else:
+            command += ["-i", self.inputs[0]]
+        maps = ["-map", "0:a"]
+        input_index = 1
+        if metadata_path:
+            command += ["-i", metadata_path]
+            maps += ["-map_chapters", str(input_index)]
+            input_index += 1
+        if cover_path:
+            command += ["-i", cover_path]
+            maps += ["-map", f"{input_index}:v", "-c:v", "copy", "-disposition:v:0", "attached_pic"]
+        command += maps
+        if self.copy_codec:
+            command += ["-c:a", "copy"]
+        return command + ["-metadata:s:a:0", "title=", tmp_output]
+
+
+def plan_post_processing(audiobook: Audiobook, filepaths: Sequence[str], output_dir: str, current_format: str, output_format: str, options) -> Optional[PostProcessPlan]:
+    """
+    Plan fused post-processing of downloaded files. Only used when the
+    result is a single file and ffmpeg has to rewrite the audio anyway,
+    since edits that only change tags are done in place.
+
+    :param audiobook: Downloaded audiobook
+    :param filepaths: Downloaded files
+    :param output_dir: Output location of audiobook
+    :param current_format: Format of downloaded files
+    :param output_format: Format of output
+    :param options: Cli options
+    :returns: Plan or `None` if the files should be processed step by step
+    """
+    combine = len(filepaths) > 1
+    if (combine and not options.combine) or not program_in_path("ffmpeg"):
+        return None
+    # Mp3 files are combined without ffmpeg and get chapters in their ID3 tag
+    combine_with_ffmpeg = combine and not (current_format == "mp3" and output_format == "mp3")
+    add_chapters = bool(audiobook.chapters) and not options.no_chapters
+    chapters_with_ffmpeg = add_chapters and not id3.is_id3_file(f"file.{output_format}")
+    if not (combine_with_ffmpeg or current_format != output_format or chapters_with_ffmpeg):
+        return None
+    if combine:
+        output_path = f"{output_dir}.{output_format}"
+    else:
+        output_path = f"{os.path.splitext(filepaths[0])[0]}.{output_format}"
+    plan = PostProcessPlan(
+        inputs = list(filepaths),
+        output_path = output_path,
+        copy_codec = current_format == output_format or output.can_copy_codec(current_format, output_format),
+        tmp_dir = output_dir if combine else None,
+    )
+    if add_chapters:
+        plan.duration = media_duration(audiobook, filepaths)
+    add_chapters_and_cover(plan, audiobook, output_format, add_chapters)
+    return plan
+
+
+def plan_stream_processing(audiobook: Audiobook, output_dir: str, options) -> Optional[PostProcessPlan]:
+    """
+    Plan conversion of audiobook while it is downloaded. The downloaded
+    bytes are written to ffmpeg in order, so the book has to be a single
+    stream in a format ffmpeg can read from a pipe.
+
+    :param audiobook: Audiobook to download
+    :param output_dir: Output location of audiobook
+    :param options: Cli options
+    :returns: Plan or `None` if the audiobook can't be converted while downloading
+    """
+    current_format = audiobook.files[0].ext
+    output_format = options.output_format
+    if not output_format or output_format == current_format \
+            or current_format not in STREAM_INPUT_FORMATS \
+            or not program_in_path("ffmpeg"):
+        return None
+    plan = PostProcessPlan(
+        inputs = ["pipe:0"],
+        output_path = f"{output_dir}.{output_format}",
+        copy_codec = output.can_copy_codec(current_format, output_format),
+        input_format = STREAM_INPUT_FORMATS[current_format],
+    )
+    add_chapters = bool(audiobook.chapters) and not options.no_chapters
+    # The files don't exist yet, so the duration has to be known by the source
+    if add_chapters and all(file.duration for file in audiobook.files):
+        plan.duration = sum(file.duration for file in audiobook.files) # type: ignore[misc]
+    add_chapters_and_cover(plan, audiobook, output_format, add_chapters)
+    return plan
+
+
+def add_chapters_and_cover(plan: PostProcessPlan, audiobook: Audiobook, output_format: str, add_chapters: bool) -> None:
+    """Embed chapters and cover of `audiobook` with plan if ffmpeg supports it"""
+    if add_chapters and plan.duration is not None:
+        plan.chapters = list(audiobook.chapters)
+    cover = audiobook.cover
+    if cover and cover.extension in COVER_IMAGE_EXTENSIONS and output_format in COVER_FORMATS:
+        plan.cover = cover
+
+
+def media_duration(audiobook: Audiobook, filepaths: Sequence[str]) -> Optional[float]:
+    """
+    Find duration of downloaded files from the durations in the audiobook or
+    by reading the files
+
+    :returns: Duration in milliseconds or `None` if it is unknown
+    """
+    if len(audiobook.files) > 0 and all(file.duration for file in audiobook.files):
+        return sum(file.duration for file in audiobook.files) # type: ignore[misc]
+    duration = 0.0
+    for filepath in filepaths:
+        audio = MutagenFile(filepath)
+        if audio is None or not audio.info.length:
+            return None
+        duration += audio.info.length * 1000
+    return duration
+
+
+def run_post_processing(plan: PostProcessPlan) -> str:
+    """
+    Combine, convert and embed chapters and cover in a single ffmpeg run
+
+    :param plan: Post-processing plan
+    :returns: Path of output
+    """
+    base, extension = os.path.splitext(plan.output_path)
+    tmp_output = f"{base}.tmp{extension}"
+    tmp_files = []
+    concat_list = None
+    if len(plan.inputs) > 1:
+        concat_list = f"{base}.{output.CONCAT_LIST_FILENAME}"
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for filepath in plan.inputs:
+                f.write(f"file {output.quote_concat_path(os.path.abspath(filepath))}\n")
+        tmp_files.append(concat_list)
+    try:
+        metadata_path, cover_path = write_metadata_inputs(plan, tmp_files)
+        command = plan.command(concat_list, metadata_path, cover_path, tmp_output)
+        logging.debug(f"Running {' '.join(command)}")
+        result = subprocess.run(command, capture_output=not logging.ffmpeg_output)
+    finally:
+        remove_files(tmp_files)
+    if result.returncode != 0 or not os.path.exists(tmp_output):
+        remove_files([tmp_output])
+        raise FailedCombining
+    if plan.tmp_dir:
+        shutil.rmtree(plan.tmp_dir)
+    else:
+        os.remove(plan.inputs[0])
+    os.rename(tmp_output, plan.output_path)
+    return plan.output_path
+
+
+class StreamProcessor:
+    """
+    Writable output that pipes bytes into a running ffmpeg process, so the
+    audio is converted while it is downloaded
+    """
+
+    def __init__(self, plan: PostProcessPlan):
+        self.plan = plan
+        base, extension = os.path.splitext(plan.output_path)
+        self.tmp_output = f"{base}.tmp{extension}"
+        self.tmp_files: List[str] = []
+        try:
+            metadata_path, cover_path = write_metadata_inputs(plan, self.tmp_files)
+            command = plan.command(None, metadata_path, cover_path, self.tmp_output)
+            logging.debug(f"Running {' '.join(command)}")
+            self.process = subprocess.Popen(
+                command,
+                stdin = subprocess.PIPE,
+                stdout = subprocess.DEVNULL,
+                # Captured output would have to be read while writing to stdin
+                stderr = None if logging.ffmpeg_output else subprocess.DEVNULL,
+            )
+        except Exception:
+            remove_files(self.tmp_files)
+            raise
+
+
+    def __enter__(self) -> "StreamProcessor":
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
+
+
+    def write(self, data: bytes) -> int:
+        """
+        Write bytes to ffmpeg
+
+        :raises FailedConversion: If ffmpeg has stopped
+        """
+        assert self.process.stdin is not None
+        try:
+            return self.process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            raise FailedConversion(files=f" • {self.plan.output_path}")
+
+
+    def finish(self) -> str:
+        """
+        Wait for ffmpeg to convert the remaining audio
+
+        :returns: Path of output
+        :raises FailedConversion: If ffmpeg failed
+        """
+        assert self.process.stdin is not None
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        remove_files(self.tmp_files)
+        if returncode != 0 or not os.path.exists(self.tmp_output):
+            remove_files([self.tmp_output])
+            raise FailedConversion(files=f" • {self.plan.output_path}")
+        os.rename(self.tmp_output, self.plan.output_path)
+        return self.plan.output_path
+
+
+    def abort(self) -> None:
+        """Stop ffmpeg and remove the partial output"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        if self.process.stdin:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        remove_files(self.tmp_files + [self.tmp_output])
+
+
+def write_metadata_inputs(plan: PostProcessPlan, tmp_files: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Write chapters and cover of plan to files ffmpeg can read
+
+    :param plan: Post-processing plan
+    :param tmp_files: List the paths of the written files are added to
+    :returns: Path of FFMETADATA file and cover
+    """
+    base = os.path.splitext(plan.output_path)[0]
+    metadata_path = cover_path = None
+    if plan.chapters:
+        metadata_path = f"{base}.chapters.txt"
+        tmp_files.append(metadata_path)
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            f.write(create_ffmetadata(plan.chapters, plan.duration or 0))
+    if plan.cover:
+        cover_path = f"{base}.cover.{plan.cover.extension}"
+        tmp_files.append(cover_path)
+        with open(cover_path, "wb") as f:
+            f.write(plan.cover.image)
+    return metadata_path, cover_path
+
+
+def remove_files(paths: Sequence[str]) -> None:
+    """Remove files that exist"""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_ffmetadata(chapters: Sequence[Chapter], duration: float) -> str:
+    """
+    Create FFMETADATA file with chapters
+
+    :param chapters: Chapters of audiobook
+    :param duration: Duration of audio in milliseconds
+    :returns: Content of file
+    """
+    result = ";FFMETADATA1\n"
+    for i, chapter in enumerate(chapters):
+        end = chapters[i+1].start if i + 1 < len(chapters) else int(duration)
+        result += create_chapter_text(chapter.title, chapter.start, end)
+    return result
@@ -0,0 +1,252 @@
+from attrs import define, Factory
+
+import json
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+
+# Seconds between each progress report
+REPORT_INTERVAL = 0.5
+# Weight of the newest sample in the download speed
+SPEED_SMOOTHING = 0.3
+
+
+@define
+class FileProgress:
+    # One of `queued`, `downloading`, `done` or `reused`
+    state: str = "queued"
+    # Size of file in bytes if known
+    size: Optional[int] = None
+    # Bytes present on disk from an earlier run
+    resumed: int = 0
+    # Bytes downloaded in this run
+    downloaded: int = 0
+
+
+@define
+class ProgressSnapshot:
+    # Bytes on disk for all files
+    completed: int
+    # Estimated size of all files
+    total: Optional[int]
+    # Download speed in bytes per second
+    speed: float
+    # Estimated seconds remaining
+    eta: Optional[float]
+    files: List[FileProgress] = Factory(list)
+
+    @property
+    def finished_files(self) -> int:
+        return len([f for f in self.files if f.state in ("done", "reused")])
+
+    def as_json(self) -> str:
+        return json.dumps({
+            "completed": self.completed,
+            "total": self.total,
+            "speed": round(self.speed),
+            "eta": round(self.eta) if self.eta is not None else None,
+            "files": [
+                {
+                    "state": f.state,
+                    "size": f.size,
+                    "completed": f.resumed + f.downloaded,
+                }
+                for f in self.files
+            ]
+        })
+
+
+ProgressReporter = Callable[[ProgressSnapshot], None]
+
+
+class ProgressTracker:
+    """
+    Tracks download progress of all files in an audiobook.
+
+    Download threads only increment counters that belong to the thread
+    itself, so no locks are taken while downloading. The counters are summed
+    up when a snapshot is taken.
+    """
+
+    def __init__(self, file_count: int):
+        self.files = [FileProgress() for _ in range(file_count)]
+        self._local = threading.local()
+        self._counters: List[Dict[int, int]] = []
+        self._counters_lock = threading.Lock()
+
+
+    def add_bytes(self, index: int, size: int) -> None:
+        """
+        Record downloaded bytes for file
+
+        :param index: Index of file in audiobook
+        :param size: Number of downloaded bytes
+        """
+        try:
+            counters = self._local.counters
+        except AttributeError:
+            counters = self._local.counters = {}
+            with self._counters_lock:
+                self._counters.append(counters)
+        counters[index] = counters.get(index, 0) + size
+
+
+    def remove_bytes(self, index: int, size: int) -> None:
+        """
+        Remove bytes recorded by a download attempt that failed or lost to a
+        hedged attempt, since they are downloaded again by another attempt
+
+        :param index: Index of file in audiobook
+        :param size: Number of bytes recorded by the attempt
+        """
+        if size:
+            self.add_bytes(index, -size)
+
+
+    def plan_file(self, index: int, size: Optional[int]) -> None:
+        """
+        Set size of file before it is downloaded
+
+        :param index: Index of file in audiobook
+        :param size: Size of file if known
+        """
+        self.files[index].size = size
+
+
+    def start_file(self, index: int, size: Optional[int], resumed: int = 0) -> None:
+        """
+        Mark file as being downloaded
+
+        :param index: Index of file in audiobook
+        :param size: Size of file if known
+        :param resumed: Bytes downloaded in an earlier run
+        """
+        file = self.files[index]
+        file.size = size
+        file.resumed = resumed
+        file.state = "downloading"
+
+
+    def finish_file(self, index: int) -> None:
+        """Mark file as completely downloaded"""
+        self.files[index].state = "done"
+
+
+    def reuse_file(self, index: int, size: int) -> None:
+        """Mark file as downloaded in an earlier run"""
+        file = self.files[index]
+        file.size = size
+        file.resumed = size
+        file.state = "reused"
+
+
+    def downloaded(self) -> int:
+        """Total number of bytes downloaded in this run"""
+        return sum(self._downloaded_by_file().values())
+
+
+    def _downloaded_by_file(self) -> Dict[int, int]:
+        with self._counters_lock:
+            all_counters = list(self._counters)
+        result: Dict[int, int] = {}
+        for counters in all_counters:
+            for index, size in counters.copy().items():
+                result[index] = result.get(index, 0) + size
+        return result
+
+
+    def snapshot(self, speed: float = 0) -> ProgressSnapshot:
+        """
+        Create snapshot of the current progress
+
+        :param speed: Current download speed in bytes per second
+        :returns: Snapshot of progress
+        """
+        downloaded = self._downloaded_by_file()
+        files = []
+        for index, file in enumerate(self.files):
+            # Removed attempts can include bytes cut off at the end of a byte range
+            current = FileProgress(file.state, file.size, file.resumed, max(downloaded.get(index, 0), 0))
+            if current.size is None and current.state == "done":
+                current.size = current.resumed + current.downloaded
+            files.append(current)
+        completed = sum(f.resumed + f.downloaded for f in files)
+        total = estimate_total_size(files)
+        eta = None
+        if total is not None and speed > 0:
+            eta = max(total - completed, 0) / speed
+        return ProgressSnapshot(completed, total, speed, eta, files)
+
+
+def estimate_total_size(files: List[FileProgress]) -> Optional[int]:
+    """
+    Estimate size of all files. Files with unknown size are assumed to have
+    the average size of the known files.
+
+    :param files: Progress of all files
+    :returns: Estimated size in bytes or `None` if no sizes are known
+    """
+    known_sizes = [f.size for f in files if f.size is not None]
+    if not known_sizes:
+        return None
+    unknown = len(files) - len(known_sizes)
+    return sum(known_sizes) + unknown * sum(known_sizes) // len(known_sizes)
+
+
+class ProgressRenderer:
+    """
+    Samples a `ProgressTracker` from a separate thread at a fixed interval and
+    sends snapshots to all reporters
+    """
+
+    def __init__(self, tracker: ProgressTracker, reporters: List[ProgressReporter], interval: float = REPORT_INTERVAL):
+        self.tracker = tracker
+        self.reporters = reporters
+        self.interval = interval
+        self.speed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._last_time = time.monotonic()
+        self._last_downloaded = 0
+
+
+    def __enter__(self) -> "ProgressRenderer":
+        if self.reporters:
+            self._thread.start()
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        if self.reporters:
+            self._stop.set()
+            self._thread.join()
+            self.report()
+
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.report()
+
+
+    def report(self) -> None:
+        """Send snapshot of current progress to all reporters"""
+        now = time.monotonic()
+        downloaded = self.tracker.downloaded()
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            # Downloaded bytes decrease when a failed attempt is removed
+            current_speed = max(downloaded - self._last_downloaded, 0) / elapsed
+            if self.speed == 0:
+                self.speed = current_speed
+            else:
+                self.speed = SPEED_SMOOTHING * current_speed + (1 - SPEED_SMOOTHING) * self.speed
+        self._last_time = now
+        self._last_downloaded = downloaded
+        snapshot = self.tracker.snapshot(self.speed)
+        for reporter in self.reporters:
+            reporter(snapshot)
+
+
+def json_reporter(snapshot: ProgressSnapshot) -> None:
+    """Print progress as a single line of json"""
+    print(snapshot.as_json(), flush=True)
@@ -0,0 +1,276 @@
+from audiobookdl import logging
+from audiobookdl.exceptions import DownloadStalled
+
+import math
+import time
+import threading
+from requests import Response
+from typing import Any, Callable, List, Optional, TypeVar
+
+# Seconds between each check of running downloads
+WATCHDOG_INTERVAL = 0.5
+# Seconds throughput is measured over before a download counts as stalled
+STALL_WINDOW = 20.0
+# Downloads slower than this many bytes per second are stopped and retried
+MIN_THROUGHPUT = 1024 * 4
+# Number of finished downloads required before slow downloads are hedged
+MIN_HEDGE_SAMPLES = 10
+# Max share of downloads that are hedged
+MAX_HEDGE_RATIO = 0.1
+
+T = TypeVar("T")
+
+
+class DownloadCancelled(Exception):
+    """Raised in a download attempt that lost to a hedged attempt"""
+
+
+class DownloadAttempt:
+    """A single attempt at downloading a file"""
+
+    def __init__(self, hedge: bool):
+        # Whether this is a duplicate of a slow download
+        self.hedge = hedge
+        self.start = time.monotonic()
+        self.bytes = 0
+        self.responses: List[Response] = []
+        self.cancelled = False
+        self.stalled = False
+        # Seconds spent waiting for the rate limit
+        self.throttled = 0.0
+        self._window_start = self.start
+        self._window_bytes = 0
+        self._window_throttled = 0.0
+
+
+    def add_response(self, response: Response) -> None:
+        """Register response the attempt is reading from"""
+        self.responses.append(response)
+
+
+    def check(self) -> None:
+        """
+        Raise error if the attempt has been stopped by the watchdog.
+        Should be called by the download thread.
+        """
+        if self.cancelled:
+            raise DownloadCancelled
+        if self.stalled:
+            raise DownloadStalled
+
+
+    def abort(self) -> None:
+        """Shut down connections so reads blocking the download thread fail"""
+        for response in self.responses:
+            try:
+                # `shutdown` was added in urllib3 2.3
+                shutdown = getattr(response.raw, "shutdown", None)
+                if shutdown:
+                    shutdown()
+                else:
+                    response.close()
+            except Exception:
+                pass
+
+
+    def throttle(self, delay: float) -> None:
+        """
+        Wait for the rate limit. Time spent waiting doesn't count against the
+        throughput of the attempt, so limited downloads are not stalled.
+
+        :param delay: Seconds to wait
+        """
+        self.throttled += delay
+        time.sleep(delay)
+
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self.abort()
+
+
+    def check_throughput(self, now: float) -> None:
+        """Stop attempt if it has been too slow during the last window"""
+        elapsed = now - self._window_start
+        if elapsed < STALL_WINDOW:
+            return
+        active = max(elapsed - (self.throttled - self._window_throttled), 0)
+        if self.bytes - self._window_bytes < MIN_THROUGHPUT * active:
+            logging.debug(f"Download stalled at {self.bytes} bytes")
+            self.stalled = True
+            self.abort()
+        self._window_start = now
+        self._window_bytes = self.bytes
+        self._window_throttled = self.throttled
+
+
+class FileDownload:
+    """
+    Download of a single file, which can consist of a primary and a hedged
+    attempt. The first attempt to finish wins, and the other is cancelled.
+    """
+
+    def __init__(self, function: Callable[[DownloadAttempt], Any], discarded: Optional[Callable[[DownloadAttempt], None]] = None):
+        self.function = function
+        # Called with attempts that finished after another attempt had won
+        self.discarded = discarded
+        self.start = time.monotonic()
+        self.attempts: List[DownloadAttempt] = []
+        self.running = 0
+        self.result: Optional[Any] = None
+        self.error: Optional[Exception] = None
+        self._condition = threading.Condition()
+
+
+    @property
+    def hedged(self) -> bool:
+        return len(self.attempts) > 1
+
+
+    def start_attempt(self, hedge: bool) -> Optional[DownloadAttempt]:
+        """Create new attempt if the download is not finished"""
+        with self._condition:
+            if self.result is not None or (self.attempts and self.running == 0):
+                return None
+            attempt = DownloadAttempt(hedge)
+            self.attempts.append(attempt)
+            self.running += 1
+            return attempt
+
+
+    def run(self, attempt: DownloadAttempt) -> None:
+        """Run attempt and record the result"""
+        try:
+            result = self.function(attempt)
+        except Exception as e:
+            with self._condition:
+                self.running -= 1
+                if not isinstance(e, DownloadCancelled) and self.error is None:
+                    self.error = e
+                self._condition.notify_all()
+            return
+        with self._condition:
+            self.running -= 1
+            won = self.result is None
+            if won:
+                self.result = result
+                for other in self.attempts:
+                    if other is not attempt:
+                        other.cancel()
+            self._condition.notify_all()
+        if not won and self.discarded:
+            self.discarded(attempt)
+
+
+    def wait(self) -> Any:
+        """
+        Wait until an attempt succeeds or all attempts have failed
+
+        :returns: Result of the successful attempt
+        """
+        with self._condition:
+            while self.result is None and self.running > 0:
+                self._condition.wait()
+            if self.result is not None:
+                return self.result
+            raise self.error or DownloadCancelled
+
+
+class DownloadWatchdog:
+    """
+    Monitors running downloads from a separate thread.
+    Downloads that are slower than `MIN_THROUGHPUT` are stopped, so they can
+    be retried. When hedging is enabled, downloads that take longer than the
+    given percentile of the finished downloads are started a second time,
+    and the first attempt to finish is used.
+    """
+
+    def __init__(self, hedge_percentile: Optional[float]):
+        self.hedge_percentile = hedge_percentile
+        self.downloads: List[FileDownload] = []
+        self.durations: List[float] = []
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def __enter__(self) -> "DownloadWatchdog":
+        self._thread.start()
+        return self
+
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+    def download(self, function: Callable[[DownloadAttempt], T], discarded: Optional[Callable[[DownloadAttempt], None]] = None) -> T:
+        """
+        Download file while monitoring it
+
+        :param function: Function downloading the file with a given attempt
+        :param discarded: Called with attempts that finished after another attempt
+        :returns: Result of `function`, like the path of the downloaded file
+        """
+        download = FileDownload(function, discarded)
+        attempt = download.start_attempt(hedge = False)
+        assert attempt is not None
+        with self._lock:
+            self.downloads.append(download)
+        try:
+            download.run(attempt)
+            result = download.wait()
+            with self._lock:
+                self.durations.append(time.monotonic() - download.start)
+            return result
+        finally:
+            with self._lock:
+                self.downloads.remove(download)
+
+
+    def _run(self) -> None:
+        while not self._stop.wait(WATCHDOG_INTERVAL):
+            now = time.monotonic()
+            with self._lock:
+                downloads = list(self.downloads)
+                threshold = self.hedge_threshold()
+            for download in downloads:
+                for attempt in download.attempts:
+                    attempt.check_throughput(now)
+                if threshold is not None and not download.hedged and now - download.start > threshold:
+                    self._hedge(download)
+
+
+    def hedge_threshold(self) -> Optional[float]:
+        """Duration after which downloads are hedged"""
+        if not self.hedge_percentile or len(self.durations) < MIN_HEDGE_SAMPLES:
+            return None
+        if self.hedges >= MAX_HEDGE_RATIO * len(self.durations):
+            return None
+        return percentile(self.durations, self.hedge_percentile)
+
+
+    def _hedge(self, download: FileDownload) -> None:
+        attempt = download.start_attempt(hedge = True)
+        if attempt is None:
+            return
+        self.hedges += 1
+        logging.debug(f"Hedging download after {time.monotonic() - download.start:.2f} seconds")
+        threading.Thread(target=download.run, args=(attempt,), daemon=True).start()
+
+
+    def summary(self) -> Optional[str]:
+        """Summary of download durations"""
+        if len(self.durations) < 2:
+            return None
+        p50 = percentile(self.durations, 50)
+        p99 = percentile(self.durations, 99)
+        return f"Download time per file: p50 {p50:.2f} s, p99 {p99:.2f} s, {self.hedges} hedged"
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of `values`"""
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(p / 100 * len(ordered))))
+    return ordered[rank - 1]
@@ -17,6 +17,7 @@ class BookBeatSource(Source):
     _authentication_methods = [
         "login",
     ]
+    split = 4
     saved_books: dict
     book_info: dict
 
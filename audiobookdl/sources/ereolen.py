@@ -15,6 +15,7 @@ class EreolenSource(Source):
         "login"
     ]
     names = [ "eReolen" ]
+    http2 = True
     login_data = [ "username", "password", "library" ]
     match = [
         r"https?://ereolen.dk/ting/object/.+"
@@ -15,6 +15,7 @@ class EverandSource(Source[str]):
         r"https?://(www.)?(scribd|everand).com/series/\d+"
     ]
     names = [ "Everand", "Scribd" ]
+    http2 = True
 
     def download(self, url: str) -> Result:
         # Matches series url
@@ -20,6 +20,7 @@ class KubusSource(Source):
     ]
     names = [ "Kubus" ]
     _authentication_methods: list[str] = []
+    split = 4
     def download(self, url: str) -> Result:
         # Matches series url
         if re.match(self.match[1], url):
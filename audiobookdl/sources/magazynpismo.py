@@ -32,6 +32,7 @@ class PismoSource(Source):
 
     _authentication_methods = ["login"]
     login_data = ["username", "password"]
+    split = 4
 
     SLEDZTWO_SEASON_RE = re.compile(r"/sezon-(\d+)")
 
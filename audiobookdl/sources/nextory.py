@@ -28,6 +28,7 @@ class NextorySource(Source):
         r"https?://((www|catalog-\w\w).)?nextory.+",
     ]
     names = [ "Nextory" ]
+    http2 = True
     _authentication_methods = [
         "login",
     ]
@@ -182,15 +183,12 @@ class NextorySource(Source):
 
 
     def get_files(self, audio_data) -> List[AudiobookFile]:
-        files = []
-        for file in audio_data["files"]:
-            # master url redirects to media url
-            # TODO Handle redirect correctly
-            media_url = file["uri"].replace("master", "media")
-            files.extend(
-                self.get_stream_files(media_url, headers=self._session.headers)
-            )
-        return files
+        # Master urls redirect to media playlists, which is handled when the
+        # playlists are loaded
+        return self.get_multiple_stream_files(
+            [file["uri"] for file in audio_data["files"]],
+            headers = self._session.headers
+        )
 
 
     def get_metadata(self, book_info) -> AudiobookMetadata:
@@ -18,6 +18,7 @@ class PodimoSource(Source[dict]):
     _authentication_methods = [
         "login"
     ]
+    split = 4
 
 
     def _login(self, url: str, username: str, password: str) -> None:
@@ -138,8 +139,8 @@ class PodimoSource(Source[dict]):
         )
         file_url = response.json()["data"]["podcastEpisodeStreamMediaById"]["url"]
         if "m3u8" in file_url:
-            audio_url = file_url.replace("main.m3u8", "stream_audio_high/stream.m3u8")
-            return self.get_stream_files(audio_url)
+            # The variant is chosen from the master playlist by `--quality`
+            return self.get_stream_files(file_url)
         else:
             return [ AudiobookFile( url = file_url, ext = "mp3" ) ]
 
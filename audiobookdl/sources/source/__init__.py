@@ -2,10 +2,13 @@
 from . import networking
 from audiobookdl import logging, AudiobookFile, Chapter, AudiobookMetadata, Cover, Result, Audiobook, BookId
 from audiobookdl.exceptions import DataNotPresent, GenericAudiobookDLException
-from audiobookdl.utils import CustomSSLContextHTTPAdapter
+from audiobookdl.utils import CustomSSLContextHTTPAdapter, http2
+from audiobookdl.utils.retry import RetryPolicy
+from audiobookdl.utils.quality import Quality
 
 # External imports
 import requests
+from requests.adapters import HTTPAdapter
 import lxml.html
 from lxml.cssselect import CSSSelector
 import re
@@ -31,6 +34,12 @@ class Source(Generic[T]):
     _authentication_methods: List[str] = [ "cookies" ]
     # Create database directory for source
     create_storage_dir: bool = False
+    # Number of byte ranges single files are downloaded in at the same time
+    split: int = 1
+    # Max number of connections to each host
+    connections: int = 20
+    # Use HTTP/2 when the server supports it
+    http2: bool = False
     # If cookies are loaded
     __authenticated = False
     # Cache of previously loaded pages
@@ -40,6 +49,9 @@ class Source(Generic[T]):
         self.database_directory = os.path.join(options.database_directory, self.name)
         self.skip_downloaded = options.skip_downloaded
         self._session: requests.Session = self.create_session(options)
+        self._retry_policy = RetryPolicy(retries=options.retries)
+        # Policy for choosing between stream variants with different bitrates
+        self.quality: Quality = options.quality
         if self.create_storage_dir:
             os.makedirs(self.database_directory, exist_ok=True)
 
@@ -175,6 +187,9 @@ class Source(Generic[T]):
     post_json = networking.post_json
     get_json = networking.get_json
     get_stream_files = networking.get_stream_files
+    get_multiple_stream_files = networking.get_multiple_stream_files
+    load_playlist = networking.load_playlist
+    playlist_files = networking.playlist_files
 
     def create_ssl_context(self, options: Any) -> SSLContext:
         try:
@@ -195,6 +210,18 @@ class Source(Generic[T]):
     def create_session(self, options: Any) -> requests.Session:
         session = requests.Session()
         ssl_context: SSLContext = self.create_ssl_context(options)
+        # Connection pools are sized to the number of download threads and
+        # block when all connections are in use, so connections are reused
+        # instead of being discarded
+        pool_options = {
+            "pool_maxsize": options.connections,
+            "pool_block": True,
+        }
         # session.adapters.pop("https://", None)
-        session.mount("https://", CustomSSLContextHTTPAdapter(ssl_context))
+        https_adapter = http2.create_adapter(ssl_context, options.connections) if options.http2 else None
+        if https_adapter:
+            session.mount("https://", https_adapter)
+        else:
+            session.mount("https://", CustomSSLContextHTTPAdapter(ssl_context, **pool_options))
+        session.mount("http://", HTTPAdapter(**pool_options))
         return session
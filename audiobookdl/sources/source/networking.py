@@ -1,16 +1,26 @@
 from audiobookdl import AudiobookFile, exceptions, logging
 from audiobookdl.utils.audiobook import AESEncryption
+from audiobookdl.utils.quality import Quality, select_variant
 
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
+from multiprocessing.pool import ThreadPool
 import json
 import os
 import m3u8
 import requests
 
+# Max number of playlists or keys downloaded at the same time
+PLAYLIST_CONNECTIONS = 8
+# Max number of master playlists followed before a media playlist is found
+MAX_PLAYLIST_DEPTH = 3
 
-def post(self, url: str, **kwargs) -> bytes:
+
+def post(self, url: str, idempotent: bool = False, **kwargs) -> bytes:
     """Make post request with `Source` session"""
-    resp = self._session.post(url, **kwargs)
+    resp = self._retry_policy.call(
+        lambda: self._session.post(url, **kwargs),
+        idempotent = idempotent
+    )
     if resp.status_code == 200:
         return resp.content
     logging.debug(f"Failed to download data from: {url}\nResponse:\n{resp.content}")
@@ -20,13 +30,8 @@ def post(self, url: str, **kwargs) -> bytes:
 def get(self, url: str, force_cookies: bool = False, **kwargs) -> bytes:
     """Make get request with `Source` session"""
     if force_cookies:
-        resp = self._session.get(
-            url,
-            cookies=_get_all_cookies(self._session),
-            **kwargs
-        )
-    else:
-        resp = self._session.get(url, **kwargs)
+        kwargs["cookies"] = _get_all_cookies(self._session)
+    resp = self._retry_policy.call(lambda: self._session.get(url, **kwargs))
     if resp.status_code == 200:
         return resp.content
     logging.debug(f"Failed to download data from: {url}\nResponse:\n{resp.content}")
@@ -47,25 +52,114 @@ def get_json(self, url: str, **kwargs) -> dict:
 
 def get_stream_files(self, url: str, headers={}, extension=None) -> List[AudiobookFile]:
     """Creates a list of audio files from an m3u8 file"""
-    playlist = m3u8.load(url, headers=headers)
+    return self.get_multiple_stream_files([url], headers=headers, extension=extension)
+
+
+def get_multiple_stream_files(self, urls: Sequence[str], headers={}, extension=None) -> List[AudiobookFile]:
+    """
+    Creates a list of audio files from multiple m3u8 files. The playlists and
+    their encryption keys are downloaded at the same time.
+
+    :param urls: Urls of playlists in the order they should be played
+    :param headers: Headers used when downloading playlists, keys and segments
+    :param extension: Extension of segments. Found from the segment urls if not given
+    :returns: Segments of all playlists
+    """
+    with ThreadPool(processes=max(1, min(len(urls), PLAYLIST_CONNECTIONS))) as pool:
+        playlists = pool.map(lambda url: self.load_playlist(url, headers), urls)
+        # Keys are cached, so they are only downloaded once
+        key_urls = {
+            seg.key.absolute_uri
+            for playlist, _ in playlists
+            for seg in playlist.segments
+            if seg.key and seg.key.method != "NONE"
+        }
+        pool.map(lambda key_url: self._get_page(key_url, headers=headers), key_urls)
     files = []
-    for _, seg in enumerate(playlist.segments):
+    for playlist, bitrate in playlists:
+        files.extend(self.playlist_files(playlist, headers, extension, bitrate))
+    return files
+
+
+def load_playlist(self, url: str, headers={}, depth: int = 0) -> Tuple[m3u8.M3U8, Optional[int]]:
+    """
+    Download m3u8 playlist with the source session. Master playlists are
+    followed to the media playlist chosen by the quality policy of the source.
+
+    :param url: Url of playlist
+    :param headers: Headers of request
+    :returns: Media playlist and its bitrate if it was given in a master playlist
+    """
+    resp = self._retry_policy.call(lambda: self._session.get(url, headers=headers))
+    if resp.status_code != 200:
+        logging.debug(f"Failed to download playlist from: {url}\nResponse:\n{resp.content}")
+        raise exceptions.RequestError
+    # Relative urls are resolved from the url after redirects
+    playlist = m3u8.loads(resp.text, uri=resp.url)
+    if playlist.is_variant:
+        if depth >= MAX_PLAYLIST_DEPTH or not playlist.playlists:
+            raise exceptions.DataNotPresent
+        variant = select_playlist_variant(playlist, self.quality)
+        bitrate = variant.stream_info.bandwidth
+        logging.debug(f"Using variant playlist with bitrate {bitrate}: {variant.absolute_uri}")
+        media_playlist, media_bitrate = self.load_playlist(variant.absolute_uri, headers, depth + 1)
+        return media_playlist, media_bitrate or bitrate
+    return playlist, None
+
+
+def select_playlist_variant(playlist: m3u8.M3U8, quality: Quality) -> m3u8.Playlist:
+    """Select variant from master playlist based on quality policy"""
+    return select_variant(
+        playlist.playlists,
+        [variant.stream_info.bandwidth for variant in playlist.playlists],
+        quality,
+    )
+
+
+def playlist_files(self, playlist: m3u8.M3U8, headers={}, extension=None, bitrate: Optional[int] = None) -> List[AudiobookFile]:
+    """Creates a list of audio files from a media playlist"""
+    files = []
+    # End of the previous byte range in each resource
+    range_ends: Dict[str, int] = {}
+    for index, seg in enumerate(playlist.segments):
         if extension is None:
             extension = os.path.splitext(seg.absolute_uri)[1][1:].split("?")[0]
         current = AudiobookFile(
             url = seg.absolute_uri,
             ext = extension,
-            headers = headers
+            headers = headers,
+            segment = True,
+            bitrate = bitrate,
+            duration = seg.duration * 1000 if seg.duration else None,
         )
-        if not seg.key.method == "NONE":
+        if seg.byterange:
+            current.byte_range = parse_byterange(seg.byterange, range_ends.get(seg.absolute_uri, 0))
+            range_ends[seg.absolute_uri] = current.byte_range[1] + 1
+        if seg.key and not seg.key.method == "NONE":
+            # The media sequence number is used when the playlist has no iv
+            iv = int(seg.key.iv, 0) if seg.key.iv else (playlist.media_sequence or 0) + index
             current.encryption_method = AESEncryption(
                 key = self._get_page(seg.key.absolute_uri, headers=headers),
-                iv = int(seg.key.iv, 0).to_bytes(16, byteorder='big')
+                iv = iv.to_bytes(16, byteorder='big'),
+                unpad = True,
             )
         files.append(current)
     return files
 
 
+def parse_byterange(byterange: str, previous_end: int) -> Tuple[int, int]:
+    """
+    Parse value of EXT-X-BYTERANGE tag
+
+    :param byterange: Value in the format `<length>[@<offset>]`
+    :param previous_end: Offset used when the value has no offset
+    :returns: First and last byte of range
+    """
+    length, _, offset = byterange.partition("@")
+    start = int(offset) if offset else previous_end
+    return start, start + int(length) - 1
+
+
 def _get_all_cookies(session: requests.Session) -> Dict[str, str]:
     """
     Retrieves all cookies from session
@@ -103,6 +103,7 @@ class StorytelSource(Source):
     ]
     _download_counter = 0
     create_storage_dir = True
+    split = 4
 
     def __init__(self, options) -> None:
         super().__init__(options)
@@ -1,6 +1,7 @@
 import importlib.resources
-from typing import Sequence
+from typing import Dict, Sequence, Tuple
 import shutil
+import requests
 from urllib3.poolmanager import PoolManager
 from requests.adapters import HTTPAdapter
 from ssl import SSLContext
@@ -55,3 +56,35 @@ class CustomSSLContextHTTPAdapter(HTTPAdapter):
             block=block,
             ssl_context=self.ssl_context,
         )
+
+
+def connection_stats(session: requests.Session) -> Dict[str, Tuple[int, int]]:
+    """
+    Count requests and new connections for each host in the connection
+    pools of `session`
+
+    :param session: Session to get statistics from
+    :returns: Number of requests and connections by host
+    """
+    result: Dict[str, Tuple[int, int]] = {}
+    for adapter in session.adapters.values():
+        # HTTP/2 adapters count requests themselves. Their connection pools
+        # are only used for requests sent with HTTP/1.1
+        host_stats = getattr(adapter, "host_stats", None)
+        if host_stats:
+            for host, (requests_count, connections_count) in list(host_stats.items()):
+                old_requests, old_connections = result.get(host, (0, 0))
+                result[host] = (old_requests + requests_count, old_connections + connections_count)
+        if not isinstance(adapter, HTTPAdapter):
+            continue
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_count, connections_count = result.get(pool.host, (0, 0))
+            result[pool.host] = (
+                requests_count + pool.num_requests,
+                connections_count + pool.num_connections,
+            )
+    return result
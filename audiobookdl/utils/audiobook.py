@@ -24,6 +24,8 @@ class Cover:
 class AESEncryption:
     key: bytes
     iv: bytes
+    # Remove PKCS#7 padding after decryption
+    unpad: bool = False
 
 
 AudiobookFileEncryption = AESEncryption
@@ -45,6 +47,15 @@ class AudiobookFile:
     expected_content_type: Optional[str] = None
     # Expected status code of the download request
     expected_status_code: Optional[int] = None
+    # Part of a stream (like an HLS playlist) that can be joined with the
+    # other segments by concatenating the downloaded bytes
+    segment: bool = False
+    # First and last byte of the file in the resource at `url`
+    byte_range: Optional[Tuple[int, int]] = None
+    # Bitrate in bits per second of the stream variant the file belongs to
+    bitrate: Optional[int] = None
+    # Duration of audio in milliseconds
+    duration: Optional[float] = None
 
 
 @define
@@ -61,6 +72,8 @@ class AudiobookMetadata:
     isbn: Optional[str] = None
     publisher: Optional[str] = None
     release_date: Optional[date] = None
+    # Bitrate in bits per second of the downloaded audio
+    bitrate: Optional[int] = None
 
     def add_author(self, author: str):
         """Add author to metadata"""
@@ -162,6 +175,8 @@ class AudiobookMetadata:
             result["publisher"] = self.publisher
         if self.release_date:
             result["release_date"] = self.release_date
+        if self.bitrate:
+            result["bitrate"] = self.bitrate
 
         return result
 
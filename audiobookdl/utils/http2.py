@@ -0,0 +1,197 @@
+from audiobookdl import logging
+from audiobookdl.utils import CustomSSLContextHTTPAdapter
+
+import io
+import threading
+from types import SimpleNamespace
+import http.client
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+from ssl import SSLContext
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+try:
+    import httpx
+    import h2 # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Connection specific headers that are not allowed in HTTP/2
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"}
+
+
+def convert_timeout(timeout: Union[None, float, Tuple[Optional[float], Optional[float]]]) -> "httpx.Timeout":
+    """Convert requests timeout to httpx timeout"""
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def convert_error(error: Exception) -> Exception:
+    """Convert httpx error to the matching requests error"""
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(error)
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.ReadTimeout(error)
+    return requests.exceptions.ConnectionError(error)
+
+
+class HTTP2ResponseBody(io.RawIOBase):
+    """
+    Body of httpx response with the parts of the urllib3 response interface
+    requests and audiobook-dl use
+    """
+
+    def __init__(self, response: "httpx.Response"):
+        self._response = response
+        self._chunks: Iterator[bytes] = response.iter_bytes()
+        self._chunk = memoryview(b"")
+        self.decode_content = True
+        # Used by requests to extract cookies
+        headers = http.client.HTTPMessage()
+        for key, value in response.headers.multi_items():
+            headers[key] = value
+        self._original_response = SimpleNamespace(msg=headers)
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def _next_chunk(self) -> bool:
+        try:
+            self._chunk = memoryview(next(self._chunks, b""))
+        except httpx.HTTPError as e:
+            raise convert_error(e)
+        return len(self._chunk) > 0
+
+
+    def readinto(self, buffer) -> int:
+        if not self._chunk and not self._next_chunk():
+            return 0
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+    def stream(self, amt: int = 2**16, decode_content: Optional[bool] = None) -> Iterator[bytes]:
+        while self._chunk or self._next_chunk():
+            chunk = self._chunk[:amt]
+            self._chunk = self._chunk[amt:]
+            yield bytes(chunk)
+
+
+    def close(self) -> None:
+        self._response.close()
+        super().close()
+
+
+    def release_conn(self) -> None:
+        self._response.close()
+
+
+    def shutdown(self) -> None:
+        self._response.close()
+
+
+class HTTP2Adapter(CustomSSLContextHTTPAdapter):
+    """
+    Transport adapter sending requests with httpx, so requests to the same
+    host are multiplexed as streams over a single HTTP/2 connection.
+    Servers that don't support HTTP/2 are used with HTTP/1.1.
+
+    The httpx client is shared by all requests, so requests through a
+    proxy or with their own certificate settings are sent with HTTP/1.1 by
+    the parent adapter instead.
+    """
+
+    def __init__(self, ssl_context: SSLContext, max_connections: int):
+        super().__init__(ssl_context, pool_maxsize=max_connections, pool_block=True)
+        self.client = httpx.Client(
+            http2 = True,
+            verify = ssl_context,
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects = False,
+            trust_env = False,
+        )
+        # Number of requests and new connections by host
+        self.host_stats: Dict[str, Tuple[int, int]] = {}
+        self._stats_lock = threading.Lock()
+
+
+    def _count(self, host: str, requests_count: int, connections_count: int) -> None:
+        with self._stats_lock:
+            old_requests, old_connections = self.host_stats.get(host, (0, 0))
+            self.host_stats[host] = (old_requests + requests_count, old_connections + connections_count)
+
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout: Any = None, verify: Any = True, cert: Any = None, proxies: Any = None) -> requests.Response:
+        url = request.url or ""
+        body = request.body
+        if select_proxy(url, proxies) or verify is not True or cert or not (body is None or isinstance(body, (str, bytes))):
+            return super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        host = urlparse(url).hostname or ""
+
+        def trace(event: str, info: dict) -> None:
+            if event == "connection.connect_tcp.complete":
+                self._count(host, 0, 1)
+
+        httpx_request = self.client.build_request(
+            request.method or "GET",
+            url,
+            headers = {
+                key: value if isinstance(value, str) else value.decode("latin-1")
+                for key, value in request.headers.items()
+                if key.lower() not in HOP_BY_HOP_HEADERS
+            },
+            content = body,
+            timeout = convert_timeout(timeout),
+            extensions = {"trace": trace},
+        )
+        try:
+            httpx_response = self.client.send(httpx_request, stream=True)
+        except httpx.HTTPError as e:
+            raise convert_error(e)
+        self._count(host, 1, 0)
+        response = self.build_http2_response(request, httpx_response)
+        if not stream:
+            response.content
+        return response
+
+
+    def build_http2_response(self, request: requests.PreparedRequest, httpx_response: "httpx.Response") -> requests.Response:
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.headers = CaseInsensitiveDict(httpx_response.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = HTTP2ResponseBody(httpx_response)
+        response.reason = httpx_response.reason_phrase
+        response.url = request.url or ""
+        response.request = request
+        response.connection = self
+        requests.cookies.extract_cookies_to_jar(response.cookies, request, response.raw)
+        return response
+
+
+    def close(self) -> None:
+        self.client.close()
+        super().close()
+
+
+def create_adapter(ssl_context: SSLContext, max_connections: int) -> Optional[HTTP2Adapter]:
+    """
+    Create HTTP/2 adapter if httpx is installed
+
+    :param ssl_context: Context used for tls connections
+    :param max_connections: Max number of connections
+    :returns: Adapter or `None` if HTTP/2 is not available
+    """
+    if not HTTP2_AVAILABLE:
+        logging.debug("httpx with HTTP/2 support is not installed, using HTTP/1.1")
+        return None
+    return HTTP2Adapter(ssl_context, max_connections)
@@ -0,0 +1,345 @@
+from attrs import define
+
+import os
+import mmap
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+
+# Bitrates of MPEG layer III in kbit/s by bitrate index
+MPEG1_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MPEG2_BITRATES = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+# Sample rates by MPEG version and sample rate index
+SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+# MPEG version by the two version bits of a frame header
+VERSIONS = {0b00: 2.5, 0b10: 2, 0b11: 1}
+# Size of ID3v2 header and footer
+ID3V2_HEADER_SIZE = 10
+# Size of ID3v1 tag at the end of a file
+ID3V1_SIZE = 128
+# Number of entries in the seek table of a Xing header
+XING_TOC_SIZE = 100
+# Number of bytes after the ID3v2 tag searched for the first audio frame
+FRAME_SEARCH_SIZE = 64 * 1024
+# Xing header flags
+XING_FRAMES = 0x1
+XING_BYTES = 0x2
+XING_TOC = 0x4
+
+# Data frame headers can be parsed from
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+@define
+class FrameHeader:
+    """Header of an MPEG layer III audio frame"""
+    # The four bytes of the header as an integer
+    value: int
+    # 1, 2 or 2.5
+    version: float
+    # Bitrate in bits per second
+    bitrate: int
+    sample_rate: int
+    padding: int
+    mono: bool
+
+    @property
+    def samples(self) -> int:
+        """Number of samples in frame"""
+        return 1152 if self.version == 1 else 576
+
+    @property
+    def size(self) -> int:
+        """Size of frame in bytes including header"""
+        return self.samples // 8 * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def average_size(self) -> float:
+        """Size of frames in a CBR stream on average, since padding adds a byte to some frames"""
+        return self.samples / 8 * self.bitrate / self.sample_rate
+
+
+    @property
+    def side_info_size(self) -> int:
+        """Size of side information following the header"""
+        if self.version == 1:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+    @property
+    def duration(self) -> float:
+        """Duration of frame in milliseconds"""
+        return self.samples * 1000 / self.sample_rate
+
+
+@define
+class XingHeader:
+    """Xing or Info header stored in the first frame of an mp3 file"""
+    # `True` for Xing headers of VBR files, `False` for Info headers of CBR files
+    vbr: bool
+    # Number of audio frames
+    frames: Optional[int] = None
+    # Number of audio bytes including the header frame
+    size: Optional[int] = None
+    # Seek table with the byte position of each percent of the duration
+    # as a fraction of 256
+    toc: Optional[List[int]] = None
+
+
+def id3v2_size(data: bytes) -> int:
+    """
+    Find size of ID3v2 tag at the start of `data`
+
+    :param data: First bytes of file
+    :returns: Size of tag or 0 if the file has no tag
+    """
+    if len(data) < ID3V2_HEADER_SIZE or data[:3] != b"ID3":
+        return 0
+    # Size is stored as a synchsafe integer with 7 bits in each byte
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7f)
+    has_footer = data[5] & 0x10
+    return ID3V2_HEADER_SIZE + size + (ID3V2_HEADER_SIZE if has_footer else 0)
+
+
+def parse_frame_header(data: Buffer, offset: int = 0) -> Optional[FrameHeader]:
+    """
+    Parse MPEG layer III frame header at `offset`
+
+    :param data: Bytes of file
+    :param offset: Position of header in `data`
+    :returns: Frame header or `None` if there is no valid header at `offset`
+    """
+    if offset + 4 > len(data):
+        return None
+    (value,) = struct.unpack_from(">I", data, offset)
+    if value >> 21 != 0x7ff:
+        return None
+    version = VERSIONS.get((value >> 19) & 0b11)
+    layer = (value >> 17) & 0b11
+    bitrate_index = (value >> 12) & 0b1111
+    sample_rate_index = (value >> 10) & 0b11
+    if version is None or layer != 0b01 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrates = MPEG1_BITRATES if version == 1 else MPEG2_BITRATES
+    return FrameHeader(
+        value = value,
+        version = version,
+        bitrate = bitrates[bitrate_index] * 1000,
+        sample_rate = SAMPLE_RATES[version][sample_rate_index],
+        padding = (value >> 9) & 1,
+        mono = (value >> 6) & 0b11 == 0b11,
+    )
+
+
+def find_first_frame(data: bytes, offset: int = 0) -> Optional[int]:
+    """
+    Find position of first audio frame at or after `offset`. A frame is only
+    accepted if it is followed by another frame, so stray sync bits in
+    leftover tag data are skipped.
+
+    :param data: Bytes of file
+    :param offset: Position to start searching from
+    :returns: Position of frame or `None` if no frame was found
+    """
+    position = data.find(b"\xff", offset)
+    while position != -1:
+        header = parse_frame_header(data, position)
+        if header:
+            next_position = position + header.size
+            if next_position + 4 > len(data) or parse_frame_header(data, next_position):
+                return position
+        position = data.find(b"\xff", position + 1)
+    return None
+
+
+def parse_xing_header(data: bytes, offset: int, header: FrameHeader) -> Optional[XingHeader]:
+    """
+    Parse Xing or Info header of frame at `offset`
+
+    :param data: Bytes of file
+    :param offset: Position of frame in `data`
+    :param header: Header of frame
+    :returns: Xing header or `None` if the frame is an audio frame
+    """
+    position = offset + 4 + header.side_info_size
+    tag = data[position:position+4]
+    if tag not in (b"Xing", b"Info"):
+        return None
+    (flags,) = struct.unpack_from(">I", data, position + 4)
+    position += 8
+    xing = XingHeader(vbr = tag == b"Xing")
+    if flags & XING_FRAMES:
+        (xing.frames,) = struct.unpack_from(">I", data, position)
+        position += 4
+    if flags & XING_BYTES:
+        (xing.size,) = struct.unpack_from(">I", data, position)
+        position += 4
+    if flags & XING_TOC:
+        xing.toc = list(data[position:position+XING_TOC_SIZE])
+    return xing
+
+
+@define
+class Mp3Audio:
+    """Audio frames of an mp3 file without tags and Xing header"""
+    path: str
+    # First byte of audio frames
+    start: int
+    # End of audio frames
+    end: int
+    # Header of first audio frame
+    header: FrameHeader
+    # Number of audio frames
+    frames: int
+    # `True` if the frames have different bitrates
+    vbr: bool
+    # Seek table of Xing header
+    toc: Optional[List[int]] = None
+
+    @property
+    def size(self) -> int:
+        """Size of audio frames in bytes"""
+        return self.end - self.start
+
+    @property
+    def duration(self) -> float:
+        """Duration in milliseconds"""
+        return self.frames * self.header.duration
+
+    def position(self, time: float) -> int:
+        """Find byte position of `time` relative to `start`"""
+        fraction = min(max(time / self.duration, 0.0), 1.0) if self.duration else 0.0
+        if self.toc:
+            percent = fraction * 100
+            index = min(int(percent), XING_TOC_SIZE - 1)
+            upper = self.toc[index + 1] if index + 1 < XING_TOC_SIZE else 256
+            fraction = (self.toc[index] + (upper - self.toc[index]) * (percent - index)) / 256
+        return int(fraction * self.size)
+
+
+def read_audio(path: str) -> Mp3Audio:
+    """
+    Find the audio frames of an mp3 file. Frames are only counted one by one
+    for files without a Xing header.
+
+    :param path: Path of mp3 file
+    :returns: Position and length of audio frames
+    :raises ValueError: If no audio frames were found
+    """
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        start = id3v2_size(f.read(ID3V2_HEADER_SIZE))
+        f.seek(start)
+        data = f.read(FRAME_SEARCH_SIZE)
+        end = file_size
+        if file_size - start >= ID3V1_SIZE:
+            f.seek(file_size - ID3V1_SIZE)
+            if f.read(3) == b"TAG":
+                end -= ID3V1_SIZE
+    frame_position = find_first_frame(data)
+    if frame_position is None:
+        raise ValueError(f"No mp3 frames found in {path}")
+    header = parse_frame_header(data, frame_position)
+    assert header is not None
+    start += frame_position
+    xing = parse_xing_header(data, frame_position, header)
+    if xing:
+        start += header.size
+        next_header = parse_frame_header(data, frame_position + header.size)
+        header = next_header or header
+    if xing and xing.frames:
+        return Mp3Audio(path, start, end, header, xing.frames, xing.vbr, xing.toc)
+    frames, vbr, end = count_frames(path, start, end)
+    return Mp3Audio(path, start, end, header, frames, vbr)
+
+
+def count_frames(path: str, start: int, end: int) -> Tuple[int, bool, int]:
+    """
+    Count audio frames by following the frame headers from `start`
+
+    :param path: Path of mp3 file
+    :param start: Position of first frame
+    :param end: End of audio frames
+    :returns: Number of frames, if the bitrate varies, and the end of the
+    last complete frame
+    """
+    # Size of frames without padding by the bits of the header before the
+    # padding bit
+    frame_sizes: Dict[int, int] = {}
+    frames = 0
+    bitrates = set()
+    position = start
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while position + 4 <= end:
+            value = int.from_bytes(data[position:position+4], "big")
+            key = value >> 10
+            size = frame_sizes.get(key)
+            if size is None:
+                header = parse_frame_header(data, position)
+                if header is None:
+                    break
+                size = header.size - header.padding
+                frame_sizes[key] = size
+                bitrates.add(header.bitrate)
+            size += (value >> 9) & 1
+            if position + size > end:
+                break
+            position += size
+            frames += 1
+    return frames, len(bitrates) > 1, position
+
+
+def create_xing_frame(header: FrameHeader, frames: int, size: int, toc: List[int], vbr: bool) -> bytes:
+    """
+    Create frame with a Xing header describing the frames after it
+
+    :param header: Header of first audio frame. The Xing frame uses the same
+    version, sample rate and channel mode
+    :param frames: Number of audio frames
+    :param size: Size of all frames including the Xing frame
+    :param toc: Seek table
+    :param vbr: Write a Xing header for VBR files instead of an Info header
+    :returns: Xing frame
+    :raises ValueError: If no frame with the format of `header` is large enough
+    """
+    content = struct.pack(">4sIII", b"Xing" if vbr else b"Info", XING_FRAMES | XING_BYTES | XING_TOC, frames, size) + bytes(toc)
+    bitrates = MPEG1_BITRATES if header.version == 1 else MPEG2_BITRATES
+    frame_header: Optional[FrameHeader] = None
+    for bitrate_index in range(1, len(bitrates)):
+        # Padding is disabled and the protection bit is set, so the frame has no crc
+        value = (header.value & ~(0b1111 << 12) & ~(1 << 9)) | (1 << 16) | (bitrate_index << 12)
+        candidate = parse_frame_header(value.to_bytes(4, "big"))
+        if candidate and candidate.size >= 4 + candidate.side_info_size + len(content):
+            frame_header = candidate
+            break
+    if frame_header is None:
+        raise ValueError("Xing header does not fit in a frame")
+    frame = bytearray(frame_header.size)
+    frame[0:4] = value.to_bytes(4, "big")
+    offset = 4 + frame_header.side_info_size
+    frame[offset:offset+len(content)] = content
+    return bytes(frame)
+
+
+def synchsafe(value: int) -> bytes:
+    """Encode integer with 7 bits in each byte"""
+    return bytes((value >> shift) & 0x7f for shift in (21, 14, 7, 0))
+
+
+def create_id3v2_tag(length: int, padding: int) -> bytes:
+    """
+    Create ID3v2.4 tag with a TLEN frame
+
+    :param length: Length of audio in milliseconds
+    :param padding: Empty space in tag that can be used for tags added later
+    :returns: Tag
+    """
+    # Text encoded as utf-8
+    text = b"\x03" + str(length).encode()
+    frame = b"TLEN" + synchsafe(len(text)) + b"\x00\x00" + text
+    return b"ID3\x04\x00\x00" + synchsafe(len(frame) + padding) + frame + bytes(padding)
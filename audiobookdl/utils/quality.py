@@ -0,0 +1,56 @@
+from attrs import define
+
+import re
+from typing import List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Multipliers of bitrate suffixes
+BITRATE_UNITS = {"": 1, "K": 1000, "M": 1000**2}
+
+
+@define
+class Quality:
+    """Policy for choosing between variants of a stream with different bitrates"""
+    # One of `best`, `worst` or `max`
+    policy: str = "best"
+    # Highest allowed bitrate in bits per second when policy is `max`
+    max_bitrate: Optional[int] = None
+
+
+def parse_quality(value: str) -> Quality:
+    """
+    Parse quality option
+
+    :param value: `best`, `worst` or a max bitrate like `<=128k`
+    :returns: Quality policy
+    :raises ValueError: If the value is not a valid quality
+    """
+    value = value.strip().lower()
+    if value in ("best", "worst"):
+        return Quality(value)
+    match = re.fullmatch(r"<=\s*(\d+(?:\.\d+)?)\s*([km]?)(?:bps)?", value)
+    if match is None:
+        raise ValueError(f"Invalid quality: {value}")
+    number, unit = match.groups()
+    return Quality("max", int(float(number) * BITRATE_UNITS[unit.upper()]))
+
+
+def select_variant(variants: List[T], bitrates: List[Optional[int]], quality: Quality) -> T:
+    """
+    Select variant of stream based on quality policy. Variants without a
+    known bitrate are treated as the lowest quality.
+
+    :param variants: Available variants
+    :param bitrates: Bitrate of each variant in bits per second
+    :param quality: Quality policy
+    :returns: Selected variant
+    """
+    ranked = sorted(zip(variants, [bitrate or 0 for bitrate in bitrates]), key=lambda pair: pair[1])
+    if quality.policy == "worst":
+        return ranked[0][0]
+    if quality.policy == "max" and quality.max_bitrate is not None:
+        allowed = [variant for variant, bitrate in ranked if bitrate <= quality.max_bitrate]
+        # Use the lowest bitrate if every variant is above the limit
+        return allowed[-1] if allowed else ranked[0][0]
+    return ranked[-1][0]
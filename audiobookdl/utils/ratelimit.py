@@ -0,0 +1,102 @@
+import re
+import time
+import threading
+from typing import Optional, Union
+
+# Seconds of traffic allowed in a burst if no burst size is given
+DEFAULT_BURST_DURATION = 1.0
+# Multipliers of size suffixes
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the number of bytes per second shared between all
+    download threads.
+
+    Threads take tokens for data they have already read, and the bucket is
+    allowed to go into debt. The thread that causes the debt sleeps until it
+    is paid back, outside the lock, so the lock is only held for a few
+    arithmetic operations per chunk. Without a rate no lock is taken at all.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.rate: Optional[float] = None
+        self.burst = 0.0
+        self.tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate, burst)
+
+
+    def set_rate(self, rate: Optional[float], burst: Optional[float] = None) -> None:
+        """
+        Change limit. Can be called while downloads are running.
+
+        :param rate: Max bytes per second or `None` for no limit
+        :param burst: Max bytes that can be read at once after being idle
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate or None
+            if self.rate is None:
+                self.burst = 0.0
+            else:
+                self.burst = burst or self.rate * DEFAULT_BURST_DURATION
+            self.tokens = min(self.tokens, self.burst)
+
+
+    def _refill(self, now: float) -> None:
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+    def consume(self, size: int) -> None:
+        """
+        Take tokens for `size` bytes and wait if the limit has been exceeded
+
+        :param size: Number of bytes
+        """
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def reserve(self, size: int) -> float:
+        """
+        Take tokens for `size` bytes without waiting
+
+        :param size: Number of bytes
+        :returns: Seconds the caller should wait before reading more
+        """
+        if self.rate is None:
+            return 0
+        with self._lock:
+            rate = self.rate
+            if rate is None:
+                return 0
+            self._refill(time.monotonic())
+            self.tokens -= size
+            return -self.tokens / rate if self.tokens < 0 else 0
+
+
+# Limit shared by all downloads in this process
+limiter = TokenBucket()
+
+
+def parse_size(value: Union[str, int, float]) -> float:
+    """
+    Parse size in bytes with an optional K, M or G suffix (powers of 1024)
+
+    :param value: Size like `500K` or `20M`
+    :returns: Number of bytes
+    :raises ValueError: If the value is not a valid size
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?\s*", value, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {value}")
+    number, unit = match.groups()
+    return float(number) * SIZE_UNITS[unit.upper()]
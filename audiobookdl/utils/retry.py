@@ -0,0 +1,212 @@
+from audiobookdl import logging
+from audiobookdl.exceptions import DownloadError, DownloadStalled
+
+import time
+import random
+import asyncio
+import threading
+import requests
+import urllib.error
+import urllib3.exceptions
+from attrs import define
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+# Function deciding if an error should be retried. See `classify_exception`
+Classifier = Callable[[Exception, bool], Optional[Tuple[str, Optional[float]]]]
+
+# Status codes that indicate a temporary problem with the server
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Status codes where the server has not processed the request, so even
+# requests that are not idempotent can be sent again
+UNPROCESSED_STATUS_CODES = {429, 503}
+# Longest time to wait when the server sends a Retry-After header
+MAX_RETRY_AFTER = 120.0
+
+# Errors where the request never reached the server
+CONNECT_ERRORS = (
+    requests.exceptions.ConnectTimeout,
+    urllib3.exceptions.ConnectTimeoutError,
+    urllib3.exceptions.NewConnectionError,
+)
+# Errors where the connection failed after the request might have been sent
+CONNECTION_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.ProtocolError,
+    urllib3.exceptions.ReadTimeoutError,
+    urllib.error.URLError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class RetryStats:
+    """Counts retries by the type of error that caused them"""
+
+    def __init__(self) -> None:
+        self.retries: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, error_class: str) -> None:
+        with self._lock:
+            self.retries[error_class] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.retries.values())
+
+    def summary(self) -> str:
+        return ", ".join(f"{count} after {error_class}" for error_class, count in self.retries.most_common())
+
+
+# Retries in this run
+stats = RetryStats()
+
+
+@define
+class RetryPolicy:
+    # Max number of retries after the first attempt
+    retries: int = 3
+    # Delay before the first retry in seconds. Doubled for each retry
+    backoff: float = 1.0
+    # Longest delay between retries in seconds
+    max_backoff: float = 30.0
+
+    def call(self, function: Callable[[], T], idempotent: bool = True) -> T:
+        """
+        Call `function` until it succeeds or the retries are used up.
+        Responses with a temporary error status code are retried, and the last
+        response is returned if all retries fail.
+
+        :param function: Function that makes a request
+        :param idempotent: Whether the request can safely be sent more than once
+        :returns: Result of `function`
+        """
+        attempt = 0
+        while True:
+            try:
+                result = function()
+            except Exception as e:
+                retryable = classify_exception(e, idempotent)
+                if retryable is None or attempt >= self.retries:
+                    raise
+                error_class, retry_after = retryable
+            else:
+                if not isinstance(result, requests.Response):
+                    return result
+                retryable = classify_status(result.status_code, result.headers.get("Retry-After"), idempotent)
+                if retryable is None or attempt >= self.retries:
+                    return result
+                error_class, retry_after = retryable
+                result.close()
+            attempt += 1
+            time.sleep(self.before_retry(attempt, error_class, retry_after))
+
+    async def call_async(self, function: Callable[[], Awaitable[T]], idempotent: bool = True, classify: Optional[Classifier] = None) -> T:
+        """
+        Await `function` until it succeeds or the retries are used up.
+        Async version of `call` for functions that raise on failed responses.
+
+        :param function: Function returning a coroutine that makes a request
+        :param idempotent: Whether the request can safely be sent more than once
+        :param classify: Function deciding which errors are retried
+        :returns: Result of `function`
+        """
+        classify = classify or classify_exception
+        attempt = 0
+        while True:
+            try:
+                return await function()
+            except Exception as e:
+                retryable = classify(e, idempotent)
+                if retryable is None or attempt >= self.retries:
+                    raise
+                error_class, retry_after = retryable
+            attempt += 1
+            await asyncio.sleep(self.before_retry(attempt, error_class, retry_after))
+
+    def before_retry(self, attempt: int, error_class: str, retry_after: Optional[float]) -> float:
+        """
+        Record retry and find delay before it
+
+        :returns: Seconds to wait
+        """
+        stats.add(error_class)
+        delay = self.delay(attempt, retry_after)
+        logging.debug(f"Retrying after {error_class} in {delay:.1f} seconds ({attempt}/{self.retries})")
+        return delay
+
+    def delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        """
+        Time to wait before retry number `attempt`.
+        Exponential backoff where the second half of the delay is random.
+        """
+        backoff = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+        return delay
+
+
+def classify_status(status_code: int, retry_after: Optional[str], idempotent: bool) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    Decide if a response should be retried based on its status code
+
+    :returns: Error class and requested delay, or `None` if it should not be retried
+    """
+    if status_code not in RETRY_STATUS_CODES:
+        return None
+    if not idempotent and status_code not in UNPROCESSED_STATUS_CODES:
+        return None
+    return f"status {status_code}", parse_retry_after(retry_after)
+
+
+def classify_exception(error: Exception, idempotent: bool) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    Decide if a request that raised `error` should be retried
+
+    :returns: Error class and requested delay, or `None` if it should not be retried
+    """
+    if isinstance(error, DownloadError):
+        status_code = error.data.get("status_code")
+        if status_code is None:
+            return None
+        return classify_status(status_code, error.data.get("retry_after"), idempotent)
+    if isinstance(error, DownloadStalled):
+        return ("stalled download", None) if idempotent else None
+    if isinstance(error, urllib.error.HTTPError):
+        return classify_status(error.code, error.headers.get("Retry-After"), idempotent)
+    # requests wraps the underlying urllib3 error
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    if isinstance(error, CONNECT_ERRORS) or isinstance(reason, CONNECT_ERRORS):
+        return "connection failure", None
+    if isinstance(error, CONNECTION_ERRORS) and idempotent:
+        return "connection error", None
+    return None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse value of Retry-After header
+
+    :param value: Number of seconds or http date
+    :returns: Number of seconds to wait
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time.tzinfo is None:
+        retry_time = retry_time.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_time - datetime.now(timezone.utc)).total_seconds())
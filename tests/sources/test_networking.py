@@ -0,0 +1,81 @@
+from audiobookdl import Source
+from audiobookdl.sources.source import networking
+from audiobookdl.utils.quality import Quality
+
+import threading
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def test_parse_byterange_with_offset():
+    assert networking.parse_byterange("1000@500", 0) == (500, 1499)
+
+
+def test_parse_byterange_continues_previous_range():
+    assert networking.parse_byterange("1000", 1500) == (1500, 2499)
+
+
+PLAYLISTS = {
+    "/master.m3u8": "#EXTM3U\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=64000\nlow/media.m3u8\n"
+        "#EXT-X-STREAM-INF:BANDWIDTH=128000\nhigh/media.m3u8\n",
+    "/high/media.m3u8": "#EXTM3U\n#EXT-X-MEDIA-SEQUENCE:1\n"
+        "#EXT-X-KEY:METHOD=AES-128,URI=\"/key\"\n"
+        "#EXTINF:10,\n#EXT-X-BYTERANGE:100@0\nsegments.ts\n"
+        "#EXTINF:10,\n#EXT-X-BYTERANGE:100\nsegments.ts\n"
+        "#EXT-X-ENDLIST\n",
+    "/low/media.m3u8": "#EXTM3U\n#EXTINF:10,\nsegment.aac\n#EXT-X-ENDLIST\n",
+    "/other.m3u8": "#EXTM3U\n#EXTINF:10,\nsegment.mp3\n#EXT-X-ENDLIST\n",
+    "/key": "0123456789abcdef",
+}
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == "/redirect.m3u8":
+            self.send_response(302)
+            self.send_header("Location", "/master.m3u8")
+            self.end_headers()
+            return
+        body = PLAYLISTS[self.path].encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PlaylistSource(Source):
+    names = ["Playlist"]
+
+
+def test_get_multiple_stream_files(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PlaylistHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    source = PlaylistSource(Namespace(database_directory=str(tmp_path), skip_downloaded=False, retries=0, connections=4, http2=False, quality=Quality()))
+    files = source.get_multiple_stream_files([f"{url}/redirect.m3u8", f"{url}/other.m3u8"])
+    server.shutdown()
+    assert [file.url for file in files] == [f"{url}/high/segments.ts"] * 2 + [f"{url}/segment.mp3"]
+    assert [file.byte_range for file in files] == [(0, 99), (100, 199), None]
+    assert [file.ext for file in files] == ["ts", "ts", "mp3"]
+    assert files[0].encryption_method.key == b"0123456789abcdef"
+    assert files[1].encryption_method.iv == (2).to_bytes(16, byteorder="big")
+    assert server.requests.count("/key") == 1
+    assert [file.bitrate for file in files] == [128000, 128000, None]
+
+
+def test_get_stream_files_with_max_quality(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PlaylistHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    source = PlaylistSource(Namespace(database_directory=str(tmp_path), skip_downloaded=False, retries=0, connections=4, http2=False, quality=Quality("max", 100000)))
+    files = source.get_stream_files(f"{url}/master.m3u8")
+    server.shutdown()
+    assert [file.url for file in files] == [f"{url}/low/segment.aac"]
+    assert files[0].bitrate == 64000
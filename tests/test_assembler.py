@@ -0,0 +1,51 @@
+from audiobookdl.output import assembler
+
+import io
+import threading
+import pytest
+
+
+def test_segments_are_written_in_order():
+    output = io.BytesIO()
+    segments = assembler.SegmentAssembler(output, 4)
+    segments.put(2, b"c")
+    segments.put(1, b"b")
+    assert output.getvalue() == b""
+    segments.put(0, b"a")
+    assert output.getvalue() == b"abc"
+    assert segments.pending == {}
+
+
+def test_window_blocks_segments_ahead():
+    segments = assembler.SegmentAssembler(io.BytesIO(), 2)
+    started = threading.Event()
+
+    def wait():
+        segments.wait_for_turn(2)
+        started.set()
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    assert not started.wait(0.1)
+    segments.put(0, b"a")
+    assert started.wait(1)
+    thread.join()
+
+
+def test_abort_wakes_waiting_segments():
+    segments = assembler.SegmentAssembler(io.BytesIO(), 1)
+    errors = []
+
+    def wait():
+        try:
+            segments.wait_for_turn(5)
+        except assembler.AssemblyAborted as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    segments.abort(ValueError())
+    thread.join(1)
+    assert len(errors) == 1
+    with pytest.raises(assembler.AssemblyAborted):
+        segments.put(0, b"a")
@@ -0,0 +1,156 @@
+from audiobookdl import Audiobook, AudiobookFile, AudiobookMetadata, Chapter
+from audiobookdl.exceptions import ChapterNotFound
+from audiobookdl.output import chapters
+from audiobookdl.utils import mp3
+
+import re
+import pytest
+import threading
+import requests
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# MPEG 1 layer III frame at 128 kbit/s and 44.1 kHz
+FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+# ID3v2 tag with 100 bytes of content
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x64" + bytes(100)
+MP3_CONTENT = ID3_TAG + FRAME * 1000
+# Same frame with padding bit, which adds a byte
+PADDED_FRAME = b"\xff\xfb\x92\x00" + bytes(414)
+
+
+class Mp3Handler(BaseHTTPRequestHandler):
+    """Serves mp3 file of server with support for byte range requests"""
+
+    def do_GET(self):
+        content = self.server.content
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers["Range"])
+        start = int(m.group(1))
+        end = min(int(m.group(2)), len(content) - 1)
+        self.server.requests.append((start, end))
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(content[start:end+1])
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mp3_server(content: bytes) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Mp3Handler)
+    server.content = content
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_audiobook(files, chapter_starts) -> Audiobook:
+    return Audiobook(
+        session = requests.Session(),
+        metadata = AudiobookMetadata("test"),
+        chapters = [Chapter(start, f"Chapter {i}") for i, start in enumerate(chapter_starts, start=1)],
+        files = files,
+    )
+
+
+def test_parse_chapter_selection():
+    assert chapters.parse_chapter_selection("1-3,10") == [1, 2, 3, 10]
+    assert chapters.parse_chapter_selection("2, 1-2") == [1, 2]
+    for value in ["0", "3-1", "a", "1,"]:
+        with pytest.raises(ValueError):
+            chapters.parse_chapter_selection(value)
+
+
+def test_select_segments_by_duration():
+    files = [AudiobookFile(url=f"{i}.ts", ext="ts", segment=True, duration=10_000) for i in range(10)]
+    audiobook = create_audiobook(files, [0, 25_000, 50_000, 80_000])
+    chapters.select_chapters(audiobook, [2, 4], Namespace())
+    assert [file.url for file in audiobook.files] == ["2.ts", "3.ts", "4.ts", "8.ts", "9.ts"]
+    assert audiobook.chapters == [Chapter(5_000, "Chapter 2"), Chapter(30_000, "Chapter 4")]
+
+
+def test_select_file_of_each_chapter():
+    files = [AudiobookFile(url=f"{i}.mp3", ext="mp3") for i in range(4)]
+    audiobook = create_audiobook(files, [0, 1_000, 3_000, 6_000])
+    chapters.select_chapters(audiobook, [2, 4], Namespace())
+    assert [file.url for file in audiobook.files] == ["1.mp3", "3.mp3"]
+    assert audiobook.chapters == [Chapter(0, "Chapter 2"), Chapter(2_000, "Chapter 4")]
+
+
+def test_select_missing_chapter():
+    audiobook = create_audiobook([AudiobookFile(url="0.mp3", ext="mp3")], [0])
+    with pytest.raises(ChapterNotFound):
+        chapters.select_chapters(audiobook, [2], Namespace())
+
+
+def test_select_mp3_byte_ranges():
+    server = start_mp3_server(MP3_CONTENT)
+    url = f"http://127.0.0.1:{server.server_port}/book.mp3"
+    # 1000 frames of 417 bytes at 128 kbit/s
+    audiobook = create_audiobook([AudiobookFile(url=url, ext="mp3")], [0, 8_340, 16_680])
+    chapters.select_chapters(audiobook, [2], Namespace(retries=0))
+    server.shutdown()
+    assert len(audiobook.files) == 1
+    start, end = audiobook.files[0].byte_range
+    # Chapters are cut at the frame boundaries before 8.34 and 16.68 seconds
+    assert start == len(ID3_TAG) + 320 * len(FRAME)
+    assert end == len(ID3_TAG) + 640 * len(FRAME) - 1
+    assert audiobook.chapters == [Chapter(0, "Chapter 2")]
+
+
+class NoRangeHandler(BaseHTTPRequestHandler):
+    """Ignores byte ranges and sends the start of a large file without finishing it"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(100 * len(MP3_CONTENT)))
+        self.end_headers()
+        self.wfile.write(MP3_CONTENT)
+        self.server.finished.wait()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_range_without_range_support(monkeypatch):
+    monkeypatch.setattr(chapters, "PROBE_TIMEOUT", 2)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), NoRangeHandler)
+    server.finished = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/book.mp3"
+    audiobook = create_audiobook([AudiobookFile(url=url, ext="mp3")], [0])
+    # The body is not read, so the unfinished response doesn't time out
+    result = chapters.fetch_range(audiobook, audiobook.files[0], 0, 1, Namespace(retries=0))
+    server.finished.set()
+    server.shutdown()
+    assert result == (None, None)
+
+
+def test_select_mp3_byte_ranges_with_padded_frames():
+    # Encoders pad frames at 44.1 kHz, so they alternate between 417 and 418 bytes
+    average_size = 1152 / 8 * 128_000 / 44100
+    boundaries = [int(i * average_size) for i in range(1001)]
+    content = ID3_TAG + b"".join(
+        PADDED_FRAME if end - start == len(PADDED_FRAME) else FRAME
+        for start, end in zip(boundaries, boundaries[1:])
+    )
+    server = start_mp3_server(content)
+    url = f"http://127.0.0.1:{server.server_port}/book.mp3"
+    audiobook = create_audiobook([AudiobookFile(url=url, ext="mp3")], [0, 8_340, 16_680])
+    chapters.select_chapters(audiobook, [2], Namespace(retries=0))
+    server.shutdown()
+    start, end = audiobook.files[0].byte_range
+    frame_duration = 1152 / 44.1
+    assert start == len(ID3_TAG) + boundaries[int(8_340 / frame_duration)]
+    assert end == len(ID3_TAG) + boundaries[int(16_680 / frame_duration)] - 1
+
+
+def test_mp3_frame_header():
+    header = mp3.parse_frame_header(FRAME)
+    assert header.bitrate == 128_000
+    assert header.sample_rate == 44100
+    assert header.size == len(FRAME)
+    assert mp3.id3v2_size(ID3_TAG) == len(ID3_TAG)
+    assert mp3.find_first_frame(MP3_CONTENT, len(ID3_TAG)) == len(ID3_TAG)
@@ -0,0 +1,45 @@
+from audiobookdl.output import concurrency
+
+import pytest
+
+
+def download(controller: concurrency.ConcurrencyController, host: str, size: int):
+    with controller.slot(host) as slot:
+        slot.bytes = size
+
+
+def test_error_decreases_concurrency():
+    controller = concurrency.ConcurrencyController(20)
+    with pytest.raises(ValueError):
+        with controller.slot("example.com"):
+            raise ValueError
+    assert controller.hosts["example.com"].limit == concurrency.INITIAL_CONCURRENCY * concurrency.ERROR_DECREASE
+    assert controller.hosts["example.com"].active == 0
+
+
+def test_first_window_increases_concurrency():
+    controller = concurrency.ConcurrencyController(20)
+    for _ in range(concurrency.INITIAL_CONCURRENCY):
+        download(controller, "example.com", 1000)
+    assert controller.hosts["example.com"].limit == concurrency.INITIAL_CONCURRENCY + 1
+
+
+def test_concurrency_never_exceeds_max(monkeypatch):
+    # Constant clock steps keep the measured throughput stable
+    clock = iter(range(1000))
+    monkeypatch.setattr(concurrency.time, "monotonic", lambda: next(clock))
+    controller = concurrency.ConcurrencyController(2)
+    for _ in range(10):
+        download(controller, "example.com", 1000)
+    assert controller.hosts["example.com"].limit == 2
+
+
+def test_learned_concurrency_is_saved(tmp_path):
+    controller = concurrency.ConcurrencyController.load(20, str(tmp_path))
+    with pytest.raises(ValueError):
+        with controller.slot("example.com"):
+            raise ValueError
+    controller.save()
+    loaded = concurrency.ConcurrencyController.load(20, str(tmp_path))
+    with loaded.slot("example.com"):
+        assert loaded.hosts["example.com"].limit == concurrency.INITIAL_CONCURRENCY * concurrency.ERROR_DECREASE
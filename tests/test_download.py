@@ -0,0 +1,673 @@
+from audiobookdl import Audiobook, AudiobookFile, AudiobookMetadata, Source, utils
+from audiobookdl.output import download, journal, manifest, planner, postprocess, progress, watchdog
+from audiobookdl.exceptions import DownloadError, DownloadStalled, NotEnoughSpace
+from audiobookdl.utils.quality import Quality
+
+import os
+import json
+import errno
+import re
+import shutil
+import pytest
+import subprocess
+import threading
+import requests
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT = bytes(range(256)) * 4096 * 5
+ETAG = '"v1"'
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves `CONTENT` with support for byte range requests"""
+
+    def do_GET(self):
+        if self.path.startswith("/missing"):
+            self.server.requests.append(self.path)
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == ETAG):
+            m = re.match(r"bytes=(\d+)-(\d*)", range_header)
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else len(CONTENT) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENT)}")
+        else:
+            start, end = 0, len(CONTENT) - 1
+            self.send_response(200)
+        self.server.requests.append(range_header)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(CONTENT[start:end+1])
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_audiobook(server: ThreadingHTTPServer) -> Audiobook:
+    return Audiobook(
+        session = requests.Session(),
+        metadata = AudiobookMetadata("test"),
+        files = [
+            AudiobookFile(url = f"http://127.0.0.1:{server.server_port}/book.mp3", ext = "mp3")
+        ]
+    )
+
+
+def create_options(**kwargs) -> Namespace:
+    defaults = {
+        "split": 1,
+        "resume": False,
+        "connections": 20,
+        "database_directory": None,
+        "retries": 0,
+        "timeout": 30,
+        "hedge_percentile": None,
+        "limit_rate": None,
+        "limit_burst": None,
+        "engine": "thread",
+        "http2": False,
+        "combine": False,
+        "coalesce_size": 4 * 1024 * 1024,
+        "quality": Quality(),
+        "chapters": None,
+        "plan_only": False,
+    }
+    return Namespace(**{**defaults, **kwargs})
+
+
+def test_split_byte_ranges():
+    ranges = download.split_byte_ranges(10 * download.MIN_SPLIT_SIZE + 3, 4)
+    assert len(ranges) == 4
+    assert ranges[0].start == 0
+    assert ranges[-1].end == 10 * download.MIN_SPLIT_SIZE + 2
+    for a, b in zip(ranges, ranges[1:]):
+        assert b.start == a.end + 1
+
+
+def test_split_byte_ranges_small_file():
+    assert download.split_byte_ranges(download.MIN_SPLIT_SIZE, 4) == [journal.ByteRange(0, download.MIN_SPLIT_SIZE - 1)]
+
+
+def test_download_file_split(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "MIN_SPLIT_SIZE", 1024 * 512)
+    server = start_server()
+    audiobook = create_audiobook(server)
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options(split = 4))
+    server.shutdown()
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT
+    assert len([r for r in server.requests if r]) == 3
+
+
+def test_download_file_without_split(tmp_path):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options())
+    server.shutdown()
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT
+    assert server.requests == [None]
+
+
+def create_partial_download(tmp_path, etag: str) -> str:
+    """Create tmp file and journal for a download stopped halfway through"""
+    filepath_tmp = os.path.join(tmp_path, "book.mp3.tmp")
+    half = len(CONTENT) // 2
+    with open(filepath_tmp, "wb") as f:
+        f.write(CONTENT[:half])
+        f.truncate(len(CONTENT))
+    journal.DownloadJournal(
+        url = "http://expired.example.com/book.mp3",
+        total_filesize = len(CONTENT),
+        ranges = [journal.ByteRange(0, len(CONTENT) - 1, half)],
+        etag = etag,
+        path = journal.journal_path(filepath_tmp),
+    ).save()
+    return filepath_tmp
+
+
+def test_download_file_resume(tmp_path):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    filepath_tmp = create_partial_download(tmp_path, ETAG)
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options(resume = True))
+    server.shutdown()
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT
+    assert server.requests == [f"bytes={len(CONTENT) // 2}-{len(CONTENT) - 1}"]
+    assert not os.path.exists(journal.journal_path(filepath_tmp))
+
+
+def test_download_file_resume_changed_file(tmp_path):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    create_partial_download(tmp_path, '"v0"')
+    # Corrupt the partial data to make sure it is not reused
+    with open(os.path.join(tmp_path, "book.mp3.tmp"), "r+b") as f:
+        f.write(b"\0" * 1024)
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options(resume = True))
+    server.shutdown()
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_download_file_resume_weak_etag(tmp_path):
+    # Without a strong validator the server sends part of the changed file
+    server = start_server()
+    audiobook = create_audiobook(server)
+    create_partial_download(tmp_path, 'W/"v0"')
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options(resume = True))
+    server.shutdown()
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT
+    assert server.requests == [f"bytes={len(CONTENT) // 2}-{len(CONTENT) - 1}", None]
+
+
+@pytest.mark.parametrize("headers,resumable", [
+    ({"ETag": ETAG}, True),
+    ({"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}, True),
+    ({"ETag": 'W/"v1"'}, False),
+    ({}, False),
+    ({"ETag": ETAG, "Content-Encoding": "gzip"}, False),
+])
+def test_can_resume(headers, resumable):
+    response = requests.Response()
+    response.headers.update(headers)
+    assert journal.can_resume(response) == resumable
+
+
+def test_download_files_reuses_completed_files(tmp_path):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/{name}.mp3", ext = "mp3", title = name, expected_status_code = 200)
+        for name in ["part1", "part2", "missing"]
+    ]
+    output_dir = os.path.join(tmp_path, "book")
+    os.makedirs(output_dir)
+    with pytest.raises(DownloadError):
+        download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options())
+    assert manifest.has_manifest(output_dir)
+    # Second run only downloads the file that failed
+    server.requests.clear()
+    audiobook.files[2].url = f"{url}/part3.mp3"
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options())
+    server.shutdown()
+    assert server.requests == [None]
+    assert not manifest.has_manifest(output_dir)
+    for filepath in filepaths:
+        with open(filepath, "rb") as f:
+            assert f.read() == CONTENT
+
+
+def test_interrupted_download_keeps_completed_files(tmp_path, monkeypatch):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.metadata.title = "book"
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/{name}.mp3", ext = "mp3", title = name, expected_status_code = 200)
+        for name in ["part1", "missing"]
+    ]
+    output_dir = os.path.join(tmp_path, "book")
+    os.makedirs(output_dir)
+    with pytest.raises(DownloadError):
+        download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options())
+    server.shutdown()
+    open(os.path.join(output_dir, "missing.mp3.tmp"), "wb").close()
+    def interrupt(*args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(download, "download_audiobook", interrupt)
+    download.download(audiobook, create_options(output_template = str(tmp_path / "{title}"), remove_chars = ""))
+    assert manifest.has_manifest(output_dir)
+    assert sorted(os.listdir(output_dir)) == sorted([manifest.MANIFEST_FILENAME, "part1.mp3"])
+
+
+def test_connections_are_reused(tmp_path):
+    class TestSource(Source):
+        names = ["Test"]
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    source = TestSource(create_options(database_directory = str(tmp_path), skip_downloaded = False, connections = 4))
+    audiobook = create_audiobook(server)
+    audiobook.session = source._session
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/part{i}.mp3", ext = "mp3", title = f"part{i}")
+        for i in range(12)
+    ]
+    download.download_files(audiobook, str(tmp_path), progress.ProgressTracker(12), create_options(connections = 4))
+    server.shutdown()
+    requests_count, connections_count = utils.connection_stats(audiobook.session)["127.0.0.1"]
+    # A HEAD request to find the size of each file and a GET to download it
+    assert requests_count == 24
+    assert connections_count <= 4
+
+
+@pytest.mark.parametrize("engine", ["thread", "async"])
+def test_download_files_engines(tmp_path, engine):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.session.headers["X-Test"] = "1"
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/part{i}.mp3", ext = "mp3", title = f"part{i}", expected_status_code = 200)
+        for i in range(8)
+    ]
+    output_dir = os.path.join(tmp_path, "book")
+    os.makedirs(output_dir)
+    tracker = progress.ProgressTracker(len(audiobook.files))
+    filepaths = download.download_files(audiobook, output_dir, tracker, create_options(engine = engine))
+    server.shutdown()
+    assert len(server.requests) == 8
+    assert tracker.downloaded() == 8 * len(CONTENT)
+    for filepath in filepaths:
+        with open(filepath, "rb") as f:
+            assert f.read() == CONTENT
+
+
+def test_download_stream(tmp_path):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/segment{i}.ts", ext = "ts", segment = True)
+        for i in range(10)
+    ]
+    options = create_options(combine = True, connections = 2)
+    assert download.can_assemble_stream(audiobook, options)
+    output_dir = os.path.join(tmp_path, "book")
+    filepath = download.download_stream(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), options)
+    server.shutdown()
+    assert os.listdir(tmp_path) == ["book.ts"]
+    with open(filepath, "rb") as f:
+        assert f.read() == CONTENT * 10
+
+
+def test_resumed_stream_is_downloaded_with_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(download.logging, "quiet_mode", True)
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/segment{i}.ts", ext = "ts", title = f"segment{i}", segment = True, expected_status_code = 200)
+        for i in range(4)
+    ]
+    audiobook.files[2].url = f"{url}/missing.ts"
+    options = create_options(combine = True, resume = True, progress_json = False)
+    assert not download.can_assemble_stream(audiobook, options)
+    output_dir = os.path.join(tmp_path, "book")
+    with pytest.raises(DownloadError):
+        download.download_files_with_cli_output(audiobook, output_dir, options)
+    # Finished segments are kept and only the failed segment is downloaded again
+    audiobook.files[2].url = f"{url}/segment2.ts"
+    server.requests.clear()
+    filepaths = download.download_files_with_cli_output(audiobook, output_dir, options)
+    server.shutdown()
+    assert server.requests == [None]
+    assert len(filepaths) == 4
+
+
+def test_async_engine_downloads_stream_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(download.logging, "quiet_mode", True)
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/segment{i}.ts", ext = "ts", title = f"segment{i}", segment = True)
+        for i in range(4)
+    ]
+    options = create_options(combine = True, engine = "async", progress_json = False)
+    assert not download.can_assemble_stream(audiobook, options)
+    monkeypatch.setattr(download, "download_stream", lambda *args: pytest.fail("Segments were assembled with threads"))
+    filepaths = download.download_files_with_cli_output(audiobook, os.path.join(tmp_path, "book"), options)
+    server.shutdown()
+    assert len(filepaths) == 4
+
+
+def test_async_engine_is_not_used_for_byte_ranges(tmp_path, monkeypatch):
+    messages = []
+    monkeypatch.setattr(download.logging, "log", messages.append)
+    monkeypatch.setattr(download.logging, "quiet_mode", True)
+    server = start_server()
+    audiobook = create_audiobook(server)
+    url = audiobook.files[0].url
+    audiobook.files = [
+        AudiobookFile(url = url, ext = "mp3", segment = True, byte_range = (0, 999)),
+        AudiobookFile(url = url, ext = "mp3", segment = True, byte_range = (5000, 5999)),
+    ]
+    options = create_options(engine = "async", progress_json = False)
+    assert download.can_assemble_stream(audiobook, options)
+    filepaths = download.download_files_with_cli_output(audiobook, os.path.join(tmp_path, "book"), options)
+    server.shutdown()
+    assert len(filepaths) == 1
+    assert any("async engine" in message for message in messages)
+
+
+def test_download_stream_failed_segment(tmp_path):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/segment{i}.ts", ext = "ts", segment = True, expected_status_code = 200)
+        for i in range(5)
+    ]
+    audiobook.files[3].url = f"{url}/missing.ts"
+    output_dir = os.path.join(tmp_path, "book")
+    with pytest.raises(DownloadError):
+        download.download_stream(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options(combine = True))
+    server.shutdown()
+    assert os.listdir(tmp_path) == []
+
+
+def test_plan_segment_requests():
+    def segment(url: str, start: int, end: int) -> AudiobookFile:
+        return AudiobookFile(url = url, ext = "ts", segment = True, byte_range = (start, end))
+    files = [
+        segment("a", 0, 99),
+        segment("a", 100, 199),
+        segment("a", 200, 299),
+        segment("b", 300, 399),
+        segment("b", 500, 599),
+        AudiobookFile(url = "c", ext = "ts", segment = True),
+    ]
+    assert download.plan_segment_requests(files, 1000) == [[0, 1, 2], [3], [4], [5]]
+    assert download.plan_segment_requests(files, 200) == [[0, 1], [2], [3], [4], [5]]
+
+
+def test_download_stream_byte_ranges(tmp_path):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}/book.ts"
+    audiobook = create_audiobook(server)
+    part_size = len(CONTENT) // 8
+    audiobook.files = [
+        AudiobookFile(url = url, ext = "ts", segment = True, byte_range = (start, start + part_size - 1))
+        for start in range(0, len(CONTENT), part_size)
+    ]
+    options = create_options(combine = True, coalesce_size = part_size * 4)
+    output_dir = os.path.join(tmp_path, "book")
+    filepath = download.download_stream(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), options)
+    server.shutdown()
+    assert len(server.requests) == 2
+    with open(filepath, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_byte_ranges_of_one_file_are_assembled_without_combine(tmp_path, monkeypatch):
+    # Selecting chapters 1 and 3 of a single mp3 file gives two byte ranges
+    monkeypatch.setattr(download.logging, "quiet_mode", True)
+    server = start_server()
+    audiobook = create_audiobook(server)
+    url = audiobook.files[0].url
+    audiobook.files = [
+        AudiobookFile(url = url, ext = "mp3", segment = True, byte_range = (0, 999)),
+        AudiobookFile(url = url, ext = "mp3", segment = True, byte_range = (5000, 5999)),
+    ]
+    options = create_options(progress_json = False)
+    assert download.can_assemble_stream(audiobook, options)
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files_with_cli_output(audiobook, output_dir, options)
+    server.shutdown()
+    assert filepaths == [f"{output_dir}.mp3"]
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT[0:1000] + CONTENT[5000:6000]
+
+
+def test_bitrate_is_written_to_json_metadata(tmp_path):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    server.shutdown()
+    audiobook.files[0].bitrate = 64000
+    download.set_bitrate_metadata(audiobook)
+    filepath = str(tmp_path / "book.ogg")
+    options = create_options(write_json_metadata = True, no_chapters = True)
+    download.add_metadata_to_file(audiobook, filepath, options)
+    with open(f"{filepath}.json") as f:
+        assert json.load(f)["bitrate"] == 64000
+
+
+def test_interrupted_stream_conversion_is_cleaned_up(tmp_path, monkeypatch):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    server.shutdown()
+    audiobook.files = [AudiobookFile(url = f"{url}/segment{i}.ts", ext = "ts", segment = True) for i in range(3)]
+    def interrupt(*args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(download, "download_audiobook", interrupt)
+    options = create_options(stream_convert = True, output_template = str(tmp_path / "{title}"), remove_chars = "")
+    # The output directory is never created when segments are piped into ffmpeg
+    download.download(audiobook, options)
+    assert os.listdir(tmp_path) == []
+
+
+def test_single_file_is_only_probed_for_stream_conversion(tmp_path, monkeypatch):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    probes = []
+    monkeypatch.setattr(download.postprocess, "plan_stream_processing", lambda *args: None)
+    monkeypatch.setattr(download, "stream_segments", lambda *args: probes.append(args))
+    monkeypatch.setattr(download, "download_files_with_cli_output", lambda *args: [])
+    monkeypatch.setattr(download, "get_output_audio_format", lambda *args: ("mp3", "mp3"))
+    monkeypatch.setattr(download, "add_metadata_to_dir", lambda *args: None)
+    options = create_options(skip_downloaded = False, stream_convert = True, output_format = None)
+    download.download_audiobook(audiobook, str(tmp_path / "book"), options)
+    server.shutdown()
+    assert probes == []
+
+
+def test_failed_responses_release_connections(tmp_path):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    # Sessions of sources block when all pooled connections are in use
+    audiobook.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=2, pool_block=True))
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/missing{i}.mp3", ext = "mp3", title = f"missing{i}", expected_status_code = 200)
+        for i in range(2)
+    ] + [
+        AudiobookFile(url = f"{url}/file{i}.mp3", ext = "mp3", title = f"file{i}")
+        for i in range(2)
+    ]
+    output_dir = os.path.join(tmp_path, "book")
+    os.makedirs(output_dir)
+    errors = []
+    def run():
+        try:
+            download.download_files(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), create_options(connections = 2, retries = 1))
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout = 20)
+    server.shutdown()
+    assert not thread.is_alive()
+    assert isinstance(errors[0], DownloadError)
+
+
+@pytest.mark.parametrize("hedge", [False, True])
+def test_failed_attempt_is_removed_from_progress(tmp_path, monkeypatch, hedge):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    read_response = download.read_response
+    calls = []
+    def fail_first_attempt(response, attempt = None):
+        calls.append(response)
+        if len(calls) == 1:
+            readinto = response.raw.readinto
+            def fail_after_first_chunk(buffer):
+                if attempt.bytes:
+                    raise DownloadStalled
+                return readinto(buffer)
+            response.raw.readinto = fail_after_first_chunk
+        return read_response(response, attempt)
+    def download_hedged(self, function, discarded = None):
+        # Both attempts finish reading before either result is recorded
+        barrier = threading.Barrier(2)
+        def finish_together(attempt):
+            result = function(attempt)
+            barrier.wait()
+            return result
+        file_download = watchdog.FileDownload(finish_together, discarded)
+        attempts = [file_download.start_attempt(hedge = hedge) for hedge in (False, True)]
+        threads = [threading.Thread(target=file_download.run, args=(attempt,)) for attempt in attempts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return file_download.wait()
+    if hedge:
+        monkeypatch.setattr(watchdog.DownloadWatchdog, "download", download_hedged)
+    else:
+        monkeypatch.setattr(download, "read_response", fail_first_attempt)
+    tracker = progress.ProgressTracker(len(audiobook.files))
+    output_dir = os.path.join(tmp_path, "book")
+    download.download_files(audiobook, output_dir, tracker, create_options(retries = 1))
+    server.shutdown()
+    assert len(server.requests) == 2
+    assert tracker.downloaded() == len(CONTENT)
+    assert tracker.snapshot().completed == len(CONTENT)
+
+
+class NoRangeRequestHandler(BaseHTTPRequestHandler):
+    """Ignores byte ranges and sends the start of `CONTENT` without finishing it"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(10 * len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(CONTENT)
+        self.server.finished.wait()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_stream_segments_without_range_support(monkeypatch):
+    monkeypatch.setattr(download.chapters, "PROBE_TIMEOUT", 2)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), NoRangeRequestHandler)
+    server.finished = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    audiobook = create_audiobook(server)
+    # The probe doesn't read the full response, so it returns without a timeout
+    stream_audiobook = download.stream_segments(audiobook, create_options())
+    server.finished.set()
+    server.shutdown()
+    assert stream_audiobook is None
+
+
+def test_stream_segments_splits_single_file():
+    server = start_server()
+    audiobook = create_audiobook(server)
+    stream_audiobook = download.stream_segments(audiobook, create_options(coalesce_size = 2 * 1024 * 1024))
+    server.shutdown()
+    assert stream_audiobook is not None
+    assert len(audiobook.files) == 1
+    assert [file.byte_range for file in stream_audiobook.files] == [
+        (0, 2 * 1024 * 1024 - 1),
+        (2 * 1024 * 1024, 4 * 1024 * 1024 - 1),
+        (4 * 1024 * 1024, len(CONTENT) - 1),
+    ]
+    assert all(file.segment for file in stream_audiobook.files)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_download_stream_converts_while_downloading(tmp_path, monkeypatch):
+    content = subprocess.run(
+        ["ffmpeg", "-f", "lavfi", "-i", "sine=duration=3", "-f", "mp3", "-"],
+        capture_output = True,
+        check = True,
+    ).stdout
+    monkeypatch.setitem(globals(), "CONTENT", content)
+    server = start_server()
+    audiobook = create_audiobook(server)
+    options = create_options(output_format = "m4a", no_chapters = False, coalesce_size = 4096, connections = 4)
+    output_dir = os.path.join(tmp_path, "book")
+    stream_audiobook = download.stream_segments(audiobook, options)
+    plan = postprocess.plan_stream_processing(audiobook, output_dir, options)
+    assert stream_audiobook is not None and plan is not None
+    filepath = download.download_stream(stream_audiobook, output_dir, progress.ProgressTracker(len(stream_audiobook.files)), options, stream_plan = plan)
+    server.shutdown()
+    assert os.listdir(tmp_path) == ["book.m4a"]
+    probe = subprocess.run(["ffmpeg", "-i", filepath], capture_output = True, text = True)
+    assert "Audio: aac" in probe.stderr
+    duration = re.search(r"Duration: 00:00:(\d+\.\d+)", probe.stderr).group(1)
+    assert abs(float(duration) - 3) < 0.2
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_download_stream_conversion_failed_segment(tmp_path):
+    server = start_server()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = create_audiobook(server)
+    audiobook.files = [
+        AudiobookFile(url = f"{url}/segment{i}.ts", ext = "ts", segment = True, expected_status_code = 200)
+        for i in range(5)
+    ]
+    audiobook.files[3].url = f"{url}/missing.ts"
+    options = create_options(output_format = "m4a", no_chapters = True)
+    output_dir = os.path.join(tmp_path, "book")
+    plan = postprocess.plan_stream_processing(audiobook, output_dir, options)
+    with pytest.raises(DownloadError):
+        download.download_stream(audiobook, output_dir, progress.ProgressTracker(len(audiobook.files)), options, stream_plan = plan)
+    server.shutdown()
+    assert os.listdir(tmp_path) == []
+
+
+def test_required_space_includes_post_processing(tmp_path):
+    audiobook = Audiobook(
+        session = requests.Session(),
+        metadata = AudiobookMetadata("test"),
+        files = [AudiobookFile(url = f"part{i}.mp3", ext = "mp3") for i in range(4)],
+    )
+    plan = planner.DownloadPlan("book", [planner.PlannedFile(i, f"part{i}.mp3", "mp3", 1000) for i in range(4)])
+    output_dir = str(tmp_path / "book")
+    options = create_options(output_format = None, no_chapters = False)
+    assert download.required_space(audiobook, plan, output_dir, options) == 4000
+    options.output_format = "m4b"
+    # Each file is converted on its own
+    assert download.required_space(audiobook, plan, output_dir, options) == 5000
+    options.combine = True
+    assert download.required_space(audiobook, plan, output_dir, options) == 4000 + download.COMBINE_SCRATCH_COPIES * 4000
+    # Files from an earlier run are already on disk
+    os.makedirs(output_dir)
+    with open(os.path.join(output_dir, "part0.mp3"), "wb") as f:
+        f.write(bytes(1000))
+    assert download.required_space(audiobook, plan, output_dir, options) == 3000 + download.COMBINE_SCRATCH_COPIES * 4000
+
+
+def test_preallocate_fails_when_disk_is_full(tmp_path, monkeypatch):
+    def posix_fallocate(fd, offset, size):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(os, "posix_fallocate", posix_fallocate)
+    with open(tmp_path / "file", "wb") as f:
+        with pytest.raises(NotEnoughSpace):
+            download.preallocate(f, 1000)
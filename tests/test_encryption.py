@@ -0,0 +1,44 @@
+from audiobookdl.output import encryption
+
+import os
+import random
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+KEY = bytes(range(16))
+IV = bytes(range(16, 32))
+PLAINTEXT = os.urandom(1024 * 100 + 7)
+
+
+def encrypt(data: bytes) -> bytes:
+    return AES.new(KEY, AES.MODE_CBC, IV).encrypt(pad(data, AES.block_size))
+
+
+def test_stream_decryptor_with_uneven_chunks():
+    ciphertext = encrypt(PLAINTEXT)
+    decryptor = encryption.AESStreamDecryptor(KEY, IV, unpad = True)
+    result = b""
+    position = 0
+    while position < len(ciphertext):
+        size = random.randint(1, 5000)
+        result += decryptor.update(ciphertext[position:position+size])
+        position += size
+    result += decryptor.finalize()
+    assert result == PLAINTEXT
+
+
+def test_stream_decryptor_without_unpad():
+    ciphertext = encrypt(PLAINTEXT)
+    decryptor = encryption.AESStreamDecryptor(KEY, IV)
+    result = decryptor.update(ciphertext) + decryptor.finalize()
+    assert result == pad(PLAINTEXT, AES.block_size)
+
+
+def test_decrypt_file_in_place(tmp_path, monkeypatch):
+    monkeypatch.setattr(encryption, "DECRYPTION_BUFFER_SIZE", 1000)
+    path = os.path.join(tmp_path, "file")
+    with open(path, "wb") as f:
+        f.write(encrypt(PLAINTEXT))
+    encryption.decrypt_file_aes(path, KEY, IV, unpad = True)
+    with open(path, "rb") as f:
+        assert f.read() == PLAINTEXT
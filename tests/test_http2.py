@@ -0,0 +1,53 @@
+from audiobookdl.output import download, progress
+from audiobookdl.utils import connection_stats
+from test_download import CONTENT, start_server, create_audiobook, create_options
+
+import os
+import ssl
+import pytest
+import requests
+
+httpx = pytest.importorskip("httpx")
+from audiobookdl.utils import http2
+
+
+def create_adapter() -> http2.HTTP2Adapter:
+    return http2.HTTP2Adapter(ssl.create_default_context(), 4)
+
+
+def test_adapter_response(tmp_path):
+    server = start_server()
+    audiobook = create_audiobook(server)
+    audiobook.session.mount("http://", create_adapter())
+    url = audiobook.files[0].url
+    response = audiobook.session.get(url, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 10-19/{len(CONTENT)}"
+    assert response.content == CONTENT[10:20]
+    output_dir = os.path.join(tmp_path, "book")
+    filepaths = download.download_files(audiobook, output_dir, progress.ProgressTracker(1), create_options())
+    server.shutdown()
+    with open(filepaths[0], "rb") as f:
+        assert f.read() == CONTENT
+    requests_count, _ = connection_stats(audiobook.session)["127.0.0.1"]
+    assert requests_count == 2
+
+
+def test_connection_errors_are_converted():
+    session = create_audiobook(start_server()).session
+    session.mount("http://", create_adapter())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get("http://127.0.0.1:1/")
+
+
+def test_proxied_requests_use_http1():
+    server = start_server()
+    session = create_audiobook(server).session
+    adapter = create_adapter()
+    session.mount("http://", adapter)
+    # The test server answers requests for absolute urls like a proxy
+    proxy = f"http://127.0.0.1:{server.server_port}"
+    response = session.get("http://audiobook.invalid/book.mp3", proxies={"http": proxy})
+    server.shutdown()
+    assert response.content == CONTENT
+    assert adapter.host_stats == {}
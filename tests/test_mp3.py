@@ -0,0 +1,77 @@
+from audiobookdl.output.output import combine_audiofiles, combine_mp3_files
+from audiobookdl.utils import mp3
+
+import pytest
+from mutagen.id3 import ID3
+from mutagen.mp3 import MP3
+
+# MPEG 1 layer III frames at 44.1 kHz
+FRAME_128K = b"\xff\xfb\x90\x00" + bytes(413)
+FRAME_64K = b"\xff\xfb\x50\x00" + bytes(204)
+ID3V2_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x64" + bytes(100)
+ID3V1_TAG = b"TAG" + bytes(125)
+
+
+def write_file(path, content: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_read_audio_skips_tags(tmp_path):
+    path = write_file(tmp_path / "part.mp3", ID3V2_TAG + FRAME_128K * 10 + ID3V1_TAG)
+    audio = mp3.read_audio(path)
+    assert (audio.start, audio.end) == (len(ID3V2_TAG), len(ID3V2_TAG) + 10 * len(FRAME_128K))
+    assert audio.frames == 10
+    assert not audio.vbr
+
+
+def test_read_audio_with_xing_header(tmp_path):
+    header = mp3.parse_frame_header(FRAME_128K)
+    xing = mp3.create_xing_frame(header, 1000, 0, list(range(100)), vbr = True)
+    path = write_file(tmp_path / "part.mp3", xing + FRAME_128K * 10)
+    audio = mp3.read_audio(path)
+    assert audio.start == len(xing)
+    # The frame count is read from the header instead of counting frames
+    assert audio.frames == 1000
+    assert audio.vbr
+    assert audio.toc == list(range(100))
+
+
+def test_combine_mp3_files(tmp_path):
+    filepaths = [
+        write_file(tmp_path / "part1.mp3", ID3V2_TAG + FRAME_128K * 100 + ID3V1_TAG),
+        write_file(tmp_path / "part2.mp3", FRAME_64K * 50),
+    ]
+    output_path = str(tmp_path / "book.mp3")
+    combine_mp3_files(filepaths, output_path)
+    audio = mp3.read_audio(output_path)
+    assert audio.frames == 150
+    assert audio.vbr
+    with open(output_path, "rb") as f:
+        f.seek(audio.start)
+        assert f.read() == FRAME_128K * 100 + FRAME_64K * 50
+    length = 150 * 1152 / 44100
+    assert MP3(output_path).info.length == pytest.approx(length, abs = 0.01)
+    assert ID3(output_path)["TLEN"].text == [str(round(length * 1000))]
+
+
+def test_combine_mp3_files_with_different_sample_rates(tmp_path):
+    # MPEG 1 layer III frame at 48 kHz
+    frame_48k = b"\xff\xfb\x94\x00" + bytes(380)
+    filepaths = [
+        write_file(tmp_path / "part1.mp3", FRAME_128K * 10),
+        write_file(tmp_path / "part2.mp3", frame_48k * 10),
+    ]
+    with pytest.raises(ValueError):
+        combine_mp3_files(filepaths, str(tmp_path / "book.mp3"))
+
+
+def test_combine_audiofiles_without_ffmpeg(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", "")
+    tmp_dir = tmp_path / "book"
+    tmp_dir.mkdir()
+    filepaths = [write_file(tmp_dir / f"part{i}.mp3", FRAME_128K * 10) for i in range(3)]
+    combine_audiofiles(filepaths, str(tmp_dir), str(tmp_path / "book.mp3"))
+    assert mp3.read_audio(str(tmp_path / "book.mp3")).frames == 30
+    assert not tmp_dir.exists()
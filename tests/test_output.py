@@ -1,7 +1,14 @@
 from audiobookdl import AudiobookMetadata
-from audiobookdl.output.output import gen_output_location
+from audiobookdl.exceptions import FailedConversion
+from audiobookdl.output import output
+from audiobookdl.output.output import combine_audiofiles, gen_output_location, quote_concat_path
 from audiobookdl.output.download import get_output_audio_format
 
+import re
+import shutil
+import pytest
+import subprocess
+
 TEST_DATA = [
     {
         "template": "{author} - {title}",
@@ -28,3 +35,75 @@ def test_gen_output_audio_format_with_option():
 
 def test_gen_output_audio_format_without_option():
     assert get_output_audio_format(None, ["file1.mp3","file2.mp3","file3.mp3"]) == ("mp3", "mp3")
+
+
+def test_quote_concat_path():
+    assert quote_concat_path("/books/it's here.mp3") == "'/books/it'\\''s here.mp3'"
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+@pytest.mark.parametrize("extension", ["mp3", "m4a"])
+def test_combine_audiofiles(tmp_path, extension):
+    tmp_dir = tmp_path / "book"
+    tmp_dir.mkdir()
+    filepaths = []
+    for i in range(3):
+        filepath = str(tmp_dir / f"part '{i}'.{extension}")
+        subprocess.run(
+            ["ffmpeg", "-f", "lavfi", "-i", "sine=duration=1", filepath],
+            capture_output = True,
+            check = True,
+        )
+        filepaths.append(filepath)
+    output_path = str(tmp_path / f"book.{extension}")
+    combine_audiofiles(filepaths, str(tmp_dir), output_path)
+    assert not tmp_dir.exists()
+    probe = subprocess.run(["ffmpeg", "-i", output_path], capture_output = True, text = True)
+    duration = re.search(r"Duration: 00:00:(\d+\.\d+)", probe.stderr).group(1)
+    assert abs(float(duration) - 3) < 0.2
+
+
+def test_conversion_workers(monkeypatch):
+    monkeypatch.setattr(output.os, "cpu_count", lambda: 32)
+    monkeypatch.setattr(output, "available_memory", lambda: None)
+    assert output.conversion_workers(60) == 32
+    assert output.conversion_workers(3) == 3
+    monkeypatch.setattr(output, "available_memory", lambda: 4 * output.CONVERSION_MEMORY)
+    assert output.conversion_workers(60) == 4
+    monkeypatch.setattr(output, "available_memory", lambda: 0)
+    assert output.conversion_workers(60) == 1
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_convert_output_isolates_failures(tmp_path):
+    filepaths = []
+    for i in range(4):
+        filepath = str(tmp_path / f"{i}.mp3")
+        subprocess.run(
+            ["ffmpeg", "-f", "lavfi", "-i", "sine=duration=1", filepath],
+            capture_output = True,
+            check = True,
+        )
+        filepaths.append(filepath)
+    with open(filepaths[2], "wb") as f:
+        f.write(b"not audio")
+    converted = []
+    with pytest.raises(FailedConversion) as error:
+        output.convert_output(filepaths, "m4a", converted.append)
+    assert "2.mp3" in error.value.data["files"]
+    assert sorted(converted) == [str(tmp_path / f"{i}.m4a") for i in (0, 1, 3)]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0.m4a", "1.m4a", "2.mp3", "3.m4a"]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_convert_output_keeps_order(tmp_path):
+    filepaths = []
+    for i in range(3):
+        filepath = str(tmp_path / f"{i}.mp3")
+        subprocess.run(
+            ["ffmpeg", "-f", "lavfi", "-i", f"sine=duration={3 - i}", filepath],
+            capture_output = True,
+            check = True,
+        )
+        filepaths.append(filepath)
+    assert output.convert_output(filepaths, "m4a") == [str(tmp_path / f"{i}.m4a") for i in range(3)]
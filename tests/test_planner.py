@@ -0,0 +1,74 @@
+from audiobookdl import Audiobook, AudiobookFile, AudiobookMetadata
+from audiobookdl.exceptions import NotEnoughSpace
+from audiobookdl.output import planner
+
+import json
+import pytest
+import threading
+import requests
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SIZES = {"/small.mp3": 100, "/large.mp3": 5000, "/medium.mp3": 1000}
+
+
+class SizeHandler(BaseHTTPRequestHandler):
+    """Serves files of `SIZES`. HEAD requests are only supported for `/large.mp3`"""
+
+    def do_HEAD(self):
+        if self.path != "/large.mp3":
+            self.send_response(403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(SIZES[self.path]))
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path not in SIZES:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes 0-0/{SIZES[self.path]}")
+        self.send_header("Content-Length", "1")
+        self.end_headers()
+        self.wfile.write(b"\0")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_create_plan(tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SizeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    audiobook = Audiobook(
+        session = requests.Session(),
+        metadata = AudiobookMetadata("test"),
+        files = [
+            AudiobookFile(url = f"{url}/small.mp3", ext = "mp3"),
+            AudiobookFile(url = f"{url}/missing.mp3", ext = "mp3"),
+            AudiobookFile(url = f"{url}/large.mp3", ext = "mp3"),
+            AudiobookFile(url = f"{url}/medium.mp3", ext = "mp3"),
+            AudiobookFile(url = f"{url}/segments.ts", ext = "ts", byte_range = (0, 1999)),
+        ]
+    )
+    plan = planner.create_plan(audiobook, str(tmp_path / "book"), Namespace(retries = 0, connections = 4))
+    server.shutdown()
+    assert [file.size for file in plan.files] == [100, None, 5000, 1000, 2000]
+    # The file with unknown size is assumed to have the average size
+    assert plan.total_size == 8100 + 2025
+    assert plan.order == [2, 1, 4, 3, 0]
+    assert plan.free_space > 0
+    assert json.loads(plan.as_json())["order"] == plan.order
+
+
+def test_check_free_space():
+    plan = planner.DownloadPlan("book", [planner.PlannedFile(0, "url", "mp3", 1000)], free_space = 1500)
+    planner.check_free_space(plan, 1500)
+    planner.check_free_space(plan, None)
+    with pytest.raises(NotEnoughSpace):
+        planner.check_free_space(plan, 1501)
@@ -0,0 +1,101 @@
+from audiobookdl import Audiobook, AudiobookFile, AudiobookMetadata, Chapter, Cover
+from audiobookdl.output import postprocess
+
+import shutil
+import pytest
+import requests
+import subprocess
+from argparse import Namespace
+from mutagen.mp4 import MP4
+
+
+def create_options(**kwargs) -> Namespace:
+    options = {"combine": True, "no_chapters": False, **kwargs}
+    return Namespace(**options)
+
+
+def create_audiobook(files: int = 3, cover: bool = True) -> Audiobook:
+    return Audiobook(
+        session = requests.Session(),
+        metadata = AudiobookMetadata("Book"),
+        files = [AudiobookFile(url=f"https://example.com/{i}.m4a", ext="m4a", duration=1000) for i in range(files)],
+        chapters = [Chapter(0, "First"), Chapter(1500, "Second")],
+        cover = Cover(b"image", "png") if cover else None,
+    )
+
+
+def test_create_ffmetadata():
+    chapters = [Chapter(0, "First"), Chapter(1500, "Second")]
+    result = postprocess.create_ffmetadata(chapters, 3000.4)
+    assert result.startswith(";FFMETADATA1\n")
+    assert "START=1500" in result
+    assert "END=3000" in result
+
+
+def test_no_plan_without_combine(monkeypatch):
+    monkeypatch.setattr(postprocess, "program_in_path", lambda _: True)
+    audiobook = create_audiobook()
+    filepaths = ["book/0.m4a", "book/1.m4a", "book/2.m4a"]
+    plan = postprocess.plan_post_processing(audiobook, filepaths, "book", "m4a", "m4b", create_options(combine=False))
+    assert plan is None
+
+
+def test_no_plan_for_mp3_combine(monkeypatch):
+    # Mp3 files are combined natively and chapters are written to the ID3 tag
+    monkeypatch.setattr(postprocess, "program_in_path", lambda _: True)
+    audiobook = create_audiobook()
+    filepaths = ["book/0.mp3", "book/1.mp3", "book/2.mp3"]
+    plan = postprocess.plan_post_processing(audiobook, filepaths, "book", "mp3", "mp3", create_options())
+    assert plan is None
+
+
+def test_plan_command(monkeypatch):
+    monkeypatch.setattr(postprocess, "program_in_path", lambda _: True)
+    audiobook = create_audiobook()
+    filepaths = ["book/0.m4a", "book/1.m4a", "book/2.m4a"]
+    plan = postprocess.plan_post_processing(audiobook, filepaths, "book", "m4a", "m4b", create_options())
+    assert plan is not None
+    assert plan.output_path == "book.m4b"
+    assert plan.copy_codec
+    assert plan.duration == 3000
+    command = plan.command("list.txt", "chapters.txt", "cover.png", "book.tmp.m4b")
+    assert command[command.index("-f")+1:command.index("-f")+6] == ["concat", "-safe", "0", "-i", "list.txt"]
+    assert command[command.index("-map_chapters")+1] == "1"
+    assert "2:v" in command
+    assert command[-1] == "book.tmp.m4b"
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_run_post_processing(tmp_path, monkeypatch):
+    tmp_dir = tmp_path / "book"
+    tmp_dir.mkdir()
+    filepaths = []
+    for i in range(3):
+        filepath = str(tmp_dir / f"{i}.m4a")
+        subprocess.run(
+            ["ffmpeg", "-f", "lavfi", "-i", "sine=duration=1", filepath],
+            capture_output = True,
+            check = True,
+        )
+        filepaths.append(filepath)
+    cover = subprocess.run(
+        ["ffmpeg", "-f", "lavfi", "-i", "color=size=16x16", "-frames:v", "1", "-f", "image2pipe", "-c:v", "png", "-"],
+        capture_output = True,
+        check = True,
+    ).stdout
+    audiobook = create_audiobook()
+    audiobook.cover = Cover(cover, "png")
+    plan = postprocess.plan_post_processing(audiobook, filepaths, str(tmp_dir), "m4a", "m4b", create_options())
+    assert plan is not None
+    runs = []
+    run = subprocess.run
+    monkeypatch.setattr(postprocess.subprocess, "run", lambda *args, **kwargs: runs.append(args) or run(*args, **kwargs))
+    output_path = postprocess.run_post_processing(plan)
+    assert len(runs) == 1
+    assert output_path == str(tmp_path / "book.m4b")
+    assert not tmp_dir.exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["book.m4b"]
+    audio = MP4(output_path)
+    assert [chapter.title for chapter in audio.chapters] == ["First", "Second"]
+    assert abs(audio.chapters[1].start - 1.5) < 0.05
+    assert "covr" in audio
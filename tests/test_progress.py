@@ -0,0 +1,56 @@
+from audiobookdl.output import progress
+
+import threading
+
+
+def test_tracker_sums_counters_from_all_threads():
+    tracker = progress.ProgressTracker(2)
+    tracker.start_file(0, 4000)
+    tracker.start_file(1, 4000, resumed = 1000)
+    def add(index: int):
+        for _ in range(100):
+            tracker.add_bytes(index, 10)
+    threads = [threading.Thread(target=add, args=(i % 2,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = tracker.snapshot(speed = 1000)
+    assert tracker.downloaded() == 4000
+    assert snapshot.completed == 5000
+    assert snapshot.total == 8000
+    assert snapshot.eta == 3
+    assert snapshot.files[1].downloaded == 2000
+
+
+def test_estimate_total_size_with_unknown_sizes():
+    files = [
+        progress.FileProgress(size = 100),
+        progress.FileProgress(size = 300),
+        progress.FileProgress(),
+    ]
+    assert progress.estimate_total_size(files) == 600
+    assert progress.estimate_total_size([progress.FileProgress()]) is None
+
+
+def test_renderer_reports_final_snapshot():
+    tracker = progress.ProgressTracker(1)
+    snapshots = []
+    with progress.ProgressRenderer(tracker, [snapshots.append], interval = 10):
+        tracker.start_file(0, None)
+        tracker.add_bytes(0, 50)
+        tracker.finish_file(0)
+    assert snapshots[-1].completed == 50
+    assert snapshots[-1].total == 50
+    assert snapshots[-1].finished_files == 1
+
+
+def test_tracker_removes_bytes_of_failed_attempt():
+    tracker = progress.ProgressTracker(1)
+    tracker.start_file(0, 1000)
+    tracker.add_bytes(0, 600)
+    tracker.remove_bytes(0, 600)
+    tracker.add_bytes(0, 1000)
+    snapshot = tracker.snapshot()
+    assert tracker.downloaded() == 1000
+    assert snapshot.completed == snapshot.total == 1000
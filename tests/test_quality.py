@@ -0,0 +1,30 @@
+from audiobookdl.utils.quality import Quality, parse_quality, select_variant
+
+import pytest
+
+
+def test_parse_quality():
+    assert parse_quality("best") == Quality("best")
+    assert parse_quality("WORST") == Quality("worst")
+    assert parse_quality("<=128k") == Quality("max", 128000)
+    assert parse_quality("<= 1.5M") == Quality("max", 1500000)
+    with pytest.raises(ValueError):
+        parse_quality("128k")
+
+
+VARIANTS = ["medium", "low", "high"]
+BITRATES = [96000, 64000, 256000]
+
+
+def test_select_best_and_worst():
+    assert select_variant(VARIANTS, BITRATES, Quality("best")) == "high"
+    assert select_variant(VARIANTS, BITRATES, Quality("worst")) == "low"
+
+
+def test_select_max_bitrate():
+    assert select_variant(VARIANTS, BITRATES, Quality("max", 128000)) == "medium"
+    assert select_variant(VARIANTS, BITRATES, Quality("max", 96000)) == "medium"
+
+
+def test_select_max_bitrate_below_all_variants():
+    assert select_variant(VARIANTS, BITRATES, Quality("max", 32000)) == "low"
@@ -0,0 +1,51 @@
+from audiobookdl.utils import ratelimit
+
+import time
+import pytest
+
+
+def test_parse_size():
+    assert ratelimit.parse_size("500") == 500
+    assert ratelimit.parse_size("20M") == 20 * 1024**2
+    assert ratelimit.parse_size("1.5k") == 1536
+    assert ratelimit.parse_size("2GiB") == 2 * 1024**3
+    assert ratelimit.parse_size(1000) == 1000
+    with pytest.raises(ValueError):
+        ratelimit.parse_size("fast")
+
+
+def test_unlimited_bucket_does_not_wait():
+    bucket = ratelimit.TokenBucket()
+    start = time.monotonic()
+    bucket.consume(10**12)
+    assert time.monotonic() - start < 0.1
+
+
+def test_bucket_limits_rate():
+    bucket = ratelimit.TokenBucket(rate = 100_000, burst = 10_000)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.consume(10_000)
+    # 40 KB with an empty bucket at 100 KB/s
+    assert 0.35 <= time.monotonic() - start < 1
+
+
+def test_burst_is_allowed_after_idle():
+    bucket = ratelimit.TokenBucket(rate = 100_000, burst = 50_000)
+    time.sleep(0.5)
+    start = time.monotonic()
+    bucket.consume(50_000)
+    assert time.monotonic() - start < 0.1
+
+
+def test_rate_can_be_removed():
+    bucket = ratelimit.TokenBucket(rate = 1000)
+    bucket.set_rate(None)
+    start = time.monotonic()
+    bucket.consume(10**6)
+    assert time.monotonic() - start < 0.1
+
+
+def test_reserve_returns_delay():
+    bucket = ratelimit.TokenBucket(rate = 1000, burst = 1000)
+    assert bucket.reserve(500) == pytest.approx(0.5, abs = 0.05)
@@ -0,0 +1,64 @@
+from audiobookdl.utils import retry
+from audiobookdl.exceptions import DownloadError
+
+import pytest
+import requests
+
+POLICY = retry.RetryPolicy(retries = 2, backoff = 0)
+
+
+def flaky(errors: list):
+    """Create function that raises the given errors before succeeding"""
+    def function():
+        if errors:
+            raise errors.pop(0)
+        return "done"
+    return function
+
+
+def test_retries_connection_errors():
+    function = flaky([requests.exceptions.ConnectionError(), requests.exceptions.ReadTimeout()])
+    assert POLICY.call(function) == "done"
+
+
+def test_gives_up_after_max_retries():
+    function = flaky([requests.exceptions.ConnectionError()] * 3)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        POLICY.call(function)
+
+
+def test_does_not_retry_non_idempotent_after_connection_error():
+    function = flaky([requests.exceptions.ConnectionError()])
+    with pytest.raises(requests.exceptions.ConnectionError):
+        POLICY.call(function, idempotent = False)
+
+
+def test_retries_temporary_download_errors():
+    function = flaky([DownloadError(status_code = 503, retry_after = "0")])
+    assert POLICY.call(function) == "done"
+
+
+def test_does_not_retry_permanent_download_errors():
+    function = flaky([DownloadError(status_code = 404)])
+    with pytest.raises(DownloadError):
+        POLICY.call(function)
+
+
+def test_classify_status():
+    assert retry.classify_status(502, None, idempotent = True) == ("status 502", None)
+    assert retry.classify_status(502, None, idempotent = False) is None
+    assert retry.classify_status(429, "5", idempotent = False) == ("status 429", 5)
+    assert retry.classify_status(403, None, idempotent = True) is None
+
+
+def test_parse_retry_after():
+    assert retry.parse_retry_after("120") == 120
+    assert retry.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert retry.parse_retry_after("soon") is None
+
+
+def test_delay_respects_retry_after():
+    policy = retry.RetryPolicy(backoff = 1)
+    assert 0.5 <= policy.delay(1, None) <= 1
+    assert policy.delay(1, 10) == 10
+    assert policy.delay(1, 1000) == retry.MAX_RETRY_AFTER
@@ -0,0 +1,80 @@
+from audiobookdl.output import watchdog
+from audiobookdl.exceptions import DownloadStalled
+
+import threading
+import pytest
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert watchdog.percentile(values, 50) == 50
+    assert watchdog.percentile(values, 99) == 99
+    assert watchdog.percentile([3.0], 95) == 3
+
+
+def test_hedged_attempt_wins():
+    release = threading.Event()
+    cancelled = []
+
+    def slow_or_fast(attempt: watchdog.DownloadAttempt) -> str:
+        if attempt.hedge:
+            return "hedge"
+        release.wait(5)
+        try:
+            attempt.check()
+        except watchdog.DownloadCancelled:
+            cancelled.append(attempt)
+            raise
+        return "primary"
+
+    download = watchdog.FileDownload(slow_or_fast)
+    primary = download.start_attempt(hedge = False)
+    hedge = download.start_attempt(hedge = True)
+    thread = threading.Thread(target=download.run, args=(primary,))
+    thread.start()
+    download.run(hedge)
+    assert download.wait() == "hedge"
+    release.set()
+    thread.join()
+    assert cancelled == [primary]
+
+
+def test_no_attempts_after_finish():
+    download = watchdog.FileDownload(lambda attempt: "file")
+    download.run(download.start_attempt(hedge = False))
+    assert download.start_attempt(hedge = True) is None
+
+
+def test_slow_attempt_is_stalled():
+    attempt = watchdog.DownloadAttempt(hedge = False)
+    attempt.bytes = 10
+    attempt.check_throughput(attempt.start + watchdog.STALL_WINDOW)
+    with pytest.raises(DownloadStalled):
+        attempt.check()
+
+
+def test_fast_attempt_is_not_stalled():
+    attempt = watchdog.DownloadAttempt(hedge = False)
+    attempt.bytes = int(watchdog.MIN_THROUGHPUT * watchdog.STALL_WINDOW * 2)
+    attempt.check_throughput(attempt.start + watchdog.STALL_WINDOW)
+    attempt.check()
+
+
+def test_throttled_attempt_is_not_stalled():
+    attempt = watchdog.DownloadAttempt(hedge = False)
+    attempt.bytes = 10
+    attempt.throttled = watchdog.STALL_WINDOW
+    attempt.check_throughput(attempt.start + watchdog.STALL_WINDOW)
+    attempt.check()
+    # Only time waiting for the rate limit in the current window is ignored
+    attempt.check_throughput(attempt.start + 2 * watchdog.STALL_WINDOW)
+    with pytest.raises(DownloadStalled):
+        attempt.check()
+
+
+def test_hedge_threshold_needs_samples():
+    dog = watchdog.DownloadWatchdog(95)
+    dog.durations = [1.0] * (watchdog.MIN_HEDGE_SAMPLES - 1)
+    assert dog.hedge_threshold() is None
+    dog.durations.append(2.0)
+    assert dog.hedge_threshold() == 2.0